@@ -1,4 +1,97 @@
-from django.contrib import admin
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib import admin, messages
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.translation import ugettext_lazy as _
+
+from getpaid import reconcile
+
+ESTIMATED_COUNT_LIMIT = 10000
+
+
+def estimate_table_rows(model, using):
+    """
+    Returns number of rows of ``model`` table estimated from database statistics, or ``None``
+    if the database does not provide it.
+    """
+    connection = connections[using]
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+    elif connection.vendor == 'mysql':
+        sql = 'SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s'
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [model._meta.db_table])
+        row = cursor.fetchone()
+    return int(row[0]) if row and row[0] is not None else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator which does not count all rows of big tables. Unfiltered lists are counted from
+    database statistics (PostgreSQL and MySQL); other ones are counted up to ``count_limit`` rows,
+    so pages beyond the limit are not linked.
+    """
+    count_limit = ESTIMATED_COUNT_LIMIT
+
+    @property
+    def count(self):
+        if getattr(self, '_estimated_count', None) is None:
+            self._estimated_count = self.get_count()
+        return self._estimated_count
+
+    def get_count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_table_rows(queryset.model, queryset.db)
+            if estimate is not None and estimate > self.count_limit:
+                return estimate
+        return queryset.order_by()[:self.count_limit].count()
+
+
+class BackendListFilter(admin.SimpleListFilter):
+    """
+    Offers enabled backends instead of reading distinct values of the whole table.
+    """
+    title = _("backend")
+    parameter_name = 'backend'
+
+    def lookups(self, request, model_admin):
+        return [(backend, backend) for backend in getattr(settings, 'GETPAID_BACKENDS', [])]
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(backend=self.value())
+        return queryset
+
+
+class CreatedOnListFilter(admin.SimpleListFilter):
+    """
+    Filters by ranges of ``created_on`` index; unlike ``date_hierarchy`` it does not read distinct
+    dates of the whole table.
+    """
+    title = _("created on")
+    parameter_name = 'created'
+    ranges = (
+        ('1', _("Past 24 hours"), timedelta(days=1)),
+        ('7', _("Past 7 days"), timedelta(days=7)),
+        ('30', _("Past 30 days"), timedelta(days=30)),
+        ('365', _("Past year"), timedelta(days=365)),
+    )
+
+    def lookups(self, request, model_admin):
+        return [(value, name) for value, name, delta in self.ranges]
+
+    def queryset(self, request, queryset):
+        for value, name, delta in self.ranges:
+            if self.value() == value:
+                return queryset.filter(created_on__gte=timezone.now() - delta)
+        return queryset
 
 
 class PaymentAdmin(admin.ModelAdmin):
@@ -6,7 +99,37 @@ class PaymentAdmin(admin.ModelAdmin):
         Use it in your app.
     """
 
-    list_display = ('id', 'amount', 'currency', 'status', 'created_on', 'paid_on', 'amount_paid')
-    list_filter = ('status', 'created_on', 'paid_on')
-    search_fields = ('id', )
+    list_display = ('id', 'amount', 'currency', 'status', 'backend', 'external_id', 'created_on', 'paid_on',
+                    'amount_paid')
+    list_filter = ('status', BackendListFilter, CreatedOnListFilter)
+    list_select_related = ('order', )
+    search_fields = ('external_id', )
     raw_id_fields = ('order', )
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    actions = ['recheck_status']
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Looks payments up by exact id or external id; external ids are looked up for every enabled
+        backend to use ``(backend, external_id)`` index.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        lookup = Q(backend__in=getattr(settings, 'GETPAID_BACKENDS', []), external_id=search_term)
+        if search_term.isdigit():
+            lookup |= Q(pk=int(search_term))
+        return queryset.filter(lookup), False
+
+    def recheck_status(self, request, queryset):
+        backends = reconcile.get_reconcilable_backends()
+        payments = queryset.filter(backend__in=backends)
+        skipped = queryset.exclude(backend__in=backends).count()
+        summary = reconcile.Reconciler().run(payments.iterator())
+        if str(summary):
+            self.message_user(request, _("Statuses re-checked: %s") % summary)
+        if skipped:
+            self.message_user(request, _("%d payments skipped, their backends cannot check status") % skipped,
+                              messages.WARNING)
+    recheck_status.short_description = _("Re-check status with gateway")
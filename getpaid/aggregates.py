@@ -0,0 +1,185 @@
+# coding: utf8
+"""
+Daily payment totals maintained incrementally.
+
+``getpaid.PaymentDailyAggregate`` keeps number, amount and amount paid of
+payments created on given day, by backend, currency and current status.
+A created payment is added to its bucket and every status change moves it to
+another one, so revenue and conversion questions are answered from a few rows
+regardless of the size of ``Payment`` table::
+
+    aggregates.get_totals(date(2015, 1, 1), date(2015, 1, 31), group_by=['backend'], status='paid')
+    aggregates.get_conversion_rate(date(2015, 1, 1), date(2015, 1, 31), backend='getpaid.backends.payu')
+
+Archived payments remain counted. Payments changed without ``Payment.change_status``
+or ``PaymentQuerySet.transition`` (e.g. with ``PaymentQuerySet.change_status`` or
+``update()``) are not followed;
+totals can be rebuilt from payments with ``getpaid_rebuild_aggregates`` management
+command, which is also needed after enabling them for existing payments.
+
+Totals are kept only if ``GETPAID_DAILY_AGGREGATES`` is ``True``: they add
+statements on shared per-day rows to every payment creation and status change.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from getpaid.export import day_start, iter_rows
+
+DEFAULT_CHUNK_SIZE = 1000
+BUCKET_FIELDS = ('day', 'backend', 'currency', 'status')
+
+
+def is_enabled():
+    return getattr(settings, 'GETPAID_DAILY_AGGREGATES', False)
+
+
+def get_day(created_on):
+    """
+    Returns day of ``created_on`` in the default time zone (``TIME_ZONE``), not the one activated for
+    a request, so a payment always stays in the same bucket.
+    """
+    if timezone.is_aware(created_on):
+        created_on = timezone.localtime(created_on, timezone.get_default_timezone())
+    return created_on.date()
+
+
+def add(day, backend, currency, status, count=1, amount=0, amount_paid=0):
+    """
+    Adds given values (which can be negative) to the bucket with a single ``UPDATE``,
+    the bucket is created if it does not exist.
+    """
+    PaymentDailyAggregate = apps.get_model('getpaid', 'PaymentDailyAggregate')
+    bucket = dict(day=day, backend=backend, currency=currency, status=status)
+    queryset = PaymentDailyAggregate.objects.filter(**bucket)
+    changes = dict(count=F('count') + count, amount=F('amount') + amount, amount_paid=F('amount_paid') + amount_paid)
+    if queryset.update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            PaymentDailyAggregate.objects.create(count=count, amount=amount, amount_paid=amount_paid, **bucket)
+    except IntegrityError:
+        # created meanwhile by a concurrent payment
+        queryset.update(**changes)
+
+
+def payment_saved(sender, instance, created, raw=False, **kwargs):
+    """
+    ``post_save`` receiver of ``Payment`` adding new payments to their buckets.
+    """
+    if created and not raw and is_enabled():
+        add(get_day(instance.created_on), instance.backend, instance.currency, instance.status,
+            amount=instance.amount, amount_paid=instance.amount_paid)
+
+
+def status_changed(payment, old_status, old_amount_paid):
+    """
+    Moves ``payment`` from the bucket of its old status to the bucket of the current one.
+    Called by ``Payment.transition``.
+    """
+    if not is_enabled():
+        return
+    day = get_day(payment.created_on)
+    add(day, payment.backend, payment.currency, old_status, -1, -payment.amount, -old_amount_paid)
+    add(day, payment.backend, payment.currency, payment.status, 1, payment.amount, payment.amount_paid)
+
+
+def statuses_changed(payments, old_statuses, old_amounts_paid):
+    """
+    Moves ``payments`` changed together from buckets of their old statuses to buckets of their
+    current ones, with one update per bucket; ``old_statuses`` and ``old_amounts_paid`` are dicts
+    by payment pk. Called by ``PaymentQuerySet.transition``.
+    """
+    if not is_enabled():
+        return
+    changes = defaultdict(lambda: [0, 0, 0])
+    for payment in payments:
+        day = get_day(payment.created_on)
+        old = changes[(day, payment.backend, payment.currency, old_statuses[payment.pk])]
+        new = changes[(day, payment.backend, payment.currency, payment.status)]
+        old[0] -= 1
+        old[1] -= payment.amount
+        old[2] -= old_amounts_paid[payment.pk]
+        new[0] += 1
+        new[1] += payment.amount
+        new[2] += payment.amount_paid
+    for (day, backend, currency, status), (count, amount, amount_paid) in sorted(changes.items()):
+        add(day, backend, currency, status, count, amount, amount_paid)
+
+
+def filter_days(queryset, day_from=None, day_to=None):
+    if day_from:
+        queryset = queryset.filter(day__gte=day_from)
+    if day_to:
+        queryset = queryset.filter(day__lte=day_to)
+    return queryset
+
+
+def get_totals(day_from=None, day_to=None, group_by=(), **filters):
+    """
+    Returns ``{'count': ..., 'amount': ..., 'amount_paid': ...}`` of payments created between
+    ``day_from`` and ``day_to`` (both inclusive) matching ``filters`` (e.g. ``status='paid'``).
+    With ``group_by`` (names of bucket fields) returns list of such dicts with the grouping values.
+    """
+    PaymentDailyAggregate = apps.get_model('getpaid', 'PaymentDailyAggregate')
+    queryset = filter_days(PaymentDailyAggregate.objects.filter(**filters), day_from, day_to)
+    sums = dict(total_count=Sum('count'), total_amount=Sum('amount'), total_amount_paid=Sum('amount_paid'))
+    if not group_by:
+        return _rename_totals(queryset.aggregate(**sums))
+    rows = queryset.order_by(*group_by).values(*group_by).annotate(**sums)
+    return [_rename_totals(row) for row in rows]
+
+
+def _rename_totals(row):
+    totals = dict((name, value) for name, value in row.items() if not name.startswith('total_'))
+    totals['count'] = row['total_count'] or 0
+    totals['amount'] = row['total_amount'] or Decimal('0')
+    totals['amount_paid'] = row['total_amount_paid'] or Decimal('0')
+    return totals
+
+
+def get_conversion_rate(day_from=None, day_to=None, **filters):
+    """
+    Returns fraction of payments created between ``day_from`` and ``day_to`` matching ``filters``
+    which were paid, or ``None`` if there are no such payments.
+    """
+    total = get_totals(day_from, day_to, **filters)['count']
+    if not total:
+        return None
+    filters['status'] = 'paid'
+    return float(get_totals(day_from, day_to, **filters)['count']) / total
+
+
+def rebuild(day_from=None, day_to=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Replaces buckets between ``day_from`` and ``day_to`` (both inclusive) with totals computed from
+    live and archived payments. Returns number of buckets.
+    """
+    PaymentDailyAggregate = apps.get_model('getpaid', 'PaymentDailyAggregate')
+    fields = ('id', 'created_on', 'backend', 'currency', 'status', 'amount', 'amount_paid')
+    totals = defaultdict(lambda: [0, Decimal('0'), Decimal('0')])
+    with transaction.atomic():
+        for model_name in ('Payment', 'ArchivedPayment'):
+            queryset = apps.get_model('getpaid', model_name)._default_manager.all()
+            if day_from:
+                queryset = queryset.filter(created_on__gte=day_start(day_from))
+            if day_to:
+                queryset = queryset.filter(created_on__lt=day_start(day_to + timedelta(days=1)))
+            for pk, created_on, backend, currency, status, amount, amount_paid in iter_rows(queryset, fields,
+                                                                                             chunk_size):
+                bucket = totals[(get_day(created_on), backend, currency, status)]
+                bucket[0] += 1
+                bucket[1] += amount
+                bucket[2] += amount_paid
+        filter_days(PaymentDailyAggregate.objects.all(), day_from, day_to).delete()
+        PaymentDailyAggregate.objects.bulk_create([
+            PaymentDailyAggregate(count=count, amount=amount, amount_paid=amount_paid, **dict(zip(BUCKET_FIELDS, key)))
+            for key, (count, amount, amount_paid) in totals.items()
+        ], batch_size=chunk_size)
+    return len(totals)
@@ -1,7 +1,21 @@
-from django.apps import AppConfig
+from django.apps import AppConfig, apps
+from django.db.models.signals import post_delete, post_save
 
 
 class Config(AppConfig):
     name = 'getpaid'
     verbose_name = 'application getpaid'
     label = 'getpaid'
+
+    def ready(self):
+        from . import checks  # noqa - registers system checks
+        from .utils import build_backend_configs, clear_url_cache, get_backends_registry
+        build_backend_configs()
+        try:
+            get_backends_registry()
+        except (ImportError, AttributeError):
+            # Reported by getpaid.E001 system check
+            pass
+        if apps.is_installed('django.contrib.sites'):
+            post_save.connect(clear_url_cache, sender='sites.Site', dispatch_uid='getpaid-clear-url-cache')
+            post_delete.connect(clear_url_cache, sender='sites.Site', dispatch_uid='getpaid-clear-url-cache')
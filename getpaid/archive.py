@@ -0,0 +1,141 @@
+# coding: utf8
+"""
+Archiving of old payments in terminal states.
+
+Payments which are ``paid``, ``failed`` or ``cancelled`` for a long time are
+moved from ``Payment`` table to ``ArchivedPayment`` table (built by
+``register_to_payment`` from the same ``PaymentFactory``, so it keeps the same
+columns and primary keys). Payments are moved in chunks, each in its own
+transaction, so archiving can be interrupted and started again at any time::
+
+    for moved, last_pk in archive_payments(older_than=timedelta(days=365)):
+        ...
+
+Archived payments are not processed any more (e.g. late gateway notifications
+are ignored), but can be read together with live ones::
+
+    Payment.objects.with_archived().filter(order=order)
+
+Events of archived payments stay in ``PaymentEvent`` table. Payments still
+referenced by other rows (models of backends or of the project with a foreign
+key to ``Payment``) are not archived, as deleting them would delete or change
+those rows too.
+"""
+from datetime import timedelta
+from itertools import chain
+import logging
+
+from django.apps import apps
+from django.core.exceptions import MultipleObjectsReturned
+from django.db import models, transaction
+from django.utils import timezone
+
+logger = logging.getLogger('getpaid.archive')
+
+TERMINAL_STATUSES = ('paid', 'failed', 'cancelled')
+DEFAULT_OLDER_THAN = timedelta(days=365)
+DEFAULT_CHUNK_SIZE = 500
+
+
+class CombinedQuerySet(object):
+    """
+    Read-only view of payments in both live and archive tables. Supports filtering, iteration,
+    ``count()``, ``exists()`` and ``get()``; live payments come first.
+    """
+
+    def __init__(self, querysets):
+        self.querysets = querysets
+
+    def filter(self, *args, **kwargs):
+        return CombinedQuerySet([queryset.filter(*args, **kwargs) for queryset in self.querysets])
+
+    def exclude(self, *args, **kwargs):
+        return CombinedQuerySet([queryset.exclude(*args, **kwargs) for queryset in self.querysets])
+
+    def __iter__(self):
+        return chain(*self.querysets)
+
+    def count(self):
+        return sum(queryset.count() for queryset in self.querysets)
+
+    def exists(self):
+        return any(queryset.exists() for queryset in self.querysets)
+
+    def get(self, *args, **kwargs):
+        found = list(chain(*[queryset.filter(*args, **kwargs)[:2] for queryset in self.querysets]))
+        if not found:
+            raise self.querysets[0].model.DoesNotExist('Payment matching query does not exist.')
+        if len(found) > 1:
+            raise MultipleObjectsReturned('get() returned more than one payment')
+        return found[0]
+
+
+def get_related_fields(model):
+    """
+    Returns foreign keys to ``model`` which deleting its rows would cascade to (all but ``DO_NOTHING``).
+    """
+    try:
+        relations = [field for field in model._meta.get_fields(include_hidden=True)
+                     if field.auto_created and not field.concrete and (field.one_to_many or field.one_to_one)]
+    except AttributeError:  # django 1.7
+        relations = model._meta.get_all_related_objects(include_hidden=True)
+    return [relation.field for relation in relations if relation.field.rel.on_delete is not models.DO_NOTHING]
+
+
+def get_referenced_pks(pks):
+    """
+    Returns set of primary keys from ``pks`` of payments referenced by rows of other models.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    referenced = set()
+    for field in get_related_fields(Payment):
+        referenced.update(field.model._base_manager.filter(**{'%s__in' % field.name: pks})
+                          .values_list(field.attname, flat=True).distinct())
+    return referenced
+
+
+def archive_chunk(pks, statuses=TERMINAL_STATUSES):
+    """
+    Moves payments with given primary keys to the archive in one transaction. Payments which status
+    changed meanwhile or which are referenced by other rows are left alone. Returns number of moved
+    payments.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    ArchivedPayment = apps.get_model('getpaid', 'ArchivedPayment')
+    fields = [field.attname for field in Payment._meta.concrete_fields]
+    pk_name = Payment._meta.pk.attname
+    with transaction.atomic():
+        rows = list(Payment.lean.select_for_update().filter(pk__in=pks, status__in=statuses)
+                    .order_by().values(*fields))
+        referenced = get_referenced_pks([row[pk_name] for row in rows]) if rows else set()
+        if referenced:
+            logger.warning('Not archiving payments referenced by other rows: %s',
+                           ', '.join(str(pk) for pk in sorted(referenced)))
+            rows = [row for row in rows if row[pk_name] not in referenced]
+        if not rows:
+            return 0
+        archived_on = timezone.now()
+        ArchivedPayment.objects.bulk_create([ArchivedPayment(archived_on=archived_on, **row) for row in rows])
+        Payment.objects.filter(pk__in=[row[pk_name] for row in rows]).delete()
+    return len(rows)
+
+
+def archive_payments(older_than=DEFAULT_OLDER_THAN, statuses=TERMINAL_STATUSES, chunk_size=DEFAULT_CHUNK_SIZE,
+                     start_after=0, dry_run=False):
+    """
+    Moves payments in ``statuses`` created before ``older_than`` to the archive, ``chunk_size`` payments
+    per transaction, in primary key order starting after ``start_after``. Yields ``(moved, last_pk)``
+    after each chunk.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    queryset = Payment.objects.filter(status__in=statuses, created_on__lt=timezone.now() - older_than)\
+        .order_by('pk').values_list('pk', flat=True)
+    last_pk = start_after
+    while True:
+        pks = list(queryset.filter(pk__gt=last_pk)[:chunk_size])
+        if not pks:
+            return
+        last_pk = pks[-1]
+        moved = len(set(pks) - get_referenced_pks(pks)) if dry_run else archive_chunk(pks, statuses)
+        logger.info('Archived %d payments up to pk=%s', moved, last_pk)
+        yield moved, last_pk
@@ -1,9 +1,6 @@
-from django.conf import settings
-from django.core.exceptions import ImproperlyConfigured
-from django.template.base import Template
 from django.template.context import Context
 from django.utils import six
-from getpaid.utils import get_backend_settings
+from getpaid.utils import get_backend_config, get_order_description_func, get_order_description_template
 
 
 class PaymentProcessorBase(object):
@@ -34,6 +31,15 @@ class PaymentProcessorBase(object):
     """
     A path in static root where payment logo could be find.
     """
+    BACKEND_REQUIRED_SETTINGS = tuple()
+    """
+    Names of settings that have to be provided in ``GETPAID_BACKENDS_SETTINGS`` for this backend. Missing ones are
+    reported by ``getpaid`` system checks.
+    """
+    BACKEND_DEFAULT_SETTINGS = {}
+    """
+    Default values of optional backend settings.
+    """
 
     def __init__(self, payment):
 
@@ -52,12 +58,16 @@ class PaymentProcessorBase(object):
 
     def get_order_description(self, payment, order):
         """
-        Renders order description using django template provided in ``settings.GETPAID_ORDER_DESCRIPTION``
-        or if not provided return unicode representation of ``Order object``.
+        Returns order description built by ``settings.GETPAID_ORDER_DESCRIPTION_FUNC`` callable, rendered using
+        django template provided in ``settings.GETPAID_ORDER_DESCRIPTION`` or if none of them is provided returns
+        unicode representation of ``Order object``.
         """
-        template = getattr(settings, 'GETPAID_ORDER_DESCRIPTION', None)
-        if template:
-            return Template(template).render(Context({"payment": payment, "order": order}))
+        func = get_order_description_func()
+        if func is not None:
+            return func(payment=payment, order=order)
+        template = get_order_description_template()
+        if template is not None:
+            return template.render(Context({"payment": payment, "order": order}))
         else:
             return six.text_type(order)
 
@@ -70,6 +80,40 @@ class PaymentProcessorBase(object):
         """
         raise NotImplementedError('Must be implemented in PaymentProcessor')
 
+    def fetch_status(self):
+        """
+        Should ask the gateway for current status of ``self.payment`` and return a tuple ``(status, amount_paid)``
+        (``amount_paid`` can be ``None`` meaning the whole amount) or ``None`` if the gateway has no final status yet.
+        It must not change the payment nor use the database, as it is called from ``getpaid.reconcile`` worker
+        threads. Backends that cannot query a payment status do not implement it.
+        """
+        raise NotImplementedError('Must be implemented in PaymentProcessor')
+
+    @staticmethod
+    def apply_notification(params):
+        """
+        Should apply an already validated gateway notification (a JSON serializable dict) to its payment and
+        return the response content for the gateway. Backends which accept notifications into ``getpaid.spool``
+        implement it, it is called again by the spool drainer so it must not depend on the request.
+        """
+        raise NotImplementedError('Must be implemented in PaymentProcessor')
+
+    @classmethod
+    def can_fetch_status(cls):
+        return six.get_unbound_function(cls.fetch_status) is not \
+            six.get_unbound_function(PaymentProcessorBase.fetch_status)
+
+    def apply_status(self, status, amount_paid=None):
+        """
+        Updates ``self.payment`` with a status returned by ``fetch_status()``.
+        """
+        if status in ('paid', 'partially_paid'):
+            self.payment.on_success(amount_paid)
+        elif status == 'failed':
+            self.payment.on_failure()
+        else:
+            self.payment.change_status(status)
+
     def get_form(self, post_data):
         """
         Only used if the payment processor requires POST requests.
@@ -78,6 +122,14 @@ class PaymentProcessorBase(object):
         from getpaid.forms import PaymentHiddenInputsPostForm
         return PaymentHiddenInputsPostForm(items=post_data)
 
+    @classmethod
+    def get_backend_config(cls):
+        """
+        Returns read-only ``getpaid.utils.BackendConfig`` snapshot of backend settings. Settings are
+        available as attributes, e.g. ``cls.get_backend_config().pos_id``.
+        """
+        return get_backend_config(cls.BACKEND)
+
     @classmethod
     def get_backend_setting(cls, name, default=None):
         """
@@ -86,11 +138,7 @@ class PaymentProcessorBase(object):
         If `default` value is omitted, raises ``ImproperlyConfigured`` when
         setting ``name`` is not available.
         """
-        backend_settings = get_backend_settings(cls.BACKEND)
+        config = cls.get_backend_config()
         if default is not None:
-            return backend_settings.get(name, default)
-        else:
-            try:
-                return backend_settings[name]
-            except KeyError:
-                raise ImproperlyConfigured("getpaid '%s' requires backend '%s' setting" % (cls.BACKEND, name))
+            return config.get(name, default)
+        return getattr(config, name)
@@ -5,12 +5,11 @@ import logging
 from django.utils import six
 from six.moves.urllib.parse import urlencode
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
 from django.utils.timezone import utc
 from django.utils.translation import ugettext_lazy as _
-from getpaid import signals
+from getpaid import dedup, events, signals, spool
 from getpaid.backends import PaymentProcessorBase
-from getpaid.utils import get_domain
+from getpaid.utils import build_absolute_uri
 
 logger = logging.getLogger('getpaid.backends.dotpay')
 
@@ -28,12 +27,25 @@ class PaymentProcessor(PaymentProcessorBase):
     BACKEND_NAME = _('Dotpay')
     BACKEND_ACCEPTED_CURRENCY = ('PLN', 'EUR', 'USD', 'GBP', 'JPY', 'CZK', 'SEK')
     BACKEND_LOGO_URL = 'getpaid/backends/dotpay/dotpay_logo.png'
+    BACKEND_REQUIRED_SETTINGS = ('id', 'PIN')
 
     _ALLOWED_IP = ('195.150.9.37',)
     _ACCEPTED_LANGS = ('pl', 'en', 'de', 'it', 'fr', 'es', 'cz', 'ru', 'bg')
     _GATEWAY_URL = 'https://ssl.dotpay.eu/'
     _ONLINE_SIG_FIELDS = ('id', 'control', 't_id', 'amount', 'email', 'service', 'code', 'username', 'password', 't_status')
 
+    BACKEND_DEFAULT_SETTINGS = {
+        'allowed_ip': _ALLOWED_IP,
+        'force_ssl': False,
+        'lang': None,
+        'onlinetransfer': False,
+        'p_email': None,
+        'p_info': None,
+        'tax': False,
+        'gateway_url': _GATEWAY_URL,
+        'method': 'get',
+    }
+
     @staticmethod
     def compute_sig(params, fields, PIN):
         text = PIN + ":" + (u":".join(map(lambda field: params.get(field, ''), fields)))
@@ -42,13 +54,14 @@ class PaymentProcessor(PaymentProcessorBase):
     @staticmethod
     def online(params, ip):
 
-        allowed_ip = PaymentProcessor.get_backend_setting('allowed_ip', PaymentProcessor._ALLOWED_IP)
+        config = PaymentProcessor.get_backend_config()
+        allowed_ip = config.allowed_ip
 
         if len(allowed_ip) != 0 and ip not in allowed_ip:
             logger.warning('Got message from not allowed IP %s' % str(allowed_ip))
             return 'IP ERR'
 
-        PIN = PaymentProcessor.get_backend_setting('PIN', '')
+        PIN = six.text_type(config.PIN)
 
         if params['md5'] != PaymentProcessor.compute_sig(params, PaymentProcessor._ONLINE_SIG_FIELDS, PIN):
             logger.warning('Got message with wrong sig, %s' % str(params))
@@ -58,12 +71,19 @@ class PaymentProcessor(PaymentProcessorBase):
             params['id'] = int(params['id'])
         except ValueError:
             return u'ID ERR'
-        if params['id'] != int(PaymentProcessor.get_backend_setting('id')):
+        if params['id'] != int(config.id):
             return u'ID ERR'
 
+        if spool.is_enabled():
+            spool.append(PaymentProcessor.BACKEND, params)
+            return u'OK'
+        return PaymentProcessor.apply_notification(params)
+
+    @staticmethod
+    def apply_notification(params):
         from getpaid.models import Payment
         try:
-            payment = Payment.objects.get(pk=int(params['control']))
+            payment = Payment.lean.get(pk=int(params['control']))
         except (ValueError, Payment.DoesNotExist):
             logger.error('Got message for non existing Payment, %s' % str(params))
             return u'PAYMENT ERR'
@@ -74,42 +94,42 @@ class PaymentProcessor(PaymentProcessorBase):
             logger.error('Got message with wrong currency, %s' % str(params))
             return u'CURRENCY ERR'
 
-        payment.external_id = params.get('t_id', '')
-        payment.description = params.get('email', '')
-
-        if int(params['t_status']) == DotpayTransactionStatus.FINISHED:
-            payment.amount_paid = Decimal(amount)
-            payment.paid_on = datetime.datetime.utcnow().replace(tzinfo=utc)
-            if payment.amount <= Decimal(amount):
-                # Amount is correct or it is overpaid
-                payment.change_status('paid')
-            else:
-                payment.change_status('partially_paid')
-        elif int(params['t_status']) in [DotpayTransactionStatus.REJECTED, DotpayTransactionStatus.RECLAMATION, DotpayTransactionStatus.REFUNDED]:
-            payment.change_status('failed')
+        events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
+        with dedup.notification_guard(PaymentProcessor.BACKEND, params.get('t_id', ''), params['t_status'],
+                                      params['control'], amount) as duplicate:
+            if duplicate:
+                return u'OK'
+
+            fields = {'external_id': params.get('t_id', ''), 'description': params.get('email', '')}
+
+            if int(params['t_status']) == DotpayTransactionStatus.FINISHED:
+                fields['amount_paid'] = Decimal(amount)
+                fields['paid_on'] = datetime.datetime.utcnow().replace(tzinfo=utc)
+                if payment.amount <= Decimal(amount):
+                    # Amount is correct or it is overpaid
+                    payment.change_status('paid', **fields)
+                else:
+                    payment.change_status('partially_paid', **fields)
+            elif int(params['t_status']) in [DotpayTransactionStatus.REJECTED, DotpayTransactionStatus.RECLAMATION, DotpayTransactionStatus.REFUNDED]:
+                payment.change_status('failed', **fields)
 
         return u'OK'
 
     def get_URLC(self):
-        urlc = reverse('getpaid-dotpay-online')
-        if PaymentProcessor.get_backend_setting('force_ssl', False):
-            return u'https://%s%s' % (get_domain(), urlc)
-        else:
-            return u'http://%s%s' % (get_domain(), urlc)
+        scheme = 'https' if self.get_backend_config().force_ssl else 'http'
+        return build_absolute_uri('getpaid-dotpay-online', scheme=scheme)
 
     def get_URL(self, pk):
-        url = reverse('getpaid-dotpay-return', kwargs={'pk': pk})
-        if PaymentProcessor.get_backend_setting('force_ssl', False):
-            return u'https://%s%s' % (get_domain(), url)
-        else:
-            return u'http://%s%s' % (get_domain(), url)
+        scheme = 'https' if self.get_backend_config().force_ssl else 'http'
+        return build_absolute_uri('getpaid-dotpay-return', scheme=scheme, reverse_kwargs={'pk': pk})
 
     def get_gateway_url(self, request):
         """
         Routes a payment to Gateway, should return URL for redirection.
         """
+        config = self.get_backend_config()
         params = {
-            'id': PaymentProcessor.get_backend_setting('id'),
+            'id': config.id,
             'description': self.get_order_description(self.payment, self.payment.order),
             'amount': self.payment.amount,
             'currency': self.payment.currency,
@@ -130,24 +150,24 @@ class PaymentProcessor(PaymentProcessorBase):
 
         if user_data['lang'] and user_data['lang'].lower() in PaymentProcessor._ACCEPTED_LANGS:
             params['lang'] = user_data['lang'].lower()
-        elif PaymentProcessor.get_backend_setting('lang', False) and \
-                PaymentProcessor.get_backend_setting('lang').lower() in PaymentProcessor._ACCEPTED_LANGS:
-            params['lang'] = PaymentProcessor.get_backend_setting('lang').lower()
+        elif config.lang and config.lang.lower() in PaymentProcessor._ACCEPTED_LANGS:
+            params['lang'] = config.lang.lower()
 
-        if PaymentProcessor.get_backend_setting('onlinetransfer', False):
+        if config.onlinetransfer:
             params['onlinetransfer'] = 1
-        if PaymentProcessor.get_backend_setting('p_email', False):
-            params['p_email'] = PaymentProcessor.get_backend_setting('p_email')
-        if PaymentProcessor.get_backend_setting('p_info', False):
-            params['p_info'] = PaymentProcessor.get_backend_setting('p_info')
-        if PaymentProcessor.get_backend_setting('tax', False):
+        if config.p_email:
+            params['p_email'] = config.p_email
+        if config.p_info:
+            params['p_info'] = config.p_info
+        if config.tax:
             params['tax'] = 1
 
-        gateway_url = PaymentProcessor.get_backend_setting('gateway_url', self._GATEWAY_URL)
+        gateway_url = config.gateway_url
+        method = config.method.lower()
 
-        if PaymentProcessor.get_backend_setting('method', 'get').lower() == 'post':
+        if method == 'post':
             return gateway_url, 'POST', params
-        elif PaymentProcessor.get_backend_setting('method', 'get').lower() == 'get':
+        elif method == 'get':
             for key in params.keys():
                 params[key] = six.text_type(params[key]).encode('utf-8')
             return gateway_url + '?' + urlencode(params), "GET", {}
@@ -5,6 +5,7 @@ from django.views.generic.base import View
 from django.views.generic.detail import DetailView
 from getpaid.backends.dotpay import PaymentProcessor
 from getpaid.models import Payment
+from getpaid.replicas import ReadReplicaMixin
 
 logger = logging.getLogger('getpaid.backends.dotpay')
 
@@ -46,7 +47,7 @@ class OnlineView(View):
         return HttpResponse(status)
 
 
-class ReturnView(DetailView):
+class ReturnView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend success or failure link.
     """
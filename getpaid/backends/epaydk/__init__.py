@@ -20,7 +20,7 @@ except ImportError:
 
 from getpaid.backends import PaymentProcessorBase
 from getpaid.utils import build_absolute_uri
-from getpaid import signals
+from getpaid import dedup, events, signals
 
 
 if six.PY3:
@@ -45,6 +45,12 @@ class PaymentProcessor(PaymentProcessorBase):
         '/logo/301.jpg?21-06-2015-16'
     BACKEND_GATEWAY_BASE_URL = u'https://ssl.ditonlinebetalingssystem.dk' +\
         '/integration/ewindow/Default.aspx'
+    BACKEND_REQUIRED_SETTINGS = ('merchantnumber', 'secret')
+    BACKEND_DEFAULT_SETTINGS = {
+        'timeout': '3',
+        'instantcallback': '0',
+        'callback_secret_path': '',
+    }
 
     EPAYDK_LANGUAGE_IDS = {
         'da': 1,
@@ -110,7 +116,7 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         assert isinstance(params, OrderedDict)
         params = deepcopy(params)
-        secret = unicode(PaymentProcessor.get_backend_setting('secret', ''))
+        secret = unicode(PaymentProcessor.get_backend_config().secret)
         if not secret:
             raise ImproperlyConfigured("epaydk requires `secret` md5 hash"
                                        " setting")
@@ -156,8 +162,8 @@ class PaymentProcessor(PaymentProcessorBase):
         `callbackurl` - is called instantly from the ePay server when
                         the payment is completed.
         """
-        merchantnumber = unicode(
-            self.get_backend_setting('merchantnumber', ''))
+        config = self.get_backend_config()
+        merchantnumber = unicode(config.merchantnumber)
         if not merchantnumber:
             raise ImproperlyConfigured("epay.dk requires merchantnumber")
 
@@ -169,9 +175,8 @@ class PaymentProcessor(PaymentProcessorBase):
                            self.payment.currency))
 
         # timeout in minutes
-        timeout = unicode(self.get_backend_setting('timeout', '3'))
-        instantcallback = unicode(self.get_backend_setting('instantcallback',
-                                                           '0'))
+        timeout = unicode(config.timeout)
+        instantcallback = unicode(config.instantcallback)
 
         params = OrderedDict([
             (u'merchantnumber', merchantnumber),
@@ -203,8 +208,7 @@ class PaymentProcessor(PaymentProcessorBase):
         params['accepturl'] = build_absolute_uri('getpaid-epaydk-success',
                                                  **url_data)
 
-        if not PaymentProcessor.get_backend_setting('callback_secret_path',
-                                                    ''):
+        if not config.callback_secret_path:
             params['callbackurl'] = build_absolute_uri(
                 'getpaid-epaydk-online', **url_data
             )
@@ -216,8 +220,20 @@ class PaymentProcessor(PaymentProcessorBase):
         url = u"{}?{}".format(self.BACKEND_GATEWAY_BASE_URL, urlencode(params))
         return (url, 'GET', {})
 
-    def get_logo_url(self):
-        return self.BACKEND_LOGO_URL
+    @staticmethod
+    def apply_notification(params):
+        """
+        Applies callback ``params`` (raw query parameters with a verified hash).
+        """
+        from getpaid.backends.epaydk.forms import EpaydkOnlineForm
+        form = EpaydkOnlineForm(params)
+        if not form.is_valid():
+            raise ValueError('Invalid callback parameters: %s' % form.errors.as_text())
+        with dedup.notification_guard(PaymentProcessor.BACKEND, form.cleaned_data['txnid'],
+                                      form.cleaned_data['orderid']) as duplicate:
+            if not duplicate:
+                PaymentProcessor.confirmed(form.cleaned_data)
+        return 'OK'
 
     @staticmethod
     def confirmed(params):
@@ -226,15 +242,13 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         Payment = apps.get_model('getpaid', 'Payment')
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=params['orderid'])
+            payment = Payment.lean.get(id=params['orderid'])
+            events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
             assert payment.status == 'accepted_for_proc',\
                 "Can not confirm payment that was not accepted for processing"
-            payment.external_id = params['txnid']
             # payment_datetime = datetime.datetime.combine(params['date'],
-            amount = PaymentProcessor.amount_to_python(params['amount'])
             # txnfee = PaymentProcessor.amount_to_python(params['txnfee'])
-            payment.amount_paid = amount
-            return payment.on_success()
+            return payment.on_success(external_id=params['txnid'])
 
     @staticmethod
     def accepted_for_processing(payment_id=None):
@@ -243,7 +257,7 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         Payment = apps.get_model('getpaid', 'Payment')
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.lean.get(id=payment_id)
             assert payment.status == 'in_progress',\
                 "Can not accept payment that is not in progress"
             payment.change_status('accepted_for_proc')
@@ -255,5 +269,5 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         Payment = apps.get_model('getpaid', 'Payment')
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.lean.get(id=payment_id)
             payment.change_status('cancelled')
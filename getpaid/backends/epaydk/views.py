@@ -10,6 +10,7 @@ from django.forms import ValidationError
 from django.apps import apps
 
 
+from getpaid import spool
 from getpaid.backends.epaydk import PaymentProcessor
 from getpaid.signals import order_additional_validation
 from getpaid.utils import qs_to_ordered_params
@@ -33,8 +34,8 @@ class CallbackView(View):
 
     def get(self, request, *args, **kwargs):
 
-        cb_secret_path = PaymentProcessor\
-            .get_backend_setting('callback_secret_path', '')
+        cb_secret_path = PaymentProcessor.get_backend_config()\
+            .callback_secret_path
         if cb_secret_path:
             if not kwargs.get('secret_path', ''):
                 logger.debug("empty secret path")
@@ -48,9 +49,11 @@ class CallbackView(View):
         if form.is_valid():
             params = qs_to_ordered_params(request.META['QUERY_STRING'])
             if PaymentProcessor.is_received_request_valid(params):
-                try:
-                    PaymentProcessor.confirmed(form.cleaned_data)
+                if spool.is_enabled():
+                    spool.append(PaymentProcessor.BACKEND, request.GET.dict())
                     return HttpResponse('OK')
+                try:
+                    return HttpResponse(PaymentProcessor.apply_notification(request.GET.dict()))
                 except AssertionError as exc:
                     logger.error("PaymentProcessor.confirmed raised"
                                  " AssertionError: %s", exc, exc_info=1)
@@ -2,27 +2,19 @@
 import base64
 import hashlib
 import logging
-
-from __builtin__ import getattr
 from xml.etree import ElementTree
 
-import requests
-from lxml import etree
-
 from django.apps import apps
 from django.utils import six
 from django.utils.translation import ugettext_lazy as _
 from six.moves.urllib.parse import urlencode
-from six.moves.urllib.request import Request, urlopen
-
-from getpaid.backends.eservice.tasks import get_payment_status_task
 
 try:
     from django.db.transaction import commit_on_success_or_atomic
 except ImportError:
     from django.db.transaction import atomic as commit_on_success_or_atomic
 
-from getpaid import signals
+from getpaid import events, scheduler, signals, transport
 from getpaid.backends import PaymentProcessorBase
 # from getpaid.backends.payu.tasks import get_payment_status_task, accept_payment
 from getpaid.utils import build_absolute_uri, get_domain
@@ -81,8 +73,15 @@ class PaymentProcessor(PaymentProcessorBase):
     _TEST_API_URL = u'https://testvpos.eservice.com.pl:19445/fim/api'
     _ACCEPTED_LANGS = (u'pl', u'en')
 
+    BACKEND_REQUIRED_SETTINGS = ('client_id', 'password', 'store_type', 'api_user', 'api_password', 'pending_url')
+    BACKEND_DEFAULT_SETTINGS = {
+        'order_unique_id_field': 'id',
+        'test': False,
+        'lang': None,
+    }
+
     def generate_payment_id(self):
-        order_id_field = PaymentProcessor.get_backend_setting('order_unique_id_field', 'id')
+        order_id_field = PaymentProcessor.get_backend_config().order_unique_id_field
         order_id = getattr(self.payment.order, order_id_field)
         return six.text_type(u'{}{}'.format(order_id, self.payment.pk))
 
@@ -101,7 +100,7 @@ class PaymentProcessor(PaymentProcessorBase):
         #  of the hash_data parameters
         hash_data = request.POST.get('HASHPARAMSVAL')
 
-        store_key = six.text_type(PaymentProcessor.get_backend_setting('password'))
+        store_key = six.text_type(PaymentProcessor.get_backend_config().password)
         calculated_hash = base64.b64encode(hashlib.sha1(hash_data + store_key).digest())
 
         match = calculated_hash == request.POST.get('HASH')
@@ -111,13 +110,13 @@ class PaymentProcessor(PaymentProcessorBase):
 
     @property
     def api_url(self):
-        if PaymentProcessor.get_backend_setting('test'):
+        if PaymentProcessor.get_backend_config().test:
             return self._TEST_API_URL
         return self._API_URL
 
     @property
     def gateway_url(self):
-        if PaymentProcessor.get_backend_setting('test'):
+        if PaymentProcessor.get_backend_config().test:
             return self._TEST_GATEWAY_URL
         return self._GATEWAY_URL
 
@@ -127,10 +126,12 @@ class PaymentProcessor(PaymentProcessorBase):
 
         """
 
+        config = self.get_backend_config()
         self.payment.external_id = self.generate_payment_id()
+        self.payment.save(update_fields=['external_id'])
         params = {
-            'ClientId': six.text_type(PaymentProcessor.get_backend_setting('client_id')),
-            'Password': six.text_type(PaymentProcessor.get_backend_setting('password')),
+            'ClientId': six.text_type(config.client_id),
+            'Password': six.text_type(config.password),
             'OrderId': self.payment.external_id,
             'Total': self.payment.amount,
             'Currency': EServiceCurrency.get_by_name(self.payment.currency)
@@ -153,9 +154,8 @@ class PaymentProcessor(PaymentProcessorBase):
 
         if user_data['lang'] and user_data['lang'].lower() in PaymentProcessor._ACCEPTED_LANGS:
             params['lang'] = user_data['lang'].lower()
-        elif PaymentProcessor.get_backend_setting('lang', False) and \
-                PaymentProcessor.get_backend_setting('lang').lower() in PaymentProcessor._ACCEPTED_LANGS:
-            params['lang'] = six.text_type(PaymentProcessor.get_backend_setting('lang').lower())
+        elif config.lang and config.lang.lower() in PaymentProcessor._ACCEPTED_LANGS:
+            params['lang'] = six.text_type(config.lang.lower())
 
         url_data = {
             'domain': get_domain(request=request),
@@ -165,7 +165,7 @@ class PaymentProcessor(PaymentProcessorBase):
         params['failUrl'] = build_absolute_uri('getpaid-eservice-failure', **url_data)
         params['pendingUrl'] = build_absolute_uri('getpaid-eservice-pending', **url_data)
 
-        params['StoreType'] = PaymentProcessor.get_backend_setting('store_type')
+        params['StoreType'] = config.store_type
         params['TranType'] = u'Auth'
 
         params['ConsumerName'] = user_data.get('first_name', u'')
@@ -190,11 +190,9 @@ class PaymentProcessor(PaymentProcessorBase):
         return self.gateway_url + 'fim/eservicegate?' + urlencode(params), 'GET', {}
 
     def get_token(self, params):
-        data = six.text_type(urlencode(params)).encode('utf-8')
         url = self.gateway_url + 'pg/token'
-        request = Request(url, data)
-        response = urlopen(request)
-        response_data = self._unpack_response_data(response.read().decode('utf-8'))
+        response = transport.post(self.BACKEND, url, data=params, payment_id=self.payment.pk)
+        response_data = self._unpack_response_data(response.text)
 
         message = response_data.get('msg', '')
         if response_data.get('status') == 'ok':
@@ -205,40 +203,48 @@ class PaymentProcessor(PaymentProcessorBase):
         logger.error(u'Get token method ERROR. Message: {}'.format(message))
         return None
 
-    def check_order_status(self):
+    def fetch_status(self):
+        from lxml import etree
+
+        config = self.get_backend_config()
         xml_body = etree.Element("CC5Request")
-        etree.SubElement(xml_body, "Name").text = six.text_type(PaymentProcessor.get_backend_setting('api_user'))
-        etree.SubElement(xml_body, "Password").text = six.text_type(PaymentProcessor.get_backend_setting('api_password'))
-        etree.SubElement(xml_body, "ClientId").text = six.text_type(PaymentProcessor.get_backend_setting('client_id'))
+        etree.SubElement(xml_body, "Name").text = six.text_type(config.api_user)
+        etree.SubElement(xml_body, "Password").text = six.text_type(config.api_password)
+        etree.SubElement(xml_body, "ClientId").text = six.text_type(config.client_id)
         etree.SubElement(xml_body, "OrderId").text = str(self.payment.external_id)
         extra_options = etree.SubElement(xml_body, "Extra")
         etree.SubElement(extra_options, "ORDERSTATUS").text = 'QUERY'
         contents = etree.tostring(xml_body, encoding='utf-8')
 
-        response = requests.post(self.api_url, data=contents).text
+        response = transport.post(self.BACKEND, self.api_url, data=contents).text
 
         xml_response = ElementTree.fromstring(response)
         ret_code_element = xml_response.find('Extra/PROC_RET_CD')
         ret_code = ret_code_element.text if ret_code_element is not None else None
         if ret_code != '00':
             logger.warning('Payment {} not processed yet'.format(self.payment.id))
-            return False
+            return None
 
         status_element = xml_response.find('Extra/TRANS_STAT')
         status = status_element.text if status_element is not None else None
         logger.warning('Received status {} for payment {}'.format(status, self.payment.id))
         if status in EserviceTransactionStatus.SUCCESS_STATUSES:
             logger.warning('Processing success for payment {}'.format(self.payment.id))
-            self.payment.on_success()
-            return True
+            return 'paid', None
         elif status in EserviceTransactionStatus.ERROR_STATUSES:
             logger.warning('Processing failure for payment {}'.format(self.payment.id))
-            self.payment.on_failure()
-            return True
+            return 'failed', None
         else:
             logger.warning('Processing status unknown for payment {}: {}'.format(self.payment.id, status))
+            return None
 
-
+    def check_order_status(self):
+        result = self.fetch_status()
+        events.record(self.payment.pk, events.GATEWAY, self.BACKEND, data={'result': result})
+        if result is None:
+            return False
+        self.apply_status(*result)
+        return True
 
     @staticmethod
     def accept_payment(payment_id):
@@ -247,7 +253,7 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         Payment = apps.get_model('getpaid', 'Payment')
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.lean.get(id=payment_id)
             return payment.on_success()
 
     @staticmethod
@@ -257,9 +263,10 @@ class PaymentProcessor(PaymentProcessorBase):
         """
         Payment = apps.get_model('getpaid', 'Payment')
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.lean.get(id=payment_id)
             payment.change_status('in_progress')
-        get_payment_status_task.delay(payment_id)
+        from getpaid.backends.eservice.tasks import get_payment_status_task
+        scheduler.schedule(payment_id, get_payment_status_task)
 
     @staticmethod
     def payment_error(payment_id=None):
@@ -269,10 +276,11 @@ class PaymentProcessor(PaymentProcessorBase):
         Payment = apps.get_model('getpaid', 'Payment')
         logger.warning('Received payment error for payment {} - querying for status for confirmation'.format(payment_id))
         with commit_on_success_or_atomic():
-            payment = Payment.objects.get(id=payment_id)
+            payment = Payment.lean.get(id=payment_id)
             # payment.on_failure()
             payment.change_status('in_progress')
-        get_payment_status_task.delay(payment_id)
+        from getpaid.backends.eservice.tasks import get_payment_status_task
+        scheduler.schedule(payment_id, get_payment_status_task)
 
     @staticmethod
     def _unpack_response_data(data):
@@ -6,6 +6,7 @@ from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.http.response import HttpResponseBadRequest
 from django.views.generic.base import View, RedirectView
+from getpaid import dedup, events
 from getpaid.backends.eservice import PaymentProcessor
 from getpaid.models import Payment
 
@@ -26,10 +27,14 @@ class PendingView(View):
 
         payment_external_id = request.POST.get('OrderId')
         status = request.POST.get('mdStatus')
-        payment = Payment.objects.filter(external_id=payment_external_id).first()
+        payment = Payment.lean.by_external_id(PaymentProcessor.BACKEND, payment_external_id).first()
         logger.error(u"Payment %s still pending with status %s" % (payment, status))
-        PaymentProcessor.pending_payment(payment.pk)
-        return HttpResponseRedirect(reverse(PaymentProcessor.get_backend_setting('pending_url'),
+        if payment is not None:
+            events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=request.POST.dict())
+        with dedup.notification_guard(PaymentProcessor.BACKEND, 'pending', request.POST.get('HASH')) as duplicate:
+            if not duplicate:
+                PaymentProcessor.pending_payment(payment.pk)
+        return HttpResponseRedirect(reverse(PaymentProcessor.get_backend_config().pending_url,
                                             kwargs={'pk': payment.pk}))
 
 
@@ -44,9 +49,13 @@ class SuccessView(RedirectView):
 
         payment_external_id = request.POST.get('OrderId')
         status = request.POST.get('mdStatus')
-        payment = Payment.objects.filter(external_id=payment_external_id).first()
+        payment = Payment.lean.by_external_id(PaymentProcessor.BACKEND, payment_external_id).first()
         logger.error(u"Payment %s successful with status %s" % (payment, status))
-        PaymentProcessor.accept_payment(payment.pk)
+        if payment is not None:
+            events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=request.POST.dict())
+        with dedup.notification_guard(PaymentProcessor.BACKEND, 'success', request.POST.get('HASH')) as duplicate:
+            if not duplicate:
+                PaymentProcessor.accept_payment(payment.pk)
         return HttpResponseRedirect(reverse('getpaid-success-fallback', kwargs={'pk': payment.pk}))
 
 
@@ -68,7 +77,11 @@ class FailureView(RedirectView):
                 error_message = six.text_type(html_parser.unescape(error_unprocessed))
             except:
                 error_message = 'failed to process error message'
-        payment = Payment.objects.filter(external_id=payment_external_id).first()
+        payment = Payment.lean.by_external_id(PaymentProcessor.BACKEND, payment_external_id).first()
         logger.error(u"Payment %s failed on backend error %s with status %s" % (payment, error_message, status))
-        PaymentProcessor.payment_error(payment.pk)
+        if payment is not None:
+            events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=request.POST.dict())
+        with dedup.notification_guard(PaymentProcessor.BACKEND, 'failure', request.POST.get('HASH')) as duplicate:
+            if not duplicate:
+                PaymentProcessor.payment_error(payment.pk)
         return HttpResponseRedirect(reverse('getpaid-failure-fallback', kwargs={'pk': payment.pk}))
@@ -4,13 +4,12 @@ import logging
 import datetime
 
 from django.apps import apps
-from django.core.urlresolvers import reverse
 from django.utils.timezone import utc
-import requests
 import time
 from getpaid.signals import user_data_query
+from getpaid import dedup, events, spool, transport
 from getpaid.backends import PaymentProcessorBase
-from lxml import etree
+from getpaid.utils import build_absolute_uri
 
 logger = logging.getLogger('getpaid.backends.moip')
 
@@ -31,6 +30,10 @@ class PaymentProcessor(PaymentProcessorBase):
     BACKEND = 'getpaid.backends.moip'
     BACKEND_NAME = 'Moip'
     BACKEND_ACCEPTED_CURRENCY = (u'BRL', )
+    BACKEND_REQUIRED_SETTINGS = ('token', 'key')
+    BACKEND_DEFAULT_SETTINGS = {
+        'testing': False,
+    }
 
     _SEND_INSTRUCTION_PAGE = u'/ws/alpha/EnviarInstrucao/Unica'
     _RUN_INSTRUCTION_PAGE = u'Instrucao.do?token='
@@ -50,7 +53,10 @@ class PaymentProcessor(PaymentProcessorBase):
     }
 
     def get_gateway_url(self, request):
-        if PaymentProcessor.get_backend_setting('testing', False):
+        from lxml import etree
+
+        config = self.get_backend_config()
+        if config.testing:
             gateway_url = u"https://desenvolvedor.moip.com.br/sandbox"
         else:
             gateway_url = u"https://www.moip.com.br"
@@ -64,7 +70,7 @@ class PaymentProcessor(PaymentProcessorBase):
         etree.SubElement(xml_values, "Valor", moeda=self.payment.currency).text = str(self.payment.amount)
 
         etree.SubElement(xml_instruction, "IdProprio").text = "%s-%s" % (str(self.payment.id), str(time.time()))
-        etree.SubElement(xml_instruction, "URLRetorno").text = PaymentProcessor._get_view_full_url(request, 'getpaid-moip-success', args=(self.payment.id,))
+        etree.SubElement(xml_instruction, "URLRetorno").text = PaymentProcessor._get_view_full_url(request, 'getpaid-moip-success', kwargs={'pk': self.payment.id})
         etree.SubElement(xml_instruction, "URLNotificacao").text = PaymentProcessor._get_view_full_url(request, 'getpaid-moip-notifications')
 
         # collect customer data
@@ -84,36 +90,49 @@ class PaymentProcessor(PaymentProcessorBase):
                     etree.SubElement(xml_buyer_address, self._USER_DATA_TO_MOIP[field]).text = customer_info[field]
 
         payment_full_url = "%s%s" % (gateway_url, self._SEND_INSTRUCTION_PAGE)
-        user = PaymentProcessor.get_backend_setting('token')
-        pwd = PaymentProcessor.get_backend_setting('key')
+        user = config.token
+        pwd = config.key
         contents = etree.tostring(xml_body, encoding='utf-8')
 
-        response = requests.post(payment_full_url, auth=(user, pwd), data=contents).text
+        response = transport.post(self.BACKEND, payment_full_url, auth=(user, pwd), data=contents,
+                                  payment_id=self.payment.pk).text
         moip_payment_token = etree.XML(response)[0][2].text
 
         return u"%s/%s%s " % (gateway_url, self._RUN_INSTRUCTION_PAGE, moip_payment_token), 'GET', {}
 
     @staticmethod
     def process_notification(params):
+        # Moip notifications are not signed, there is nothing to validate before spooling
+        if spool.is_enabled():
+            spool.append(PaymentProcessor.BACKEND, params)
+            return
+        return PaymentProcessor.apply_notification(params)
+
+    @staticmethod
+    def apply_notification(params):
         Payment = apps.get_model('getpaid', 'Payment')
         try:
-            payment = Payment.objects.get(pk=int(params["id"].split("-")[0]))
+            payment = Payment.lean.get(pk=int(params["id"].split("-")[0]))
         except Payment.DoesNotExist:
             logger.error('Payment does not exist with pk=%d' % params["id"])
             return
 
-        status_code = int(params["status"])
-        if status_code in (MoipTransactionStatus.AUTHORIZED,
-                           MoipTransactionStatus.AVAILABLE):
-            payment.amount_paid = Decimal(params["amount"])
-            payment.paid_on = datetime.datetime.utcnow().replace(tzinfo=utc)
-            payment.change_status('paid')
-        elif status_code in (MoipTransactionStatus.CANCELED,
-                             MoipTransactionStatus.REFUNDED,
-                             MoipTransactionStatus.CHARGEBACK):
-            payment.change_status('failed')
+        events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
+        with dedup.notification_guard(PaymentProcessor.BACKEND, params["id"], params["moip_id"],
+                                      params["status"]) as duplicate:
+            if duplicate:
+                return
+
+            status_code = int(params["status"])
+            if status_code in (MoipTransactionStatus.AUTHORIZED,
+                               MoipTransactionStatus.AVAILABLE):
+                payment.change_status('paid', amount_paid=Decimal(params["amount"]),
+                                      paid_on=datetime.datetime.utcnow().replace(tzinfo=utc))
+            elif status_code in (MoipTransactionStatus.CANCELED,
+                                 MoipTransactionStatus.REFUNDED,
+                                 MoipTransactionStatus.CHARGEBACK):
+                payment.change_status('failed')
 
     @staticmethod
-    def _get_view_full_url(request, view_name, args=None):
-        url = reverse(view_name, args=args)
-        return u'http://%s%s' % (request.get_host(), url)
+    def _get_view_full_url(request, view_name, kwargs=None):
+        return build_absolute_uri(view_name, scheme='http', domain=request.get_host(), reverse_kwargs=kwargs)
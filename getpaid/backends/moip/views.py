@@ -5,6 +5,7 @@ from django.views.generic import DetailView
 from django.views.generic.base import View
 from getpaid.backends.moip import PaymentProcessor
 from getpaid.models import Payment
+from getpaid.replicas import ReadReplicaMixin
 
 logger = logging.getLogger('getpaid.backends.moip')
 
@@ -34,7 +35,7 @@ class NotificationsView(View):
         return HttpResponse(status)
 
 
-class SuccessView(DetailView):
+class SuccessView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend success link.
     """
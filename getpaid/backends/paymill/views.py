@@ -4,7 +4,6 @@ from django.views.generic.edit import FormView
 from . import PaymentProcessor
 from .forms import PaymillForm
 from getpaid.models import Payment
-import pymill
 
 
 class PaymillView(FormView):
@@ -18,7 +17,7 @@ class PaymillView(FormView):
         context['amount_int'] = int(self.payment.amount * 100)
         context['order'] = self.payment.order
         context['order_name'] = PaymentProcessor(self.payment).get_order_description(self.payment, self.payment.order)  # TODO: Refactoring of get_order_description needed, should not require payment arg
-        context['PAYMILL_PUBLIC_KEY'] = PaymentProcessor.get_backend_setting('PAYMILL_PUBLIC_KEY')
+        context['PAYMILL_PUBLIC_KEY'] = PaymentProcessor.get_backend_config().PAYMILL_PUBLIC_KEY
         return context
 
     def get_success_url(self):
@@ -31,9 +30,11 @@ class PaymillView(FormView):
 
     def form_valid(self, form):
         # Change payment status and jump to success_url or failure_url
+        import pymill
+
         self.payment = get_object_or_404(Payment, pk=self.kwargs['pk'], status='in_progress', backend='getpaid.backends.paymill')
 
-        pmill = pymill.Pymill(PaymentProcessor.get_backend_setting('PAYMILL_PRIVATE_KEY'))
+        pmill = pymill.Pymill(PaymentProcessor.get_backend_config().PAYMILL_PRIVATE_KEY)
 
         token = form.cleaned_data['token']
         card = pmill.new_card(token)
@@ -4,14 +4,12 @@ import hashlib
 import logging
 
 from django.utils import six
-from six.moves.urllib.request import Request, urlopen
 from six.moves.urllib.parse import urlencode
 from django.core.exceptions import ImproperlyConfigured
 from django.utils.translation import ugettext_lazy as _
 
-from getpaid import signals
+from getpaid import dedup, events, scheduler, signals, transport
 from getpaid.backends import PaymentProcessorBase
-from getpaid.backends.payu.tasks import get_payment_status_task, accept_payment
 
 
 logger = logging.getLogger('getpaid.backends.payu')
@@ -33,6 +31,13 @@ class PaymentProcessor(PaymentProcessorBase):
     BACKEND_NAME = _(u'PayU')
     BACKEND_ACCEPTED_CURRENCY = (u'PLN', )
     BACKEND_LOGO_URL = u'getpaid/backends/payu/payu_logo.png'
+    BACKEND_REQUIRED_SETTINGS = ('pos_id', 'key1', 'key2', 'pos_auth_key')
+    BACKEND_DEFAULT_SETTINGS = {
+        'lang': None,
+        'signing': True,
+        'testing': False,
+        'method': 'get',
+    }
 
     _GATEWAY_URL = u'https://www.platnosci.pl/paygw/'
     _ACCEPTED_LANGS = (u'pl', u'en')
@@ -70,7 +75,8 @@ class PaymentProcessor(PaymentProcessorBase):
             u'sig': sig
         }
 
-        key2 = six.text_type(PaymentProcessor.get_backend_setting('key2'))
+        config = PaymentProcessor.get_backend_config()
+        key2 = six.text_type(config.key2)
         if sig != PaymentProcessor.compute_sig(params, PaymentProcessor._ONLINE_SIG_FIELDS, key2):
             logger.warning('Got message with wrong sig, %s' % str(params))
             return u'SIG ERR'
@@ -79,7 +85,7 @@ class PaymentProcessor(PaymentProcessorBase):
             params['pos_id'] = int(params['pos_id'])
         except ValueError:
             return u'POS_ID ERR'
-        if params['pos_id'] != int(PaymentProcessor.get_backend_setting('pos_id')):
+        if params['pos_id'] != int(config.pos_id):
             return u'POS_ID ERR'
 
         try:
@@ -89,7 +95,11 @@ class PaymentProcessor(PaymentProcessorBase):
                 'Got message with wrong session_id, %s' % str(params))
             return u'SESSION_ID ERR'
 
-        get_payment_status_task.delay(payment_id, session_id)
+        events.record(payment_id, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
+        with dedup.notification_guard(PaymentProcessor.BACKEND, session_id, ts) as duplicate:
+            if not duplicate:
+                from getpaid.backends.payu.tasks import get_payment_status_task
+                scheduler.schedule(payment_id, get_payment_status_task, session_id)
         return u'OK'
 
     def get_gateway_url(self, request):
@@ -97,9 +107,10 @@ class PaymentProcessor(PaymentProcessorBase):
         Routes a payment to Gateway, should return URL for redirection.
 
         """
+        config = self.get_backend_config()
         params = {
-            u'pos_id': PaymentProcessor.get_backend_setting('pos_id'),
-            u'pos_auth_key': PaymentProcessor.get_backend_setting('pos_auth_key'),
+            u'pos_id': config.pos_id,
+            u'pos_auth_key': config.pos_auth_key,
             u'desc': self.get_order_description(self.payment, self.payment.order),
         }
 
@@ -116,16 +127,13 @@ class PaymentProcessor(PaymentProcessorBase):
         if user_data['lang'] and \
                 user_data['lang'].lower() in PaymentProcessor._ACCEPTED_LANGS:
             params['language'] = user_data['lang'].lower()
-        elif PaymentProcessor.get_backend_setting('lang', False) and \
-                PaymentProcessor.get_backend_setting('lang').lower() in \
-                    PaymentProcessor._ACCEPTED_LANGS:
-            params['language'] = six.text_type(
-                PaymentProcessor.get_backend_setting('lang').lower())
+        elif config.lang and config.lang.lower() in PaymentProcessor._ACCEPTED_LANGS:
+            params['language'] = six.text_type(config.lang.lower())
 
-        key1 = six.text_type(PaymentProcessor.get_backend_setting('key1'))
+        key1 = six.text_type(config.key1)
 
-        signing = PaymentProcessor.get_backend_setting('signing', True)
-        testing = PaymentProcessor.get_backend_setting('testing', False)
+        signing = config.signing
+        testing = config.testing
 
         if testing:
             # Switch to testing mode, where payment method is set to "test payment"->"t"
@@ -150,10 +158,11 @@ class PaymentProcessor(PaymentProcessorBase):
             params['sig'] = PaymentProcessor.compute_sig(
                 params, self._REQUEST_SIG_FIELDS, key1)
 
-        if PaymentProcessor.get_backend_setting('method', 'get').lower() == 'post':
+        method = config.method.lower()
+        if method == 'post':
             logger.info(u'New payment using POST: %s' % params)
             return self._GATEWAY_URL + 'UTF/NewPayment', 'POST', params
-        elif PaymentProcessor.get_backend_setting('method', 'get').lower() == 'get':
+        elif method == 'get':
             logger.info(u'New payment using GET: %s' % params)
             for key in params.keys():
                 params[key] = six.text_type(params[key]).encode('utf-8')
@@ -164,13 +173,14 @@ class PaymentProcessor(PaymentProcessorBase):
                 'PayU payment backend accepts only GET or POST')
 
     def get_payment_status(self, session_id):
+        config = self.get_backend_config()
         params = {
-            u'pos_id': PaymentProcessor.get_backend_setting('pos_id'),
+            u'pos_id': config.pos_id,
             u'session_id': session_id,
             u'ts': time.time()
         }
-        key1 = PaymentProcessor.get_backend_setting('key1')
-        key2 = PaymentProcessor.get_backend_setting('key2')
+        key1 = config.key1
+        key2 = config.key2
 
         params['sig'] = PaymentProcessor.compute_sig(
             params, self._GET_SIG_FIELDS, key1)
@@ -178,11 +188,8 @@ class PaymentProcessor(PaymentProcessorBase):
         for key in params.keys():
             params[key] = six.text_type(params[key]).encode('utf-8')
 
-        data = six.text_type(urlencode(params)).encode('utf-8')
         url = self._GATEWAY_URL + 'UTF/Payment/get/txt'
-        request = Request(url, data)
-        response = urlopen(request)
-        response_data = response.read().decode('utf-8')
+        response_data = transport.post(self.BACKEND, url, data=params, payment_id=self.payment.pk).text
         response_params = PaymentProcessor._parse_text_response(response_data)
 
         if not response_params['status'] == u'OK':
@@ -199,43 +206,41 @@ class PaymentProcessor(PaymentProcessorBase):
 
             logger.info(u'Fetching payment status: %s' % response_params)
 
-            self.payment.external_id = response_params['trans_id']
-
             status = int(response_params['trans_status'])
             if status in (PayUTransactionStatus.AWAITING, PayUTransactionStatus.FINISHED):
 
-                if self.payment.on_success(Decimal(response_params['trans_amount']) / Decimal('100')):
+                if self.payment.on_success(Decimal(response_params['trans_amount']) / Decimal('100'),
+                                           external_id=response_params['trans_id']):
                     # fully paid
                     if status == PayUTransactionStatus.AWAITING:
+                        from getpaid.backends.payu.tasks import accept_payment
                         accept_payment.delay(self.payment.id, session_id)
 
             elif status in (PayUTransactionStatus.CANCELED,
                             PayUTransactionStatus.ERROR,
                             PayUTransactionStatus.REJECTED,
                             PayUTransactionStatus.REJECTED_AFTER_CANCEL):
-                self.payment.on_failure()
+                self.payment.on_failure(external_id=response_params['trans_id'])
 
         else:
             logger.error(
                 u'Payment status wrong response signature: %s' % response_params)
 
     def accept_payment(self, session_id):
+        config = self.get_backend_config()
         params = {
-            'pos_id': PaymentProcessor.get_backend_setting('pos_id'),
+            'pos_id': config.pos_id,
             'session_id': session_id,
             'ts': time.time()
         }
-        key1 = PaymentProcessor.get_backend_setting('key1')
-        key2 = PaymentProcessor.get_backend_setting('key2')
+        key1 = config.key1
+        key2 = config.key2
         params['sig'] = PaymentProcessor.compute_sig(
             params, self._GET_SIG_FIELDS, key1)
         for key in params.keys():
             params[key] = six.text_type(params[key]).encode('utf-8')
-        data = six.text_type(urlencode(params)).encode('utf-8')
         url = self._GATEWAY_URL + 'UTF/Payment/confirm/txt'
-        request = Request(url, data)
-        response = urlopen(request)
-        response_data = response.read().decode('utf-8')
+        response_data = transport.post(self.BACKEND, url, data=params, payment_id=self.payment.pk).text
         response_params = PaymentProcessor._parse_text_response(response_data)
         if response_params['status'] == 'OK':
             if PaymentProcessor.compute_sig(response_params, self._GET_ACCEPT_SIG_FIELDS, key2) != response_params[
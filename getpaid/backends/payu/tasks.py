@@ -1,34 +1,47 @@
 import logging
-from celery.task.base import get_task_logger, task
 from django.apps import apps
 
+from getpaid import events, retry, routing, scheduler
+from getpaid.tasks import get_task_logger, task
+from getpaid.transport import TransportError
+
 
 logger = logging.getLogger('getpaid.backends.payu')
 task_logger = get_task_logger('getpaid.backends.payu')
 
 
-@task(max_retries=50, default_retry_delay=2*60)
-def get_payment_status_task(payment_id, session_id):
-    Payment = apps.get_model('getpaid', 'Payment')
-    try:
-        payment = Payment.objects.get(pk=int(payment_id))
-    except Payment.DoesNotExist:
-        task_logger.error('Payment does not exist pk=%s', payment_id)
-        return
-    from getpaid.backends.payu import PaymentProcessor # Avoiding circular import
-    processor = PaymentProcessor(payment)
-    processor.get_payment_status(session_id)
+@task(bind=True, max_retries=retry.DEFAULT_MAX_ATTEMPTS)
+def get_payment_status_task(self, payment_id, session_id):
+    with scheduler.check(payment_id), events.buffered():
+        Payment = apps.get_model('getpaid', 'Payment')
+        try:
+            payment = Payment.lean.get(pk=int(payment_id))
+        except Payment.DoesNotExist:
+            task_logger.error('Payment does not exist pk=%s', payment_id)
+            return
+        from getpaid.backends.payu import PaymentProcessor # Avoiding circular import
+        processor = PaymentProcessor(payment)
+        try:
+            processor.get_payment_status(session_id)
+        except TransportError as e:
+            task_logger.warning('Checking status of payment pk=%s failed: %s', payment_id, e)
+            retry.retry_or_give_up(self, payment, e)
 
 
-@task(max_retries=50, default_retry_delay=2 * 60)
-def accept_payment(payment_id, session_id):
+@task(bind=True, max_retries=retry.DEFAULT_MAX_ATTEMPTS, kind=routing.ACCEPT)
+def accept_payment(self, payment_id, session_id):
     Payment = apps.get_model('getpaid', 'Payment')
     try:
-        payment = Payment.objects.get(pk=int(payment_id))
+        payment = Payment.lean.get(pk=int(payment_id))
     except Payment.DoesNotExist:
         task_logger.error('Payment does not exist pk=%s', payment_id)
         return
 
     from getpaid.backends.payu import PaymentProcessor # Avoiding circular import
     processor = PaymentProcessor(payment)
-    processor.accept_payment(session_id)
\ No newline at end of file
+    with events.buffered():
+        try:
+            processor.accept_payment(session_id)
+        except TransportError as e:
+            task_logger.warning('Accepting payment pk=%s failed: %s', payment_id, e)
+            retry.retry_or_give_up(self, payment, e)
@@ -5,6 +5,7 @@ from django.views.generic.base import View
 from django.views.generic.detail import DetailView
 from getpaid.backends.payu import PaymentProcessor
 from getpaid.models import Payment
+from getpaid.replicas import ReadReplicaMixin
 
 logger = logging.getLogger('getpaid.backends.payu')
 
@@ -30,7 +31,7 @@ class OnlineView(View):
         return HttpResponse(status)
 
 
-class SuccessView(DetailView):
+class SuccessView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend success link.
     """
@@ -40,7 +41,7 @@ class SuccessView(DetailView):
         return HttpResponseRedirect(reverse('getpaid-success-fallback', kwargs={'pk': self.object.pk}))
 
 
-class FailureView(DetailView):
+class FailureView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend failure link.
     """
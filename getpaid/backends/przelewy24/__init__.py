@@ -11,18 +11,14 @@ import logging
 import time
 import datetime
 from django.utils import six
-from six.moves.urllib.request import Request, urlopen
-from six.moves.urllib.parse import urlencode
 
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
 from django.utils.translation import ugettext_lazy as _
 from pytz import utc
 
-from getpaid import signals
+from getpaid import dedup, events, scheduler, signals, transport
 from getpaid.backends import PaymentProcessorBase
-from getpaid.backends.przelewy24.tasks import get_payment_status_task
-from getpaid.utils import get_domain
+from getpaid.utils import build_absolute_uri, get_domain
 
 logger = logging.getLogger('getpaid.backends.przelewy24')
 
@@ -32,6 +28,12 @@ class PaymentProcessor(PaymentProcessorBase):
     BACKEND_NAME = _(u'Przelewy24')
     BACKEND_ACCEPTED_CURRENCY = (u'PLN', )
     BACKEND_LOGO_URL = u'getpaid/backends/przelewy24/przelewy24_logo.png'
+    BACKEND_REQUIRED_SETTINGS = ('id', 'crc')
+    BACKEND_DEFAULT_SETTINGS = {
+        'sandbox': False,
+        'lang': None,
+        'ssl_return': False,
+    }
 
     _GATEWAY_URL = u'https://secure.przelewy24.pl/index.php'
     _SANDBOX_GATEWAY_URL = u'https://sandbox.przelewy24.pl/index.php'
@@ -60,41 +62,41 @@ class PaymentProcessor(PaymentProcessorBase):
             'p24_order_id_full': p24_order_id_full,
             'p24_crc': p24_crc,
         }
-        crc = PaymentProcessor.get_backend_setting('crc')
+        crc = PaymentProcessor.get_backend_config().crc
         if p24_crc != PaymentProcessor.compute_sig(params, PaymentProcessor._SUCCESS_RETURN_SIG_FIELDS,
                                                    crc):
             logger.warning('Success return call has wrong crc %s' % str(params))
             return False
 
         payment_id = p24_session_id.split(':')[0]
-        get_payment_status_task.delay(payment_id, p24_session_id, p24_order_id, p24_kwota)
+        events.record(payment_id, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
+        # the same transaction is reported by online, success and failure views
+        with dedup.notification_guard(PaymentProcessor.BACKEND, p24_session_id, p24_order_id, p24_kwota) as duplicate:
+            if not duplicate:
+                from getpaid.backends.przelewy24.tasks import get_payment_status_task
+                scheduler.schedule(payment_id, get_payment_status_task, p24_session_id, p24_order_id, p24_kwota)
         return True
 
     def get_payment_status(self, p24_session_id, p24_order_id, p24_kwota):
+        config = self.get_backend_config()
         params = {
             'p24_session_id': p24_session_id,
             'p24_order_id': p24_order_id,
-            'p24_id_sprzedawcy': PaymentProcessor.get_backend_setting('id'),
+            'p24_id_sprzedawcy': config.id,
             'p24_kwota': p24_kwota,
         }
-        crc = PaymentProcessor.get_backend_setting('crc')
-        params['p24_crc'] = PaymentProcessor.compute_sig(params, self._STATUS_SIG_FIELDS, crc)
+        params['p24_crc'] = PaymentProcessor.compute_sig(params, self._STATUS_SIG_FIELDS, config.crc)
 
         for key in params.keys():
             params[key] = six.text_type(params[key]).encode('utf-8')
 
-        data = urlencode(params).encode('utf-8')
-
         url = self._GATEWAY_CONFIRM_URL
-        if PaymentProcessor.get_backend_setting('sandbox', False):
+        if config.sandbox:
             url = self._SANDBOX_GATEWAY_CONFIRM_URL
 
-        self.payment.external_id = p24_order_id
-
-        request = Request(url, data)
         try:
-            response = urlopen(request).read().decode('utf8')
-        except Exception:
+            response = transport.post(self.BACKEND, url, data=params, payment_id=self.payment.pk).text
+        except transport.TransportError:
             logger.exception('Error while getting payment status change %s data=%s' % (url, str(params)))
             return
 
@@ -102,23 +104,25 @@ class PaymentProcessor(PaymentProcessorBase):
 
         if len(response_list) >= 2 and response_list[0] == 'RESULT' and response_list[1] == 'TRUE':
             logger.info('Payment accepted %s' % str(params))
-            self.payment.amount_paid = Decimal(p24_kwota) / Decimal('100')
-            self.payment.paid_on = datetime.datetime.utcnow().replace(tzinfo=utc)
-            if self.payment.amount_paid >= self.payment.amount:
-                self.payment.change_status('paid')
+            amount_paid = Decimal(p24_kwota) / Decimal('100')
+            paid_on = datetime.datetime.utcnow().replace(tzinfo=utc)
+            if amount_paid >= self.payment.amount:
+                self.payment.change_status('paid', external_id=p24_order_id, amount_paid=amount_paid, paid_on=paid_on)
             else:
-                self.payment.change_status('partially_paid')
+                self.payment.change_status('partially_paid', external_id=p24_order_id, amount_paid=amount_paid,
+                                           paid_on=paid_on)
         else:
             logger.warning('Payment rejected for data=%s: "%s"' % (str(params), response))
-            self.payment.change_status('failed')
+            self.payment.change_status('failed', external_id=p24_order_id)
 
     def get_gateway_url(self, request):
         """
         Routes a payment to Gateway, should return URL for redirection.
 
         """
+        config = self.get_backend_config()
         params = {
-            'p24_id_sprzedawcy': PaymentProcessor.get_backend_setting('id'),
+            'p24_id_sprzedawcy': config.id,
             'p24_opis': self.get_order_description(self.payment, self.payment.order),
             'p24_session_id': "%s:%s:%s" % (self.payment.pk, self.BACKEND, time.time()),
             'p24_kwota': int(self.payment.amount * 100),
@@ -146,24 +150,21 @@ class PaymentProcessor(PaymentProcessorBase):
 
         if user_data['lang'] and user_data['lang'].lower() in PaymentProcessor._ACCEPTED_LANGS:
             params['p24_language'] = user_data['lang'].lower()
-        elif PaymentProcessor.get_backend_setting('lang', False) and PaymentProcessor.get_backend_setting(
-                'lang').lower() in PaymentProcessor._ACCEPTED_LANGS:
-            params['p24_language'] = PaymentProcessor.get_backend_setting('lang').lower()
+        elif config.lang and config.lang.lower() in PaymentProcessor._ACCEPTED_LANGS:
+            params['p24_language'] = config.lang.lower()
 
-        params['p24_crc'] = self.compute_sig(params, self._REQUEST_SIG_FIELDS,
-                                             PaymentProcessor.get_backend_setting('crc'))
+        params['p24_crc'] = self.compute_sig(params, self._REQUEST_SIG_FIELDS, config.crc)
 
-        current_site = get_domain()
-        use_ssl = PaymentProcessor.get_backend_setting('ssl_return', False)
-
-        params['p24_return_url_ok'] = ('https://' if use_ssl else 'http://') + current_site + reverse(
-            'getpaid-przelewy24-success', kwargs={'pk': self.payment.pk})
-        params['p24_return_url_error'] = ('https://' if use_ssl else 'http://') + current_site + reverse(
-            'getpaid-przelewy24-failure', kwargs={'pk': self.payment.pk})
+        url_data = {
+            'domain': get_domain(),
+            'scheme': 'https' if config.ssl_return else 'http',
+            'reverse_kwargs': {'pk': self.payment.pk},
+        }
+        params['p24_return_url_ok'] = build_absolute_uri('getpaid-przelewy24-success', **url_data)
+        params['p24_return_url_error'] = build_absolute_uri('getpaid-przelewy24-failure', **url_data)
 
         if params['p24_email'] is None:
             raise ImproperlyConfigured(
                 '%s requires filling `email` field for payment (you need to handle `user_data_query` signal)' % self.BACKEND)
 
-        return self._SANDBOX_GATEWAY_URL if PaymentProcessor.get_backend_setting('sandbox',
-                                                                                 False) else self._GATEWAY_URL, 'POST', params
+        return self._SANDBOX_GATEWAY_URL if config.sandbox else self._GATEWAY_URL, 'POST', params
@@ -4,13 +4,12 @@ import logging
 from six.moves.urllib.parse import urlencode
 from django.utils.six import text_type
 from django.core.exceptions import ImproperlyConfigured
-from django.core.urlresolvers import reverse
 from django.apps import apps
 from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
-from getpaid import signals
+from getpaid import dedup, events, signals, spool
 from getpaid.backends import PaymentProcessorBase
-from getpaid.utils import get_domain
+from getpaid.utils import build_absolute_uri, get_domain
 
 logger = logging.getLogger('getpaid.backends.transferuj')
 
@@ -28,6 +27,16 @@ class PaymentProcessor(PaymentProcessorBase):
     _ONLINE_SIG_FIELDS = (u'id', u'tr_id', u'tr_amount', u'tr_crc', )
     _ACCEPTED_LANGS = (u'pl', u'en', u'de')
 
+    BACKEND_REQUIRED_SETTINGS = ('id', 'key')
+    BACKEND_DEFAULT_SETTINGS = {
+        'allowed_ip': _ALLOWED_IP,
+        'signing': True,
+        'method': 'get',
+        'lang': '',
+        'force_ssl_online': False,
+        'force_ssl_return': False,
+    }
+
     @staticmethod
     def compute_sig(params, fields, key):
         text = u''
@@ -41,54 +50,73 @@ class PaymentProcessor(PaymentProcessorBase):
     def online(ip, id, tr_id, tr_date, tr_crc, tr_amount, tr_paid, tr_desc,
                tr_status, tr_error, tr_email, md5sum):
 
-        allowed_ip = PaymentProcessor.get_backend_setting('allowed_ip',
-            PaymentProcessor._ALLOWED_IP)
+        config = PaymentProcessor.get_backend_config()
+        allowed_ip = config.allowed_ip
 
         if len(allowed_ip) != 0 and ip not in allowed_ip:
             logger.warning('Got message from not allowed IP %s' % str(allowed_ip))
             return u'IP ERR'
 
         params = {'id': id, 'tr_id': tr_id, 'tr_amount': tr_amount, 'tr_crc': tr_crc}
-        key = PaymentProcessor.get_backend_setting('key')
-
-        if md5sum != PaymentProcessor.compute_sig(params, PaymentProcessor._ONLINE_SIG_FIELDS, key):
+        if md5sum != PaymentProcessor.compute_sig(params, PaymentProcessor._ONLINE_SIG_FIELDS, config.key):
             logger.warning('Got message with wrong sig, %s' % str(params))
             return u'SIG ERR'
 
-        if int(id) != int(PaymentProcessor.get_backend_setting('id')):
+        if int(id) != int(config.id):
             logger.warning('Got message with wrong id, %s' % str(params))
             return u'ID ERR'
 
+        params.update({'tr_date': tr_date, 'tr_paid': tr_paid, 'tr_desc': tr_desc, 'tr_status': tr_status,
+                       'tr_error': tr_error, 'tr_email': tr_email})
+        if spool.is_enabled():
+            spool.append(PaymentProcessor.BACKEND, params)
+            return u'TRUE'
+        return PaymentProcessor.apply_notification(params)
+
+    @staticmethod
+    def apply_notification(params):
+        id, tr_id, tr_date, tr_crc, tr_amount, tr_paid, tr_desc, tr_status, tr_error, tr_email = [
+            params[name] for name in ('id', 'tr_id', 'tr_date', 'tr_crc', 'tr_amount', 'tr_paid', 'tr_desc',
+                                      'tr_status', 'tr_error', 'tr_email')]
+
         Payment = apps.get_model('getpaid', 'Payment')
         try:
-            payment = Payment.objects.select_related('order').get(pk=int(tr_crc))
+            payment = Payment.lean.get(pk=int(tr_crc))
         except (Payment.DoesNotExist, ValueError):
             logger.error('Got message with CRC set to non existing Payment, %s' % str(params))
             return u'CRC ERR'
 
         logger.info('Incoming payment: id=%s, tr_id=%s, tr_date=%s, tr_crc=%s, tr_amount=%s, tr_paid=%s, tr_desc=%s, tr_status=%s, tr_error=%s, tr_email=%s' % (id, tr_id, tr_date, tr_crc, tr_amount, tr_paid, tr_desc, tr_status, tr_error, tr_email))
 
-        payment.external_id = tr_id
-        payment.description = tr_email
-
-        if tr_status == u'TRUE':
-            # Due to Transferuj documentation, we need to check if amount is correct
-            payment.amount_paid = Decimal(tr_paid)
-            payment.paid_on = now()
-            if payment.amount <= Decimal(tr_paid):
-                # Amount is correct or it is overpaid
-                payment.change_status('paid')
+        events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data={
+            'id': id, 'tr_id': tr_id, 'tr_date': tr_date, 'tr_amount': tr_amount, 'tr_paid': tr_paid, 'tr_desc': tr_desc,
+            'tr_status': tr_status, 'tr_error': tr_error, 'tr_email': tr_email})
+        with dedup.notification_guard(PaymentProcessor.BACKEND, tr_id, tr_status, tr_paid) as duplicate:
+            if duplicate:
+                return u'TRUE'
+
+            fields = {'external_id': tr_id, 'description': tr_email}
+
+            if tr_status == u'TRUE':
+                # Due to Transferuj documentation, we need to check if amount is correct
+                if payment.amount <= Decimal(tr_paid):
+                    # Amount is correct or it is overpaid
+                    payment.change_status('paid', amount_paid=Decimal(tr_paid), paid_on=now(), **fields)
+                else:
+                    payment.change_status('partially_paid', amount_paid=Decimal(tr_paid), paid_on=now(), **fields)
             else:
-                payment.change_status('partially_paid')
-        elif payment.status != 'paid':
-            payment.change_status('failed')
+                # never fail a payment which was already paid
+                allowed_from = [status for status, name in Payment._meta.get_field('status').choices
+                                if status not in ('paid', 'failed')]
+                payment.transition('failed', allowed_from=allowed_from, **fields)
 
         return u'TRUE'
 
     def get_gateway_url(self, request):
         "Routes a payment to Gateway, should return URL for redirection."
+        config = self.get_backend_config()
         params = {
-            'id': self.get_backend_setting('id'),
+            'id': config.id,
             'opis': self.get_order_description(self.payment,
                                                self.payment.order),
             # Here we put payment.pk as we can get order through payment model
@@ -101,7 +129,7 @@ class PaymentProcessor(PaymentProcessorBase):
         self._build_md5sum(params)
         self._build_urls(params)
 
-        method = self.get_backend_setting('method', 'get').lower()
+        method = config.method.lower()
         if method not in ('post', 'get'):
             raise ImproperlyConfigured(
                 'Transferuj.pl payment backend accepts only GET or POST'
@@ -122,7 +150,7 @@ class PaymentProcessor(PaymentProcessorBase):
                                      order=self.payment.order,
                                      user_data=user_data)
 
-        for lang in (user_data['lang'], self.get_backend_setting('lang', '')):
+        for lang in (user_data['lang'], self.get_backend_config().lang):
             if lang and lang.lower() in self._ACCEPTED_LANGS:
                 params['jezyk'] = lang.lower()
                 break
@@ -132,35 +160,35 @@ class PaymentProcessor(PaymentProcessorBase):
         return params
 
     def _build_md5sum(self, params):
-        if not self.get_backend_setting('signing', True):
+        config = self.get_backend_config()
+        if not config.signing:
             return params
 
         params['md5sum'] = self.compute_sig(
-            params, self._REQUEST_SIG_FIELDS,
-            self.get_backend_setting('key'))
+            params, self._REQUEST_SIG_FIELDS, config.key)
 
         return params
 
     def _build_urls(self, params):
+        config = self.get_backend_config()
         domain = get_domain()
-        online_domain = return_domain = "http"
-
-        if self.get_backend_setting('force_ssl_online', False):
-            online_domain = "https"
-        if self.get_backend_setting('force_ssl_return', False):
-            return_domain = "https"
+        online_scheme = return_scheme = "http"
 
-        online_domain = "{}://{}".format(online_domain, domain)
-        return_domain = "{}://{}".format(return_domain, domain)
+        if config.force_ssl_online:
+            online_scheme = "https"
+        if config.force_ssl_return:
+            return_scheme = "https"
 
-        params['wyn_url'] = online_domain + reverse(
-            'getpaid-transferuj-online'
+        params['wyn_url'] = build_absolute_uri(
+            'getpaid-transferuj-online', scheme=online_scheme, domain=domain
         )
-        params['pow_url'] = return_domain + reverse(
-            'getpaid-transferuj-success', kwargs={'pk': self.payment.pk}
+        params['pow_url'] = build_absolute_uri(
+            'getpaid-transferuj-success', scheme=return_scheme, domain=domain,
+            reverse_kwargs={'pk': self.payment.pk}
         )
-        params['pow_url_blad'] = return_domain + reverse(
-            'getpaid-transferuj-failure', kwargs={'pk': self.payment.pk}
+        params['pow_url_blad'] = build_absolute_uri(
+            'getpaid-transferuj-failure', scheme=return_scheme, domain=domain,
+            reverse_kwargs={'pk': self.payment.pk}
         )
 
         return params
@@ -5,6 +5,7 @@ from django.views.generic.base import View
 from django.views.generic.detail import DetailView
 from getpaid.backends.transferuj import PaymentProcessor
 from getpaid.models import Payment
+from getpaid.replicas import ReadReplicaMixin
 
 logger = logging.getLogger('getpaid.backends.transferuj')
 
@@ -36,7 +37,7 @@ class OnlineView(View):
         return HttpResponse(status)
 
 
-class SuccessView(DetailView):
+class SuccessView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend success link.
     """
@@ -49,7 +50,7 @@ class SuccessView(DetailView):
         return self.get(*args, **kwargs)
 
 
-class FailureView(DetailView):
+class FailureView(ReadReplicaMixin, DetailView):
     """
     This view just redirects to standard backend failure link.
     """
@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.core import checks
+
+from . import scheduler, spool
+from .utils import get_backend_config
+
+
+@checks.register()
+def check_backends_settings(app_configs=None, **kwargs):
+    """
+    Reports backends that cannot be imported or lack required settings in ``GETPAID_BACKENDS_SETTINGS``.
+    """
+    errors = []
+    for backend_name in getattr(settings, 'GETPAID_BACKENDS', []):
+        try:
+            config = get_backend_config(backend_name)
+        except (ImportError, AttributeError):
+            errors.append(checks.Error(
+                "Backend '%s' is not available or provides no processor." % backend_name,
+                hint="Check GETPAID_BACKENDS setting.",
+                obj=backend_name,
+                id='getpaid.E001',
+            ))
+            continue
+        for name in config.missing():
+            errors.append(checks.Error(
+                "getpaid '%s' requires backend '%s' setting" % (backend_name, name),
+                hint="Add '%s' to GETPAID_BACKENDS_SETTINGS['%s']." % (name, backend_name),
+                obj=backend_name,
+                id='getpaid.E002',
+            ))
+    return errors
+
+
+@checks.register()
+def check_notification_spool(app_configs=None, **kwargs):
+    """
+    Reports notification spool used with a deduplication store which is not rolled back with failed batches.
+    """
+    if not spool.is_enabled() or spool.check_dedup_store():
+        return []
+    return [checks.Error(
+        "GETPAID_NOTIFICATION_SPOOL requires deduplication keys stored in the database.",
+        hint="Set GETPAID_DEDUP_STORE to 'getpaid.dedup.DatabaseDedupStore' or None.",
+        id='getpaid.E003',
+    )]
+
+
+@checks.register()
+def check_scheduler_cache(app_configs=None, **kwargs):
+    """
+    Reports ``GETPAID_SCHEDULER_CACHE`` which is not shared by processes, so checks would stay locked.
+    """
+    alias = scheduler.get_cache_alias()
+    if not alias:
+        return []
+    backend = getattr(settings, 'CACHES', {}).get(alias, {}).get('BACKEND')
+    if backend is None:
+        message = "GETPAID_SCHEDULER_CACHE '%s' is not defined in CACHES." % alias
+    elif backend in scheduler.UNSHARED_CACHE_BACKENDS:
+        message = "GETPAID_SCHEDULER_CACHE '%s' uses %s, which is not shared by processes." % (alias, backend)
+    else:
+        return []
+    return [checks.Error(
+        message,
+        hint="Use a cache shared by web processes and workers (e.g. memcached or redis) or unset "
+             "GETPAID_SCHEDULER_CACHE.",
+        id='getpaid.E004',
+    )]
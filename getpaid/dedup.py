@@ -0,0 +1,196 @@
+# coding: utf8
+"""
+Deduplication of gateway notifications.
+
+Payment gateways repeat notifications until they are acknowledged, often
+several times for the same status change. Backends wrap processing of a
+(validated) notification with :func:`notification_guard`, which tells if the
+same notification was already received within ``GETPAID_DEDUP_WINDOW``
+seconds. Repeats should be acknowledged as usual, but not processed again::
+
+    with dedup.notification_guard(PaymentProcessor.BACKEND, session_id, ts) as duplicate:
+        if not duplicate:
+            get_payment_status_task.delay(payment_id, session_id)
+    return u'OK'
+
+Dropped repeats are counted per backend, see :func:`get_dropped_counts`.
+"""
+from contextlib import contextmanager
+from datetime import timedelta
+import hashlib
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.dispatch import receiver
+from django.utils import six, timezone
+from django.utils.module_loading import import_string
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # django < 1.8
+    from django.test.signals import setting_changed
+
+logger = logging.getLogger('getpaid.dedup')
+
+DEFAULT_STORE = 'getpaid.dedup.CacheDedupStore'
+DEFAULT_WINDOW = 60 * 60
+
+
+class BaseDedupStore(object):
+
+    def add(self, key, backend, window):
+        """
+        Stores ``key`` for ``window`` seconds. Returns ``False`` if it was already stored.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def count_dropped(self, key, backend):
+        raise NotImplementedError
+
+    def get_dropped_counts(self, backends):
+        """
+        Returns ``{backend: number of dropped repeats}``.
+        """
+        raise NotImplementedError
+
+
+class CacheDedupStore(BaseDedupStore):
+    """
+    Keeps keys in ``GETPAID_DEDUP_CACHE`` cache (``default`` by default), which has to be
+    shared by all processes, e.g. memcached or redis.
+    """
+    KEY_PREFIX = 'getpaid:dedup:'
+    COUNTER_PREFIX = 'getpaid:dedup-dropped:'
+
+    def __init__(self):
+        self.cache = caches[getattr(settings, 'GETPAID_DEDUP_CACHE', 'default')]
+
+    def add(self, key, backend, window):
+        return self.cache.add(self.KEY_PREFIX + key, 1, window)
+
+    def delete(self, key):
+        self.cache.delete(self.KEY_PREFIX + key)
+
+    def count_dropped(self, key, backend):
+        counter = self.COUNTER_PREFIX + backend
+        self.cache.add(counter, 0, None)
+        try:
+            self.cache.incr(counter)
+        except ValueError:  # evicted meanwhile
+            self.cache.add(counter, 1, None)
+
+    def get_dropped_counts(self, backends):
+        counts = self.cache.get_many([self.COUNTER_PREFIX + backend for backend in backends])
+        return dict((backend, counts.get(self.COUNTER_PREFIX + backend, 0)) for backend in backends)
+
+
+class DatabaseDedupStore(BaseDedupStore):
+    """
+    Keeps keys in ``getpaid.NotificationReceipt`` table. Receipts older than the window
+    can be deleted with :meth:`prune`.
+    """
+
+    @property
+    def model(self):
+        return apps.get_model('getpaid', 'NotificationReceipt')
+
+    def add(self, key, backend, window):
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                self.model.objects.create(key=key, backend=backend, created_on=now)
+            return True
+        except IntegrityError:
+            # a receipt older than the window counts as a new notification
+            return self.model.objects.filter(key=key, created_on__lt=now - timedelta(seconds=window))\
+                .update(created_on=now) == 1
+
+    def delete(self, key):
+        self.model.objects.filter(key=key).delete()
+
+    def count_dropped(self, key, backend):
+        self.model.objects.filter(key=key).update(duplicates=F('duplicates') + 1)
+
+    def get_dropped_counts(self, backends):
+        counts = dict((backend, 0) for backend in backends)
+        counts.update(self.model.objects.filter(backend__in=backends).values_list('backend')
+                      .annotate(Sum('duplicates')).order_by())
+        return counts
+
+    def prune(self, window=None):
+        if window is None:
+            window = get_window()
+        return self.model.objects.filter(created_on__lt=timezone.now() - timedelta(seconds=window)).delete()
+
+
+_store = {}
+
+
+def get_store():
+    """
+    Returns shared instance of ``GETPAID_DEDUP_STORE`` class or ``None`` if deduplication is disabled.
+    """
+    try:
+        return _store['instance']
+    except KeyError:
+        pass
+    path = getattr(settings, 'GETPAID_DEDUP_STORE', DEFAULT_STORE)
+    store = import_string(path)() if path else None
+    return _store.setdefault('instance', store)
+
+
+def get_window():
+    return getattr(settings, 'GETPAID_DEDUP_WINDOW', DEFAULT_WINDOW)
+
+
+def make_key(backend, key_parts):
+    key = u'\x00'.join([backend] + [six.text_type(part) for part in key_parts])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+@contextmanager
+def notification_guard(backend, *key_parts):
+    """
+    Yields ``True`` if notification identified by ``key_parts`` is a repeat. If the block raises,
+    the notification is forgotten, so a repeat of it will be processed.
+    """
+    store = get_store()
+    if store is None:
+        yield False
+        return
+    key = make_key(backend, key_parts)
+    if not store.add(key, backend, get_window()):
+        logger.info('Dropped repeated %s notification %s', backend, key_parts)
+        store.count_dropped(key, backend)
+        yield True
+        return
+    try:
+        yield False
+    except Exception:
+        store.delete(key)
+        raise
+
+
+def get_dropped_counts(backends=None):
+    """
+    Returns numbers of dropped notification repeats for each enabled backend.
+    """
+    if backends is None:
+        backends = getattr(settings, 'GETPAID_BACKENDS', [])
+    store = get_store()
+    if store is None:
+        return dict((backend, 0) for backend in backends)
+    return store.get_dropped_counts(backends)
+
+
+@receiver(setting_changed)
+def reset_store(sender, setting, **kwargs):
+    if setting in ('GETPAID_DEDUP_STORE', 'GETPAID_DEDUP_CACHE'):
+        _store.clear()
@@ -0,0 +1,144 @@
+# coding: utf8
+"""
+Append-only log of what happened to payments.
+
+Every status change, received gateway notification and gateway call made for
+a payment is recorded as a ``getpaid.PaymentEvent``::
+
+    events.record(payment.pk, events.NOTIFICATION, PaymentProcessor.BACKEND, data=params)
+
+Events recorded within :func:`buffered` block (or a request processed by
+:class:`EventBufferMiddleware`) are written with a single ``bulk_create`` when
+the block ends; otherwise each event is written right away. Old events can be
+removed (and archived) with ``getpaid_prune_events`` management command.
+Set ``GETPAID_PAYMENT_EVENTS`` to ``False`` to disable the log.
+"""
+from contextlib import contextmanager
+import json
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, transaction
+from django.utils import six, timezone
+
+logger = logging.getLogger('getpaid.events')
+
+STATUS = 'status'
+NOTIFICATION = 'notification'
+GATEWAY = 'gateway'
+
+_local = threading.local()
+
+
+def is_enabled():
+    return getattr(settings, 'GETPAID_PAYMENT_EVENTS', True)
+
+
+def serialize(data):
+    if data is None or isinstance(data, six.string_types):
+        return data or ''
+    return json.dumps(data, default=six.text_type, sort_keys=True)
+
+
+def _get_buffers():
+    try:
+        return _local.buffers
+    except AttributeError:
+        _local.buffers = []
+        return _local.buffers
+
+
+def write(events):
+    """
+    Writes events with a single statement. Failures are only logged, the log must never break payment processing.
+    """
+    if not events:
+        return
+    PaymentEvent = apps.get_model('getpaid', 'PaymentEvent')
+    try:
+        with transaction.atomic():
+            PaymentEvent.objects.bulk_create(events)
+    except DatabaseError:
+        logger.exception('Could not write %d payment events', len(events))
+
+
+def record(payment_id, kind, backend='', old_status='', new_status='', data=None):
+    if not is_enabled():
+        return
+    PaymentEvent = apps.get_model('getpaid', 'PaymentEvent')
+    event = PaymentEvent(payment_id=payment_id, created_on=timezone.now(), kind=kind, backend=backend,
+                         old_status=old_status, new_status=new_status, data=serialize(data))
+    buffers = _get_buffers()
+    if buffers:
+        buffers[-1].append(event)
+    else:
+        write([event])
+
+
+def start_buffering():
+    _get_buffers().append([])
+
+
+def flush():
+    """
+    Ends buffering started by :func:`start_buffering`. Events of a nested buffer are passed to the outer one.
+    """
+    buffers = _get_buffers()
+    events = buffers.pop()
+    if buffers:
+        buffers[-1].extend(events)
+    else:
+        write(events)
+
+
+@contextmanager
+def buffered():
+    start_buffering()
+    try:
+        yield
+    finally:
+        flush()
+
+
+class EventBufferMiddleware(object):
+    """
+    Buffers payment events recorded while processing a request.
+    """
+
+    def process_request(self, request):
+        start_buffering()
+        request._getpaid_events_buffered = True
+
+    def process_response(self, request, response):
+        if getattr(request, '_getpaid_events_buffered', False):
+            request._getpaid_events_buffered = False
+            flush()
+        return response
+
+
+def prune(older_than, batch_size=1000, archive=None):
+    """
+    Deletes events older than ``older_than`` (a ``timedelta``) in batches of ``batch_size`` rows, walking the
+    table by primary key (events are appended, so the oldest have the lowest keys). If given, ``archive`` is
+    called with each batch of events before it is deleted. Returns number of deleted events.
+    """
+    PaymentEvent = apps.get_model('getpaid', 'PaymentEvent')
+    cutoff = timezone.now() - older_than
+    deleted = 0
+    last_pk = 0
+    while True:
+        batch = list(PaymentEvent.objects.filter(pk__gt=last_pk).order_by('pk')[:batch_size])
+        if not batch:
+            break
+        last_pk = batch[-1].pk
+        old = [event for event in batch if event.created_on < cutoff]
+        if not old:
+            # events are only slightly out of order (buffering), no need to look any further
+            break
+        if archive is not None:
+            archive(old)
+        PaymentEvent.objects.filter(pk__in=[event.pk for event in old]).delete()
+        deleted += len(old)
+    return deleted
@@ -0,0 +1,133 @@
+# coding: utf8
+"""
+Streaming export of payments as CSV or JSON lines.
+
+Payments are read in chunks with keyset pagination (by primary key) as plain
+tuples, never as model instances, and every row is formatted as soon as it is
+read, so memory use does not depend on the number of exported payments::
+
+    for line in export.export('csv', statuses=['paid'], created_from=date(2015, 1, 1)):
+        output.write(line)
+
+Used by ``getpaid_export`` management command and ``getpaid-export`` view.
+"""
+from datetime import datetime, time, timedelta
+import csv
+import json
+
+from django.apps import apps
+from django.conf import settings
+from django.utils import six, timezone
+from django.utils.dateparse import parse_date
+
+FORMATS = ('csv', 'jsonl')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson; charset=utf-8',
+}
+EXPORT_FIELDS = ('id', 'order_id', 'backend', 'status', 'amount', 'amount_paid', 'currency', 'created_on', 'paid_on',
+                 'external_id', 'description')
+DEFAULT_CHUNK_SIZE = 1000
+
+
+def parse_day(value):
+    """
+    Parses YYYY-MM-DD date, returns ``None`` for empty value. Raises ``ValueError`` for invalid one.
+    """
+    if not value:
+        return None
+    day = parse_date(value)
+    if day is None:
+        raise ValueError("Invalid date '%s'" % value)
+    return day
+
+
+def day_start(day):
+    """
+    Returns beginning of ``day`` in the default time zone (naive if ``USE_TZ`` is disabled), matching
+    days of ``getpaid.aggregates``.
+    """
+    value = datetime.combine(day, time.min)
+    if getattr(settings, 'USE_TZ', False):
+        value = timezone.make_aware(value, timezone.get_default_timezone())
+    return value
+
+
+def get_export_queryset(statuses=None, backends=None, currencies=None, created_from=None, created_to=None):
+    """
+    Returns payments created between ``created_from`` and ``created_to`` dates (both inclusive)
+    in given statuses, backends and currencies.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    queryset = Payment._default_manager.all()
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if backends:
+        queryset = queryset.filter(backend__in=backends)
+    if currencies:
+        queryset = queryset.filter(currency__in=[currency.upper() for currency in currencies])
+    if created_from:
+        queryset = queryset.filter(created_on__gte=day_start(created_from))
+    if created_to:
+        queryset = queryset.filter(created_on__lt=day_start(created_to + timedelta(days=1)))
+    return queryset
+
+
+def iter_rows(queryset, fields=EXPORT_FIELDS, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yields ``values_list`` tuples of ``fields`` (which has to start with ``id``) in primary key order.
+    """
+    queryset = queryset.order_by('pk').values_list(*fields)
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        count = 0
+        for row in chunk[:chunk_size].iterator():
+            count += 1
+            last_pk = row[0]
+            yield row
+        if count < chunk_size:
+            return
+
+
+def _format_value(value):
+    if value is None:
+        return u''
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return six.text_type(value)
+
+
+class _Echo(object):
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows, fields=EXPORT_FIELDS):
+    writer = csv.writer(_Echo())
+    if six.PY2:  # csv module of python 2 does not support unicode
+        writerow = lambda values: writer.writerow([value.encode('utf-8') for value in values]).decode('utf-8')
+    else:
+        writerow = writer.writerow
+    yield writerow([six.text_type(field) for field in fields])
+    for row in rows:
+        yield writerow([_format_value(value) for value in row])
+
+
+def iter_jsonl(rows, fields=EXPORT_FIELDS):
+    for row in rows:
+        data = dict((field, value if value is None or isinstance(value, six.integer_types) else _format_value(value))
+                    for field, value in zip(fields, row))
+        yield six.text_type(json.dumps(data, sort_keys=True)) + u'\n'
+
+
+def export(format, chunk_size=DEFAULT_CHUNK_SIZE, **filters):
+    """
+    Yields lines of payments matching ``filters`` (see :func:`get_export_queryset`) in given format.
+    """
+    if format not in FORMATS:
+        raise ValueError("Export format has to be one of: %s" % ', '.join(FORMATS))
+    rows = iter_rows(get_export_queryset(**filters), chunk_size=chunk_size)
+    if format == 'csv':
+        return iter_csv(rows)
+    return iter_jsonl(rows)
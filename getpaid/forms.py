@@ -10,13 +10,13 @@ from django.utils.encoding import force_text
 from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 from getpaid.models import Order
-from .utils import get_backend_choices, import_name
+from .utils import get_backend_choices, get_backends_registry
 
 
 class PaymentRadioInput(RadioChoiceInput):
     def __init__(self, name, value, attrs, choice, index):
         super(PaymentRadioInput, self).__init__(name, value, attrs, choice, index)
-        logo_url = import_name(choice[0]).PaymentProcessor.get_logo_url()
+        logo_url = get_backends_registry().get_logo_url(choice[0])
         if logo_url:
             self.choice_label = mark_safe('<img src="%s%s" alt="%s">' % (
                 getattr(settings, 'STATIC_URL', ''),
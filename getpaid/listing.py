@@ -0,0 +1,81 @@
+# coding: utf8
+"""
+Keyset paginated listing of payments for polling services.
+
+Pages are ordered by ``(created_on, id)`` and continue after the cursor of the
+last row of the previous page, so reading any page costs the same regardless of
+its depth (unlike ``OFFSET``). Rows are plain dicts read with ``values()``,
+without instantiating payments or joining orders::
+
+    rows, cursor = listing.get_page(statuses=['paid'], updated_since=last_poll)
+    while cursor:
+        rows, cursor = listing.get_page(cursor, statuses=['paid'], updated_since=last_poll)
+
+Used by ``getpaid-payments`` view.
+"""
+import base64
+import json
+
+from django.apps import apps
+from django.db.models import Q
+from django.utils import six
+from django.utils.dateparse import parse_datetime
+
+LIST_FIELDS = ('id', 'order_id', 'backend', 'status', 'amount', 'amount_paid', 'currency', 'created_on', 'updated_on',
+               'paid_on', 'external_id')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def encode_cursor(created_on, pk):
+    value = json.dumps([created_on.isoformat(), pk]).encode('utf-8')
+    return base64.urlsafe_b64encode(value).decode('ascii')
+
+
+def decode_cursor(cursor):
+    """
+    Returns ``(created_on, pk)`` of the cursor. Raises ``ValueError`` for invalid one.
+    """
+    try:
+        created_on, pk = json.loads(base64.urlsafe_b64decode(str(cursor)).decode('utf-8'))
+        created_on = parse_datetime(created_on)
+    except (TypeError, ValueError, UnicodeError):
+        raise ValueError("Invalid cursor '%s'" % cursor)
+    if created_on is None or not isinstance(pk, six.integer_types):
+        raise ValueError("Invalid cursor '%s'" % cursor)
+    return created_on, pk
+
+
+def get_queryset(statuses=None, backends=None, currencies=None, updated_since=None):
+    """
+    Returns payments in given statuses, backends and currencies, updated at ``updated_since`` or later.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    queryset = Payment.lean.all()
+    if statuses:
+        queryset = queryset.filter(status__in=statuses)
+    if backends:
+        queryset = queryset.filter(backend__in=backends)
+    if currencies:
+        queryset = queryset.filter(currency__in=[currency.upper() for currency in currencies])
+    if updated_since:
+        queryset = queryset.filter(updated_on__gte=updated_since)
+    return queryset
+
+
+def get_page(cursor=None, page_size=DEFAULT_PAGE_SIZE, fields=LIST_FIELDS, **filters):
+    """
+    Returns ``(rows, next_cursor)`` of payments matching ``filters`` (see :func:`get_queryset`) created
+    after ``cursor``; ``next_cursor`` is ``None`` on the last page. Raises ``ValueError`` for invalid cursor.
+    """
+    queryset = get_queryset(**filters).order_by('created_on', 'pk')
+    if cursor:
+        created_on, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(created_on__gt=created_on) | Q(created_on=created_on, pk__gt=pk))
+    values = set(fields) | set(['id', 'created_on'])
+    rows = list(queryset.values(*values)[:page_size + 1])
+    next_cursor = None
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        next_cursor = encode_cursor(rows[-1]['created_on'], rows[-1]['id'])
+    return [dict((field, row[field]) for field in fields) for row in rows], next_cursor
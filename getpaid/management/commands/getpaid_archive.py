@@ -0,0 +1,40 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from getpaid import archive
+
+
+class Command(BaseCommand):
+    help = ('Move old payments in terminal states to the archive table. Every chunk is moved in its own '
+            'transaction, so the command can be interrupted and run again.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', type='int', dest='older_than', default=archive.DEFAULT_OLDER_THAN.days,
+                    help='Archive payments created at least given number of days ago (default: %d).'
+                         % archive.DEFAULT_OLDER_THAN.days),
+        make_option('--status', action='append', dest='statuses', default=[],
+                    help='Archive payments with given status (can be used multiple times, default: %s).'
+                         % ', '.join(archive.TERMINAL_STATUSES)),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=archive.DEFAULT_CHUNK_SIZE,
+                    help='Number of payments moved in one transaction (default: %d).' % archive.DEFAULT_CHUNK_SIZE),
+        make_option('--start-after', type='int', dest='start_after', default=0,
+                    help='Skip payments with primary key lower or equal to given one, e.g. the last one '
+                         'reported by an interrupted run.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count payments which would be archived.'),
+    )
+
+    def handle(self, *args, **options):
+        total = 0
+        for moved, last_pk in archive.archive_payments(
+                older_than=timedelta(days=options['older_than']),
+                statuses=options['statuses'] or archive.TERMINAL_STATUSES,
+                chunk_size=options['chunk_size'],
+                start_after=options['start_after'],
+                dry_run=options['dry_run']):
+            total += moved
+            if int(options['verbosity']) > 1:
+                self.stdout.write('Archived %d payments (last pk %s)' % (total, last_pk))
+        self.stdout.write('%s %d payments' % ('Would archive' if options['dry_run'] else 'Archived', total))
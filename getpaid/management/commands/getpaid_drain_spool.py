@@ -0,0 +1,39 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from getpaid import spool
+
+
+class Command(BaseCommand):
+    help = 'Apply gateway notifications accepted into GETPAID_NOTIFICATION_SPOOL'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=spool.DEFAULT_BATCH_SIZE,
+                    help='Number of notifications applied in one transaction (default: %d).' % spool.DEFAULT_BATCH_SIZE),
+        make_option('--interval', type='float', dest='interval', default=None,
+                    help='Keep draining the spool every given number of seconds instead of draining it once.'),
+        make_option('--requeue-failed', action='store_true', dest='requeue_failed', default=False,
+                    help='Append notifications of the dead-letter file back to the spool first.'),
+    )
+
+    def handle(self, *args, **options):
+        if not spool.is_enabled():
+            raise CommandError('GETPAID_NOTIFICATION_SPOOL is not set')
+        try:
+            drainer = spool.SpoolDrainer(batch_size=options['batch_size'])
+        except RuntimeError as exc:
+            raise CommandError(str(exc))
+        try:
+            if options['requeue_failed']:
+                self.stdout.write('Requeued %d failed notifications' % drainer.requeue_failed())
+            if options['interval']:
+                drainer.run(options['interval'])
+            else:
+                self.stdout.write('Applied %d notifications' % drainer.drain())
+        except spool.TEMPORARY_ERRORS as exc:
+            raise CommandError('Draining stopped, the failed batch will be applied again: %s' % exc)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            drainer.close()
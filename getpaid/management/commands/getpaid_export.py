@@ -0,0 +1,53 @@
+from optparse import make_option
+import io
+
+from django.core.management.base import BaseCommand, CommandError
+
+from getpaid import export
+
+
+class Command(BaseCommand):
+    help = 'Export payments as CSV or JSON lines'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv', choices=export.FORMATS,
+                    help='Output format: %s (default: csv).' % ', '.join(export.FORMATS)),
+        make_option('--status', action='append', dest='statuses', default=[],
+                    help='Export payments with given status (can be used multiple times).'),
+        make_option('--backend', action='append', dest='backends', default=[],
+                    help='Export payments of given backend (can be used multiple times).'),
+        make_option('--currency', action='append', dest='currencies', default=[],
+                    help='Export payments in given currency (can be used multiple times).'),
+        make_option('--from', dest='created_from',
+                    help='Export payments created on given date (YYYY-MM-DD) or later.'),
+        make_option('--to', dest='created_to',
+                    help='Export payments created on given date (YYYY-MM-DD) or earlier.'),
+        make_option('--output', dest='output',
+                    help='Write to given file instead of standard output.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=export.DEFAULT_CHUNK_SIZE,
+                    help='Number of payments read with one query (default: %d).' % export.DEFAULT_CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            created_from = export.parse_day(options['created_from'])
+            created_to = export.parse_day(options['created_to'])
+        except ValueError:
+            raise CommandError('--from and --to have to be dates in YYYY-MM-DD format')
+
+        lines = export.export(
+            options['format'],
+            chunk_size=options['chunk_size'],
+            statuses=options['statuses'],
+            backends=options['backends'],
+            currencies=options['currencies'],
+            created_from=created_from,
+            created_to=created_to,
+        )
+        if options['output']:
+            with io.open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for line in lines:
+                    output.write(line)
+        else:
+            for line in lines:
+                self.stdout.write(line, ending='')
@@ -0,0 +1,156 @@
+import os
+import pkgutil
+import subprocess
+import sys
+import time
+from optparse import make_option
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+BACKEND_SUBMODULES = ('', 'models', 'views', 'urls', 'tasks')
+
+
+def get_rss_kb():
+    """
+    Current resident set size of this process in kB (peak RSS where
+    ``/proc`` is not available).
+    """
+    if resource is None:
+        return 0
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize() // 1024
+    except (IOError, OSError, IndexError, ValueError):
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return rss // 1024 if sys.platform == 'darwin' else rss
+
+
+def profile_import(module_name):
+    """
+    Imports ``module_name`` and returns ``(status, seconds, new_modules, rss_kb)``.
+
+    Status is ``preloaded`` when the module was already imported (e.g. by
+    another backend), ``missing``
+    when it does not exist and ``error: ...`` when importing it failed.
+    """
+    if module_name in sys.modules:
+        return 'preloaded', 0.0, 0, 0
+    try:
+        if pkgutil.find_loader(module_name) is None:
+            return 'missing', 0.0, 0, 0
+    except ImportError:
+        return 'missing', 0.0, 0, 0
+
+    modules_before = set(sys.modules)
+    rss_before = get_rss_kb()
+    start = time.time()
+    try:
+        __import__(module_name)
+    except Exception as e:
+        return 'error: %s' % e, time.time() - start, 0, 0
+    elapsed = time.time() - start
+    new_modules = len(set(sys.modules) - modules_before)
+    return 'imported', elapsed, new_modules, get_rss_kb() - rss_before
+
+
+HEADER = '%-45s %-10s %10s %8s %10s' % ('module', 'status', 'time [ms]', 'modules', 'rss [kB]')
+
+# run in a child interpreter, so backends are not imported by django.setup() of this process yet
+PROFILE_SCRIPT = ('import sys\n'
+                  'from getpaid.management.commands.getpaid_import_profile import print_profile\n'
+                  'print_profile(sys.argv[1:])\n')
+
+
+class ImportProfiler(object):
+    """
+    ``sys.meta_path`` finder profiling the first import of given modules, whoever imports them.
+    """
+
+    def __init__(self, modules):
+        self.modules = set(modules)
+        self.results = {}
+        self.finding = False
+
+    def find_module(self, fullname, path=None):
+        if fullname not in self.modules or fullname in self.results or self.finding:
+            return None
+        self.finding = True
+        try:
+            exists = pkgutil.find_loader(fullname) is not None
+        except ImportError:
+            exists = False
+        finally:
+            self.finding = False
+        return self if exists else None
+
+    def load_module(self, fullname):
+        self.results[fullname] = None  # imported by the regular finders below
+        self.results[fullname] = profile_import(fullname)
+        if fullname not in sys.modules:
+            raise ImportError('Importing %s failed: %s' % (fullname, self.results[fullname][0]))
+        return sys.modules[fullname]
+
+
+def print_profile(backends):
+    """
+    Sets django up, profiling imports of ``backends`` modules done on the way (packages and models
+    are imported by the app registry), then imports the rest of them and prints the results.
+    """
+    import django
+
+    module_names = ['%s.%s' % (backend_name, submodule) if submodule else backend_name
+                    for backend_name in backends for submodule in BACKEND_SUBMODULES]
+    profiler = ImportProfiler(module_names)
+    sys.meta_path.insert(0, profiler)
+    try:
+        django.setup()
+    finally:
+        sys.meta_path.remove(profiler)
+
+    sys.stdout.write(HEADER + '\n')
+    for module_name in module_names:
+        status, elapsed, new_modules, rss = profiler.results.get(module_name) or profile_import(module_name)
+        if status == 'missing':
+            continue
+        sys.stdout.write('%-45s %-10s %10.1f %8d %10d\n' % (module_name, status, elapsed * 1000, new_modules, rss))
+
+
+class Command(BaseCommand):
+    help = 'Measure import time, loaded modules and memory of getpaid backends modules'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--backend', action='append', dest='backends', default=[],
+                    help='Profile only given backend (can be used multiple times).'),
+        make_option('--isolated', action='store_true', dest='isolated', default=False,
+                    help='Profile each backend in a separate process, so shared '
+                         'dependencies are not attributed to the first backend.'),
+    )
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or list(getattr(settings, 'GETPAID_BACKENDS', []))
+        unknown = set(backends) - set(getattr(settings, 'GETPAID_BACKENDS', []))
+        if unknown:
+            raise CommandError('Backends not enabled in GETPAID_BACKENDS: %s' % ', '.join(sorted(unknown)))
+
+        # this process has imported all backends in django.setup() already
+        if options['isolated']:
+            for backend_name in backends:
+                self.stdout.write(self._run_profile([backend_name]), ending='')
+        else:
+            self.stdout.write(self._run_profile(backends), ending='')
+
+    def _run_profile(self, backends):
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, PYTHONPATH=os.pathsep.join(sys.path))
+        command = [sys.executable, '-c', PROFILE_SCRIPT] + list(backends)
+        try:
+            output = subprocess.check_output(command, env=env, stderr=subprocess.STDOUT)
+        except (OSError, subprocess.CalledProcessError) as e:
+            raise CommandError('Profiling %s failed: %s' % (', '.join(backends), e))
+        return output.decode('utf-8')
@@ -0,0 +1,55 @@
+from datetime import timedelta
+from optparse import make_option
+import gzip
+import json
+
+from django.core.management.base import BaseCommand
+from django.utils import six
+
+from getpaid import events
+
+
+def archive_event(event):
+    return {
+        'id': event.pk,
+        'payment_id': event.payment_id,
+        'created_on': event.created_on.isoformat(),
+        'kind': event.kind,
+        'backend': event.backend,
+        'old_status': event.old_status,
+        'new_status': event.new_status,
+        'data': event.data,
+    }
+
+
+class Command(BaseCommand):
+    help = 'Delete old payment events, optionally archiving them to a JSON lines file'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', type='int', dest='older_than', default=90,
+                    help='Delete events recorded at least given number of days ago (default: 90).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of events deleted in one statement (default: 1000).'),
+        make_option('--archive', dest='archive',
+                    help='Append deleted events to given file (gzipped if it ends with .gz).'),
+    )
+
+    def handle(self, *args, **options):
+        archive = None
+        archive_file = None
+        if options['archive']:
+            path = options['archive']
+            archive_file = gzip.open(path, 'ab') if path.endswith('.gz') else open(path, 'ab')
+
+            def archive(batch):
+                for event in batch:
+                    line = json.dumps(archive_event(event), sort_keys=True) + '\n'
+                    archive_file.write(six.text_type(line).encode('utf-8'))
+                archive_file.flush()
+        try:
+            deleted = events.prune(timedelta(days=options['older_than']), batch_size=options['batch_size'],
+                                   archive=archive)
+        finally:
+            if archive_file is not None:
+                archive_file.close()
+        self.stdout.write('Deleted %d payment events' % deleted)
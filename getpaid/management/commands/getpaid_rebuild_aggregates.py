@@ -0,0 +1,29 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from getpaid import aggregates
+from getpaid.export import parse_day
+
+
+class Command(BaseCommand):
+    help = ('Rebuild daily payment aggregates from live and archived payments; status changes made while '
+            'the command runs may be lost, so run it again for recent days afterwards')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--from', dest='day_from',
+                    help='Rebuild aggregates of payments created on given date (YYYY-MM-DD) or later.'),
+        make_option('--to', dest='day_to',
+                    help='Rebuild aggregates of payments created on given date (YYYY-MM-DD) or earlier.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=aggregates.DEFAULT_CHUNK_SIZE,
+                    help='Number of payments read with one query (default: %d).' % aggregates.DEFAULT_CHUNK_SIZE),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            day_from = parse_day(options['day_from'])
+            day_to = parse_day(options['day_to'])
+        except ValueError:
+            raise CommandError('--from and --to have to be dates in YYYY-MM-DD format')
+        count = aggregates.rebuild(day_from, day_to, chunk_size=options['chunk_size'])
+        self.stdout.write('Rebuilt %d daily aggregates' % count)
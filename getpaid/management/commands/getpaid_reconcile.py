@@ -0,0 +1,48 @@
+from datetime import timedelta
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from getpaid import reconcile
+
+
+class Command(BaseCommand):
+    help = 'Re-check statuses of stale payments at the payment gateways'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', type='int', dest='older_than', default=60,
+                    help='Check payments created at least given number of minutes ago (default: 60).'),
+        make_option('--status', action='append', dest='statuses', default=[],
+                    help='Check payments with given status (can be used multiple times, default: %s).'
+                         % ', '.join(reconcile.RECONCILE_STATUSES)),
+        make_option('--backend', action='append', dest='backends', default=[],
+                    help='Check payments of given backend only (can be used multiple times).'),
+        make_option('--workers', type='int', dest='workers', default=reconcile.DEFAULT_WORKERS,
+                    help='Number of concurrent gateway requests (default: %d).' % reconcile.DEFAULT_WORKERS),
+        make_option('--concurrency', type='int', dest='concurrency', default=reconcile.DEFAULT_BACKEND_CONCURRENCY,
+                    help='Number of concurrent requests to one gateway (default: %d).'
+                         % reconcile.DEFAULT_BACKEND_CONCURRENCY),
+        make_option('--batch-size', type='int', dest='batch_size', default=reconcile.DEFAULT_BATCH_SIZE,
+                    help='Number of payments updated in one transaction (default: %d).'
+                         % reconcile.DEFAULT_BATCH_SIZE),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only fetch statuses, do not change payments.'),
+    )
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or None
+        if backends:
+            unsupported = set(backends) - set(reconcile.get_reconcilable_backends(backends))
+            if unsupported:
+                raise CommandError('Backends cannot fetch payment status: %s' % ', '.join(sorted(unsupported)))
+
+        summary = reconcile.reconcile(
+            older_than=timedelta(minutes=options['older_than']),
+            statuses=options['statuses'] or reconcile.RECONCILE_STATUSES,
+            backends=backends,
+            workers=options['workers'],
+            backend_concurrency=options['concurrency'],
+            batch_size=options['batch_size'],
+            dry_run=options['dry_run'],
+        )
+        self.stdout.write(str(summary) or 'No stale payments found')
@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from getpaid import sweeper
+
+
+class Command(BaseCommand):
+    help = ('Check or cancel payments left new or in progress, according to stale_policy and stale_after '
+            'settings of their backends')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--backend', action='append', dest='backends', default=[],
+                    help='Sweep payments of given backend only (can be used multiple times).'),
+        make_option('--batch-size', type='int', dest='batch_size', default=sweeper.DEFAULT_BATCH_SIZE,
+                    help='Number of payments read and changed at once (default: %d).' % sweeper.DEFAULT_BATCH_SIZE),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only count stale payments, do not change them.'),
+    )
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or None
+        if backends:
+            unknown = set(backends) - set(getattr(settings, 'GETPAID_BACKENDS', []))
+            if unknown:
+                raise CommandError('Backends are not enabled: %s' % ', '.join(sorted(unknown)))
+
+        summary = sweeper.sweep(backends=backends, batch_size=options['batch_size'], dry_run=options['dry_run'])
+        self.stdout.write(str(summary) or 'No stale payments found')
@@ -0,0 +1,28 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getpaid', '0002_auto_20150723_0923'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NotificationReceipt',
+            fields=[
+                ('id', models.AutoField(auto_created=True, verbose_name='ID', primary_key=True, serialize=False)),
+                ('key', models.CharField(unique=True, verbose_name='key', max_length=40)),
+                ('backend', models.CharField(verbose_name='backend', db_index=True, max_length=50)),
+                ('created_on', models.DateTimeField(verbose_name='created on', db_index=True)),
+                ('duplicates', models.PositiveIntegerField(default=0, verbose_name='duplicates')),
+            ],
+            options={
+                'verbose_name_plural': 'Notification receipts',
+                'verbose_name': 'Notification receipt',
+            },
+        ),
+    ]
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getpaid', '0003_notificationreceipt'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentEvent',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('created_on', models.DateTimeField(default=django.utils.timezone.now, verbose_name='created on')),
+                ('kind', models.CharField(max_length=20, verbose_name='kind', choices=[('status', 'status change'), ('notification', 'notification'), ('gateway', 'gateway call')])),
+                ('backend', models.CharField(max_length=50, verbose_name='backend', blank=True)),
+                ('old_status', models.CharField(max_length=20, verbose_name='old status', blank=True)),
+                ('new_status', models.CharField(max_length=20, verbose_name='new status', blank=True)),
+                ('data', models.TextField(verbose_name='data', blank=True)),
+                ('payment', models.ForeignKey(related_name='events', verbose_name='payment', to='getpaid.Payment', db_index=False)),
+            ],
+            options={
+                'verbose_name': 'Payment event',
+                'verbose_name_plural': 'Payment events',
+            },
+        ),
+        migrations.AlterIndexTogether(
+            name='paymentevent',
+            index_together=set([('payment', 'created_on')]),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getpaid', '0004_paymentevent'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='payment',
+            index_together=set([('backend', 'external_id'), ('backend', 'status', 'created_on'), ('order', 'status')]),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import migrations, models
+import getpaid.abstract_mixin
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.GETPAID_ORDER_MODEL),
+        ('getpaid', '0005_payment_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedPayment',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('amount', models.DecimalField(verbose_name='amount', max_digits=20, decimal_places=4)),
+                ('currency', models.CharField(max_length=3, verbose_name='currency')),
+                ('status', models.CharField(default='new', max_length=20, verbose_name='status', db_index=True, choices=[('new', 'new'), ('in_progress', 'in progress'), ('accepted_for_proc', 'accepted for processing'), ('partially_paid', 'partially paid'), ('paid', 'paid'), ('cancelled', 'cancelled'), ('failed', 'failed')])),
+                ('backend', models.CharField(max_length=50, verbose_name='backend')),
+                ('created_on', models.DateTimeField(db_index=True, verbose_name='created on', blank=True)),
+                ('paid_on', models.DateTimeField(default=None, null=True, verbose_name='paid on', db_index=True, blank=True)),
+                ('amount_paid', models.DecimalField(default=0, verbose_name='amount paid', max_digits=20, decimal_places=4)),
+                ('external_id', models.CharField(max_length=64, null=True, verbose_name='external id', blank=True)),
+                ('description', models.CharField(max_length=128, null=True, verbose_name='description', blank=True)),
+                ('archived_on', models.DateTimeField(verbose_name='archived on')),
+                ('order', models.ForeignKey(related_name='archived_payments', to=settings.GETPAID_ORDER_MODEL)),
+            ],
+            options={
+                'ordering': ('-created_on',),
+                'verbose_name': 'Archived payment',
+                'verbose_name_plural': 'Archived payments',
+            },
+            bases=(models.Model, getpaid.abstract_mixin.AbstractMixin),
+        ),
+        migrations.AlterField(
+            model_name='paymentevent',
+            name='payment',
+            field=models.ForeignKey(related_name='events', on_delete=django.db.models.deletion.DO_NOTHING, db_constraint=False, verbose_name='payment', to='getpaid.Payment', db_index=False),
+        ),
+        migrations.AlterIndexTogether(
+            name='archivedpayment',
+            index_together=set([('backend', 'external_id')]),
+        ),
+    ]
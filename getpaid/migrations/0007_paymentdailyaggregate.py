@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getpaid', '0006_archivedpayment'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyAggregate',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('day', models.DateField(verbose_name='day')),
+                ('backend', models.CharField(max_length=50, verbose_name='backend')),
+                ('currency', models.CharField(max_length=3, verbose_name='currency')),
+                ('status', models.CharField(max_length=20, verbose_name='status', choices=[('new', 'new'), ('in_progress', 'in progress'), ('accepted_for_proc', 'accepted for processing'), ('partially_paid', 'partially paid'), ('paid', 'paid'), ('cancelled', 'cancelled'), ('failed', 'failed')])),
+                ('count', models.IntegerField(default=0, verbose_name='count')),
+                ('amount', models.DecimalField(default=0, verbose_name='amount', max_digits=24, decimal_places=4)),
+                ('amount_paid', models.DecimalField(default=0, verbose_name='amount paid', max_digits=24, decimal_places=4)),
+            ],
+            options={
+                'verbose_name': 'Payment daily aggregate',
+                'verbose_name_plural': 'Payment daily aggregates',
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='paymentdailyaggregate',
+            unique_together=set([('day', 'backend', 'currency', 'status')]),
+        ),
+    ]
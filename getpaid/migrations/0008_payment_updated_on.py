@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('getpaid', '0007_paymentdailyaggregate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='updated_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, auto_now=True, verbose_name='updated on', db_index=True),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='archivedpayment',
+            name='updated_on',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='updated on', db_index=True, blank=True),
+            preserve_default=False,
+        ),
+        migrations.AlterIndexTogether(
+            name='payment',
+            index_together=set([('backend', 'external_id'), ('backend', 'status', 'created_on'), ('status', 'created_on'), ('order', 'status')]),
+        ),
+    ]
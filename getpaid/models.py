@@ -2,13 +2,15 @@ import sys
 from datetime import datetime
 
 from django.apps import apps
-from django.db import models
+from django.db import models, transaction
+from django.db.models.signals import post_save
 from django.utils import six
+from django.utils import timezone
 from django.utils.timezone import utc
 from django.utils.translation import ugettext_lazy as _
 from django.utils.encoding import python_2_unicode_compatible
 from .abstract_mixin import AbstractMixin
-from getpaid import signals
+from getpaid import aggregates, events, replicas, signals
 from .utils import import_backend_modules
 from django.conf import settings
 
@@ -26,10 +28,133 @@ PAYMENT_STATUS_CHOICES = (
         ('failed', _("failed")),
         )
 
+PAYMENT_EVENT_KIND_CHOICES = (
+    (events.STATUS, _("status change")),
+    (events.NOTIFICATION, _("notification")),
+    (events.GATEWAY, _("gateway call")),
+)
+
+# Allowed payment status transitions: ``{old status: statuses it can be changed to}``
+PAYMENT_STATUS_TRANSITIONS = {
+    'new': ('in_progress', 'accepted_for_proc', 'partially_paid', 'paid', 'cancelled', 'failed'),
+    'in_progress': ('accepted_for_proc', 'partially_paid', 'paid', 'cancelled', 'failed'),
+    'accepted_for_proc': ('partially_paid', 'paid', 'cancelled', 'failed'),
+    'partially_paid': ('paid', 'cancelled', 'failed'),
+    # refunds and chargebacks
+    'paid': ('failed',),
+    # payment can be retried or gateway can confirm it late
+    'cancelled': ('in_progress', 'partially_paid', 'paid'),
+    'failed': ('in_progress', 'partially_paid', 'paid'),
+}
+
+# ``{new status: frozenset of statuses it can be changed from}``
+ALLOWED_FROM_STATUSES = dict(
+    (status, frozenset(old for old, new_statuses in PAYMENT_STATUS_TRANSITIONS.items() if status in new_statuses))
+    for status, name in PAYMENT_STATUS_CHOICES
+)
+
+
+def get_allowed_from(new_status):
+    """
+    Returns statuses a payment can be changed to ``new_status`` from.
+    """
+    try:
+        return ALLOWED_FROM_STATUSES[new_status]
+    except KeyError:
+        raise ValueError("Unknown payment status '%s'" % new_status)
+
+
+def can_change_status(old_status, new_status):
+    return old_status in get_allowed_from(new_status)
+
+
+class PaymentQuerySet(models.QuerySet):
+
+    def allowing_status(self, new_status):
+        """
+        Filters payments which can be changed to ``new_status``.
+        """
+        return self.filter(status__in=get_allowed_from(new_status))
+
+    def change_status(self, new_status, **fields):
+        """
+        Changes status (and given ``fields``) of all payments which can be changed to ``new_status``
+        with a single ``UPDATE``. Returns number of changed payments. Note that
+        ``payment_status_changed`` signal is not emitted.
+        """
+        fields.setdefault('updated_on', timezone.now())
+        return self.allowing_status(new_status).update(status=new_status, **fields)
+
+    def transition(self, new_status, **fields):
+        """
+        Changes status (and given ``fields``) of payments which can be changed to ``new_status`` like
+        ``Payment.transition`` does, but with one ``SELECT ... FOR UPDATE`` and one ``UPDATE`` for all
+        of them. ``payment_status_changed`` is sent for each changed payment and
+        ``payment_statuses_changed`` once for all. Returns list of changed payments.
+
+        Rows of joined tables are locked too, so use it on ``Payment.lean`` querysets.
+        """
+        with transaction.atomic(), events.buffered():
+            payments = list(self.allowing_status(new_status).select_for_update())
+            if not payments:
+                return []
+            updated_on = timezone.now()
+            self.model._default_manager.filter(pk__in=[payment.pk for payment in payments]).update(
+                status=new_status, updated_on=updated_on, **fields)
+
+            old_statuses = {}
+            old_amounts_paid = {}
+            for payment in payments:
+                old_statuses[payment.pk] = payment.status
+                old_amounts_paid[payment.pk] = payment.amount_paid
+                payment.status = new_status
+                payment.updated_on = updated_on
+                for name, value in fields.items():
+                    setattr(payment, name, value)
+            replicas.pin()
+            for payment in payments:
+                signals.payment_status_changed.send(
+                    sender=self.model, instance=payment,
+                    old_status=old_statuses[payment.pk], new_status=new_status
+                )
+                events.record(payment.pk, events.STATUS, payment.backend, old_statuses[payment.pk], new_status,
+                              fields or None)
+            signals.payment_statuses_changed.send(
+                sender=self.model, payments=payments, old_statuses=old_statuses, new_status=new_status
+            )
+            aggregates.statuses_changed(payments, old_statuses, old_amounts_paid)
+        return payments
+
+    def by_external_id(self, backend, external_id):
+        """
+        Filters payments of ``backend`` with given ``external_id`` (uses ``(backend, external_id)`` index).
+        """
+        return self.filter(backend=backend, external_id=external_id)
+
+
+class PaymentManager(models.Manager.from_queryset(PaymentQuerySet)):
+    """
+    Reads payments together with their orders, unless ``defer_order`` is set (``Payment.lean``
+    manager); ``order`` is then read on first access.
+    """
+
+    def __init__(self, defer_order=False):
+        super(PaymentManager, self).__init__()
+        self.defer_order = defer_order
 
-class PaymentManager(models.Manager):
     def get_queryset(self):
-        return super(PaymentManager, self).get_queryset().select_related('order')
+        queryset = super(PaymentManager, self).get_queryset()
+        if self.defer_order:
+            return queryset
+        return queryset.select_related('order')
+
+    def with_archived(self):
+        """
+        Returns read-only view of both live and archived payments, see ``getpaid.archive``.
+        """
+        from getpaid.archive import CombinedQuerySet
+        ArchivedPayment = apps.get_model('getpaid', 'ArchivedPayment')
+        return CombinedQuerySet([self.get_queryset(), ArchivedPayment.objects.get_queryset()])
 
 
 @python_2_unicode_compatible
@@ -44,6 +169,7 @@ class PaymentFactory(models.Model, AbstractMixin):
     backend = models.CharField(_("backend"), max_length=50)
     created_on = models.DateTimeField(_("created on"), auto_now_add=True, db_index=True)
     paid_on = models.DateTimeField(_("paid on"), blank=True, null=True, default=None, db_index=True)
+    updated_on = models.DateTimeField(_("updated on"), auto_now=True, db_index=True)
     amount_paid = models.DecimalField(_("amount paid"), decimal_places=4, max_digits=20, default=0)
     external_id = models.CharField(_("external id"), max_length=64, blank=True, null=True)
     description = models.CharField(_("description"), max_length=128, blank=True, null=True)
@@ -81,22 +207,59 @@ class PaymentFactory(models.Model, AbstractMixin):
         except (ImportError, AttributeError):
             raise ValueError("Backend '%s' is not available or provides no processor." % self.backend)
 
-    def change_status(self, new_status):
+    def transition(self, new_status, allowed_from=None, **fields):
+        """
+        Changes payment status (and other given ``fields``) with a single conditional
+        ``UPDATE`` that only matches the payment row if its current status is allowed
+        by ``PAYMENT_STATUS_TRANSITIONS`` (and is in ``allowed_from``, if given), so
+        concurrent notifications cannot overwrite each other without locking the row.
+        Transitions not allowed from the current status of the instance are rejected
+        without a query.
+
+        Returns ``True`` and emits ``payment_status_changed`` signal only if the
+        row was changed; the instance is updated accordingly. With daily aggregates
+        enabled their buckets are updated in the same transaction (2 to 4 more
+        statements, see ``getpaid.aggregates``).
+        """
+        allowed = get_allowed_from(new_status)
+        if allowed_from is not None:
+            allowed = allowed.intersection(allowed_from)
+        if self.status not in allowed:
+            return False
+        queryset = type(self)._default_manager.filter(pk=self.pk, status__in=allowed)
+        updated_on = timezone.now()
+        changes = dict(fields, status=new_status, updated_on=updated_on)
+        old_values = dict((name, getattr(self, name)) for name in changes)
+        with transaction.atomic(savepoint=False):
+            if not queryset.update(**changes):
+                return False
+            for name, value in changes.items():
+                setattr(self, name, value)
+            try:
+                aggregates.status_changed(self, old_values['status'], old_values.get('amount_paid', self.amount_paid))
+            except Exception:
+                # the UPDATE is rolled back
+                for name, value in old_values.items():
+                    setattr(self, name, value)
+                raise
+        old_status = old_values['status']
+        replicas.pin()
+        signals.payment_status_changed.send(
+            sender=type(self), instance=self,
+            old_status=old_status, new_status=new_status
+        )
+        events.record(self.pk, events.STATUS, self.backend, old_status, new_status, fields or None)
+        return True
+
+    def change_status(self, new_status, **fields):
         """
         Always change payment status via this method. Otherwise the signal
-        will not be emitted.
-        """
-        if self.status != new_status:
-            # do anything only when status is really changed
-            old_status = self.status
-            self.status = new_status
-            self.save()
-            signals.payment_status_changed.send(
-                sender=type(self), instance=self,
-                old_status=old_status, new_status=new_status
-            )
+        will not be emitted. Other payment ``fields`` changed together with the
+        status have to be given as keyword arguments.
+        """
+        return self.transition(new_status, **fields)
 
-    def on_success(self, amount=None):
+    def on_success(self, amount=None, **fields):
         """
         Called when payment receives successful balance income. It defaults to
         complete payment, but can optionally accept received amount as a parameter
@@ -105,25 +268,60 @@ class PaymentFactory(models.Model, AbstractMixin):
         Returns boolean value if payment was fully paid
         """
         if getattr(settings, 'USE_TZ', False):
-            self.paid_on = datetime.utcnow().replace(tzinfo=utc)
-        else:
-            self.paid_on = datetime.now()
-        if amount:
-            self.amount_paid = amount
-        else:
-            self.amount_paid = self.amount
-        fully_paid = (self.amount_paid >= self.amount)
-        if fully_paid:
-            self.change_status('paid')
+            paid_on = datetime.utcnow().replace(tzinfo=utc)
         else:
-            self.change_status('partially_paid')
+            paid_on = datetime.now()
+        amount_paid = amount if amount else self.amount
+        fully_paid = (amount_paid >= self.amount)
+        self.change_status('paid' if fully_paid else 'partially_paid',
+                           paid_on=paid_on, amount_paid=amount_paid, **fields)
         return fully_paid
 
-    def on_failure(self):
+    def on_failure(self, **fields):
         """
         Called when payment was failed
         """
-        self.change_status('failed')
+        self.change_status('failed', **fields)
+
+
+@python_2_unicode_compatible
+class NotificationReceipt(models.Model):
+    """
+    Key of a processed gateway notification, used by ``getpaid.dedup.DatabaseDedupStore``.
+    """
+    key = models.CharField(_("key"), max_length=40, unique=True)
+    backend = models.CharField(_("backend"), max_length=50, db_index=True)
+    created_on = models.DateTimeField(_("created on"), db_index=True)
+    duplicates = models.PositiveIntegerField(_("duplicates"), default=0)
+
+    class Meta:
+        verbose_name = _("Notification receipt")
+        verbose_name_plural = _("Notification receipts")
+
+    def __str__(self):
+        return self.key
+
+
+@python_2_unicode_compatible
+class PaymentDailyAggregate(models.Model):
+    """
+    Totals of payments created on a day by backend, currency and status, see ``getpaid.aggregates``.
+    """
+    day = models.DateField(_("day"))
+    backend = models.CharField(_("backend"), max_length=50)
+    currency = models.CharField(_("currency"), max_length=3)
+    status = models.CharField(_("status"), max_length=20, choices=PAYMENT_STATUS_CHOICES)
+    count = models.IntegerField(_("count"), default=0)
+    amount = models.DecimalField(_("amount"), decimal_places=4, max_digits=24, default=0)
+    amount_paid = models.DecimalField(_("amount paid"), decimal_places=4, max_digits=24, default=0)
+
+    class Meta:
+        unique_together = [('day', 'backend', 'currency', 'status')]
+        verbose_name = _("Payment daily aggregate")
+        verbose_name_plural = _("Payment daily aggregates")
+
+    def __str__(self):
+        return u'%s %s %s %s' % (self.day, self.backend, self.currency, self.status)
 
 
 def register_to_payment(order_class, **kwargs):
@@ -135,16 +333,74 @@ def register_to_payment(order_class, **kwargs):
     This also will build a model class for every enabled backend.
     """
     global Payment
+    global ArchivedPayment
+    global PaymentEvent
     global Order
 
     class Payment(PaymentFactory.construct(order=order_class, **kwargs)):
         objects = PaymentManager()
+        lean = PaymentManager(defer_order=True)
 
         class Meta:
             ordering = ('-created_on',)
+            index_together = [
+                ('backend', 'external_id'),
+                ('backend', 'status', 'created_on'),
+                ('status', 'created_on'),
+                ('order', 'status'),
+            ]
             verbose_name = _("Payment")
             verbose_name_plural = _("Payments")
 
+    archive_kwargs = dict(kwargs, related_name='archived_payments')
+
+    class ArchivedPayment(PaymentFactory.construct(order=order_class, **archive_kwargs)):
+        """
+        Payment in a terminal state moved out of ``Payment`` table, see ``getpaid.archive``.
+        """
+        archived_on = models.DateTimeField(_("archived on"))
+
+        objects = models.Manager.from_queryset(PaymentQuerySet)()
+
+        class Meta:
+            ordering = ('-created_on',)
+            index_together = [('backend', 'external_id')]
+            verbose_name = _("Archived payment")
+            verbose_name_plural = _("Archived payments")
+
+    # creation and update dates are copied from archived payments
+    created_on = ArchivedPayment._meta.get_field('created_on')
+    created_on.auto_now_add = False
+    created_on.editable = True
+    updated_on = ArchivedPayment._meta.get_field('updated_on')
+    updated_on.auto_now = False
+    updated_on.editable = True
+
+    @python_2_unicode_compatible
+    class PaymentEvent(models.Model):
+        """
+        Entry of append-only payment log, see ``getpaid.events``. Events of archived payments are kept,
+        so the key is not constrained.
+        """
+        payment = models.ForeignKey(Payment, related_name='events', db_index=False, db_constraint=False,
+                                    on_delete=models.DO_NOTHING, verbose_name=_("payment"))
+        created_on = models.DateTimeField(_("created on"), default=timezone.now)
+        kind = models.CharField(_("kind"), max_length=20, choices=PAYMENT_EVENT_KIND_CHOICES)
+        backend = models.CharField(_("backend"), max_length=50, blank=True)
+        old_status = models.CharField(_("old status"), max_length=20, blank=True)
+        new_status = models.CharField(_("new status"), max_length=20, blank=True)
+        data = models.TextField(_("data"), blank=True)
+
+        class Meta:
+            index_together = [('payment', 'created_on')]
+            verbose_name = _("Payment event")
+            verbose_name_plural = _("Payment events")
+
+        def __str__(self):
+            return u'%s %s' % (self.get_kind_display(), self.created_on)
+
+    post_save.connect(aggregates.payment_saved, sender=Payment, dispatch_uid='getpaid-daily-aggregates')
+
     Order = order_class
 
     # Now build models for backends
@@ -0,0 +1,187 @@
+# coding: utf8
+"""
+Bulk re-checking of payment statuses at the gateways, e.g. for payments
+which notifications were lost.
+
+Stale payments are read with keyset pagination (by primary key) and only for
+backends which processors implement ``fetch_status()``. Gateways are queried
+from a bounded thread pool with a limit of concurrent requests per backend,
+results are applied from the calling thread in one transaction per batch::
+
+    from getpaid.reconcile import Reconciler, get_stale_payments
+
+    summary = Reconciler(workers=8, backend_concurrency=4).run(get_stale_payments(older_than=timedelta(hours=1)))
+"""
+from collections import defaultdict
+from datetime import timedelta
+from multiprocessing.pool import ThreadPool
+import logging
+import threading
+
+from django.apps import apps
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from getpaid import events
+from getpaid.utils import import_name
+
+logger = logging.getLogger('getpaid.reconcile')
+
+RECONCILE_STATUSES = ('in_progress', 'accepted_for_proc')
+DEFAULT_OLDER_THAN = timedelta(hours=1)
+DEFAULT_WORKERS = 8
+DEFAULT_BACKEND_CONCURRENCY = 4
+DEFAULT_BATCH_SIZE = 100
+
+
+def get_reconcilable_backends(backends=None):
+    """
+    Returns names of enabled backends (or given ones) which can fetch payment status.
+    """
+    names = backends or getattr(settings, 'GETPAID_BACKENDS', [])
+    reconcilable = []
+    for backend_name in names:
+        try:
+            processor = import_name(backend_name).PaymentProcessor
+        except (ImportError, AttributeError):
+            continue
+        if processor.can_fetch_status():
+            reconcilable.append(backend_name)
+    return reconcilable
+
+
+def get_stale_payments(older_than=DEFAULT_OLDER_THAN, statuses=RECONCILE_STATUSES, backends=None, chunk_size=500):
+    """
+    Yields payments in ``statuses`` created before ``older_than`` ago, of backends which can fetch
+    status. Payments are read without their orders in ``chunk_size`` chunks ordered by primary key.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    queryset = Payment.lean.filter(
+        status__in=statuses,
+        backend__in=get_reconcilable_backends(backends),
+        created_on__lt=timezone.now() - older_than,
+    ).order_by('pk')
+    last_pk = None
+    while True:
+        chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+        chunk = list(chunk[:chunk_size])
+        for payment in chunk:
+            yield payment
+        if len(chunk) < chunk_size:
+            return
+        last_pk = chunk[-1].pk
+
+
+class ReconcileSummary(object):
+
+    def __init__(self):
+        self.counts = defaultdict(lambda: defaultdict(int))
+
+    def add(self, backend, outcome, count=1):
+        self.counts[backend][outcome] += count
+
+    def total(self, outcome):
+        return sum(counts[outcome] for counts in self.counts.values())
+
+    def __str__(self):
+        lines = []
+        for backend in sorted(self.counts):
+            counts = self.counts[backend]
+            lines.append('%s: %s' % (backend, ', '.join('%s=%d' % (outcome, counts[outcome])
+                                                         for outcome in sorted(counts))))
+        return '\n'.join(lines)
+
+
+class Reconciler(object):
+    """
+    Fetches statuses of given payments from their gateways and applies them.
+
+    ``backend_concurrency`` is the limit of concurrent requests per backend, either a number
+    or a dict with limits for particular backends. With ``dry_run`` statuses are only fetched.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, backend_concurrency=DEFAULT_BACKEND_CONCURRENCY,
+                 batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+        self.workers = workers
+        self.backend_concurrency = backend_concurrency
+        self.batch_size = batch_size
+        self.dry_run = dry_run
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    def get_semaphore(self, backend):
+        with self._lock:
+            if backend not in self._semaphores:
+                limit = self.backend_concurrency
+                if isinstance(limit, dict):
+                    limit = limit.get(backend, DEFAULT_BACKEND_CONCURRENCY)
+                self._semaphores[backend] = threading.BoundedSemaphore(limit)
+            return self._semaphores[backend]
+
+    def run(self, payments):
+        summary = ReconcileSummary()
+        pool = ThreadPool(self.workers)
+        try:
+            batch = []
+            for payment in payments:
+                batch.append(payment)
+                if len(batch) >= self.batch_size:
+                    self.apply(pool.map(self.fetch, batch), summary)
+                    batch = []
+            if batch:
+                self.apply(pool.map(self.fetch, batch), summary)
+        finally:
+            pool.close()
+            pool.join()
+        return summary
+
+    def fetch(self, payment):
+        """
+        Returns ``(payment, processor, result, error)``; called from worker threads.
+        """
+        with self.get_semaphore(payment.backend):
+            processor = None
+            try:
+                processor = payment.get_processor()(payment)
+                return payment, processor, processor.fetch_status(), None
+            except Exception as e:
+                logger.exception('Fetching status of payment pk=%s failed', payment.pk)
+                return payment, processor, None, e
+
+    def apply(self, fetched, summary):
+        """
+        Applies fetched statuses in one transaction. Payments which status changed since they were
+        read (e.g. by a notification) are left alone.
+        """
+        Payment = apps.get_model('getpaid', 'Payment')
+        with transaction.atomic(), events.buffered():
+            current = dict(Payment.lean.select_for_update().filter(
+                pk__in=[payment.pk for payment, processor, result, error in fetched if result]
+            ).values_list('pk', 'status'))
+            for payment, processor, result, error in fetched:
+                if not self.dry_run:
+                    # fetching ran in worker threads, which must not touch the database
+                    events.record(payment.pk, events.GATEWAY, payment.backend,
+                                  data={'error': error} if error is not None else {'result': result})
+                if error is not None:
+                    summary.add(payment.backend, 'error')
+                elif result is None:
+                    summary.add(payment.backend, 'pending')
+                elif current.get(payment.pk) != payment.status:
+                    summary.add(payment.backend, 'changed')
+                elif self.dry_run:
+                    summary.add(payment.backend, result[0])
+                else:
+                    processor.apply_status(*result)
+                    summary.add(payment.backend, result[0])
+                    logger.info('Payment pk=%s reconciled to %s', payment.pk, payment.status)
+        return summary
+
+
+def reconcile(older_than=DEFAULT_OLDER_THAN, statuses=RECONCILE_STATUSES, backends=None, **kwargs):
+    """
+    Re-checks stale payments, see :class:`Reconciler` for ``kwargs``. Returns :class:`ReconcileSummary`.
+    """
+    payments = get_stale_payments(older_than=older_than, statuses=statuses, backends=backends)
+    return Reconciler(**kwargs).run(payments)
@@ -0,0 +1,130 @@
+# coding: utf8
+"""
+Routing of read-only payment lookups to a database replica.
+
+Add the router and the middleware to the settings and name the replica::
+
+    DATABASE_ROUTERS = ['getpaid.replicas.ReplicaRouter']
+    MIDDLEWARE_CLASSES += ('getpaid.replicas.ReplicaMiddleware',)
+    GETPAID_READ_DATABASE = 'replica'
+
+Payments (and orders) are read from ``GETPAID_READ_DATABASE`` only within
+:func:`read_only` block, e.g. in views using :class:`ReadReplicaMixin`; all
+other reads (notifications, status checks, transitions) and all writes go to the
+primary database. After a payment status is changed, reads of the same thread
+and, with the middleware, of the same browser session go to the primary for
+``GETPAID_READ_STICKINESS`` seconds, so users see their own changes despite
+replication lag.
+"""
+from contextlib import contextmanager
+import threading
+import time
+
+from django.conf import settings
+
+PINNED_COOKIE_NAME = 'getpaid_pinned'
+
+_local = threading.local()
+
+
+def get_read_database():
+    return getattr(settings, 'GETPAID_READ_DATABASE', None)
+
+
+def get_stickiness():
+    return getattr(settings, 'GETPAID_READ_STICKINESS', 5)
+
+
+def pin(until=None):
+    """
+    Sends reads of this thread to the primary database until ``until`` (a timestamp) or for
+    ``GETPAID_READ_STICKINESS`` seconds. Called by ``Payment.transition``.
+    """
+    if until is None:
+        until = time.time() + get_stickiness()
+        _local.changed = True
+    _local.pinned_until = max(until, getattr(_local, 'pinned_until', 0))
+
+
+def is_pinned():
+    return getattr(_local, 'pinned_until', 0) > time.time()
+
+
+def reset():
+    _local.pinned_until = 0
+    _local.changed = False
+
+
+@contextmanager
+def read_only():
+    """
+    Reads payments and orders from the replica within the block (unless pinned to the primary).
+    """
+    _local.read_only = getattr(_local, 'read_only', 0) + 1
+    try:
+        yield
+    finally:
+        _local.read_only -= 1
+
+
+def _is_routed(model):
+    opts = model._meta
+    if opts.app_label == 'getpaid':
+        return True
+    order_model = getattr(settings, 'GETPAID_ORDER_MODEL', '')
+    return order_model.lower() == ('%s.%s' % (opts.app_label, opts.object_name)).lower()
+
+
+class ReplicaRouter(object):
+    """
+    Database router sending reads of payments and orders within :func:`read_only` blocks to
+    ``GETPAID_READ_DATABASE``. Leaves everything else to other routers.
+    """
+
+    def db_for_read(self, model, **hints):
+        database = get_read_database()
+        if database and getattr(_local, 'read_only', 0) and not is_pinned() and _is_routed(model):
+            return database
+        return None
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replica has the same data as the primary
+        databases = set([get_read_database(), 'default'])
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReadReplicaMixin(object):
+    """
+    Makes a view read payments and orders from the replica, see :func:`read_only`. Template
+    responses are rendered within the block too.
+    """
+
+    def dispatch(self, request, *args, **kwargs):
+        with read_only():
+            response = super(ReadReplicaMixin, self).dispatch(request, *args, **kwargs)
+            if hasattr(response, 'render') and not response.is_rendered:
+                response.render()
+            return response
+
+
+class ReplicaMiddleware(object):
+    """
+    Keeps a browser session reading from the primary database for a while after a request
+    changed payment status.
+    """
+
+    def process_request(self, request):
+        reset()
+        try:
+            pin(float(request.COOKIES.get(PINNED_COOKIE_NAME, 0)))
+        except ValueError:
+            pass
+
+    def process_response(self, request, response):
+        if getattr(_local, 'changed', False):
+            response.set_cookie(PINNED_COOKIE_NAME, '%.3f' % _local.pinned_until, max_age=get_stickiness(),
+                                httponly=True)
+        reset()
+        return response
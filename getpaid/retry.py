@@ -0,0 +1,133 @@
+# coding: utf8
+"""
+Retry policy of gateway polling tasks.
+
+Tasks checking payments with a gateway are retried with exponential backoff
+with full jitter (a random delay between zero and ``retry_base_delay * 2 **
+attempt``, at most ``retry_max_delay`` seconds), so checks delayed by a gateway
+outage do not come back all at once. A payment is checked at most
+``retry_max_attempts`` times and not after ``retry_deadline`` seconds since the
+first attempt (its time is carried by the retries of the task); then the task
+gives up. By default the payment is left as it is; with
+``retry_give_up_status`` it is changed to that status (unless it was settled
+meanwhile). All of them can be set in ``GETPAID_BACKENDS_SETTINGS``::
+
+    'getpaid.backends.payu': {
+        'retry_base_delay': 30,
+        'retry_max_delay': 10 * 60,
+        'retry_max_attempts': 20,
+        'retry_deadline': 60 * 60,
+        'retry_give_up_status': 'cancelled',
+    }
+
+Tasks have to be bound and call :func:`retry_or_give_up` when a check has to
+be repeated::
+
+    @task(bind=True, max_retries=retry.DEFAULT_MAX_ATTEMPTS)
+    def get_payment_status_task(self, payment_id):
+        ...
+        if not processor.check_order_status():
+            retry.retry_or_give_up(self, payment)
+"""
+import logging
+import random
+import time
+
+from getpaid import events, routing, tasks
+from getpaid.utils import get_backend_config
+
+logger = logging.getLogger('getpaid.retry')
+
+DEFAULT_BASE_DELAY = 30
+DEFAULT_MAX_DELAY = 10 * 60
+DEFAULT_MAX_ATTEMPTS = 20
+DEFAULT_DEADLINE = 60 * 60
+DEFAULT_GIVE_UP_STATUS = None
+
+# statuses of payments a task can give up on; others were settled meanwhile
+GIVE_UP_FROM = ('new', 'in_progress', 'accepted_for_proc')
+
+
+class RetryPolicy(object):
+
+    def __init__(self, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, max_attempts=DEFAULT_MAX_ATTEMPTS,
+                 deadline=DEFAULT_DEADLINE, give_up_status=DEFAULT_GIVE_UP_STATUS):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.deadline = deadline
+        self.give_up_status = give_up_status
+
+    @classmethod
+    def for_backend(cls, backend):
+        config = get_backend_config(backend)
+        return cls(
+            base_delay=config.get('retry_base_delay', DEFAULT_BASE_DELAY),
+            max_delay=config.get('retry_max_delay', DEFAULT_MAX_DELAY),
+            max_attempts=config.get('retry_max_attempts', DEFAULT_MAX_ATTEMPTS),
+            deadline=config.get('retry_deadline', DEFAULT_DEADLINE),
+            give_up_status=config.get('retry_give_up_status', DEFAULT_GIVE_UP_STATUS),
+        )
+
+    def get_delay(self, attempt):
+        """
+        Returns random delay in seconds before the retry following ``attempt`` (counted from 0).
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    def get_deadline(self, first_attempt):
+        return first_attempt + self.deadline
+
+    def get_retry_delay(self, first_attempt, attempt):
+        """
+        Returns delay of the next retry, or ``None`` if the payment should not be checked again.
+        ``first_attempt`` is the timestamp of the first attempt of the task.
+        """
+        if attempt + 1 >= self.max_attempts:
+            return None
+        delay = self.get_delay(attempt)
+        if time.time() + delay > self.get_deadline(first_attempt):
+            return None
+        return delay
+
+
+def give_up(payment, attempts, policy=None):
+    """
+    Stops checking ``payment``; changes it to the give-up status of its backend, if one is set and the
+    payment is not settled yet. Returns ``True`` if the status was changed.
+    """
+    policy = policy or RetryPolicy.for_backend(payment.backend)
+    logger.error('Giving up checking payment pk=%s after %d attempts', payment.pk, attempts)
+    events.record(payment.pk, events.GATEWAY, payment.backend, data={'gave_up': attempts})
+    if not policy.give_up_status:
+        return False
+    return payment.transition(policy.give_up_status, allowed_from=GIVE_UP_FROM)
+
+
+def get_first_attempt(task):
+    """
+    Returns timestamp of the first attempt of ``task``, carried by its retries (now for the first attempt).
+    """
+    state = (task.request.kwargs or {}).get(tasks.RETRY_STATE_KWARG) or {}
+    return state.get('first_attempt') or time.time()
+
+
+def retry_or_give_up(task, payment, exc=None):
+    """
+    Retries bound ``task`` (see :mod:`getpaid.tasks`) checking ``payment`` after a backoff delay (raises ``Retry``),
+    or gives up on the payment if it ran out of attempts or time. Retries go to the ``retry`` route of the backend.
+    """
+    policy = RetryPolicy.for_backend(payment.backend)
+    attempt = task.request.retries or 0
+    first_attempt = get_first_attempt(task)
+    delay = policy.get_retry_delay(first_attempt, attempt)
+    if delay is None:
+        give_up(payment, attempt + 1, policy)
+        return
+    logger.info('Checking payment pk=%s again in %.1f s (attempt %d)', payment.pk, delay, attempt + 1)
+    options = routing.get_options(payment.backend, routing.RETRY)
+    if not isinstance(task, tasks.Task):
+        # run by celery, filtered like tasks submitted to it
+        options = routing.get_celery_options(options)
+    kwargs = dict(task.request.kwargs or {}, **{tasks.RETRY_STATE_KWARG: {'first_attempt': first_attempt}})
+    raise task.retry(exc=exc, countdown=delay, max_retries=policy.max_attempts, kwargs=kwargs, **options)
@@ -0,0 +1,93 @@
+# coding: utf8
+"""
+Routing of backend tasks to celery queues.
+
+Tasks are declared with a kind: first status check (``check``), retry of a
+check (``retry``) or payment acceptance (``accept``). With
+``GETPAID_TASK_QUEUES = True`` every backend and kind gets its own queue,
+``getpaid.<backend>.<kind>`` (e.g. ``getpaid.payu.retry``), so a slow gateway
+or a pile of retries does not hold up checks of other payments. Queue names
+can be changed per backend in ``GETPAID_BACKENDS_SETTINGS``::
+
+    'getpaid.backends.eservice': {
+        'task_queues': {'retry': 'getpaid-slow'},
+    }
+
+Each kind also has a priority (``GETPAID_TASK_PRIORITIES``, higher runs
+first), so fresh notifications go ahead of retries within a queue. It is sent
+to celery together with the queue and used by the thread pool executor.
+Queues with priority support can be declared with :func:`get_celery_queues`.
+"""
+from django.conf import settings
+from django.utils import six
+
+from getpaid.utils import get_backend_choices, get_backend_config
+
+CHECK = 'check'
+RETRY = 'retry'
+ACCEPT = 'accept'
+KINDS = (CHECK, RETRY, ACCEPT)
+
+DEFAULT_PRIORITIES = {
+    CHECK: 6,
+    ACCEPT: 6,
+    RETRY: 3,
+}
+MAX_PRIORITY = 9
+
+
+def is_enabled():
+    return getattr(settings, 'GETPAID_TASK_QUEUES', False)
+
+
+def get_queue(backend, kind):
+    queues = get_backend_config(backend).get('task_queues', {})
+    return queues.get(kind) or 'getpaid.%s.%s' % (backend.rsplit('.', 1)[-1], kind)
+
+
+def get_priority(kind):
+    priorities = dict(DEFAULT_PRIORITIES, **getattr(settings, 'GETPAID_TASK_PRIORITIES', {}))
+    return priorities.get(kind)
+
+
+def get_options(backend, kind):
+    """
+    Returns ``apply_async()`` options of a ``kind`` task of ``backend``: its priority and, if
+    ``GETPAID_TASK_QUEUES`` is enabled, its queue.
+    """
+    options = {'priority': get_priority(kind)}
+    if backend and is_enabled():
+        options['queue'] = get_queue(backend, kind)
+    return options
+
+
+def get_celery_options(options):
+    """
+    Returns ``options`` for celery: without ``priority`` unless ``GETPAID_TASK_QUEUES`` is enabled,
+    as priorities are meant for getpaid queues and would reorder shared ones.
+    """
+    if is_enabled():
+        return options
+    return dict((name, value) for name, value in options.items() if name != 'priority')
+
+
+def get_queue_names(backends=None):
+    if backends is None:
+        backends = [backend for backend, name in get_backend_choices()]
+    names = []
+    for backend in backends:
+        for kind in KINDS:
+            name = get_queue(backend, kind)
+            if name not in names:
+                names.append(name)
+    return names
+
+
+def get_celery_queues(backends=None):
+    """
+    Returns ``kombu.Queue`` declarations (with ``x-max-priority``) of queues of enabled backends,
+    to be added to ``CELERY_QUEUES`` of the celery app.
+    """
+    from kombu import Queue
+    return [Queue(six.text_type(name), routing_key=name, queue_arguments={'x-max-priority': MAX_PRIORITY})
+            for name in get_queue_names(backends)]
@@ -0,0 +1,167 @@
+# coding: utf8
+"""
+Coalescing of payment status checks.
+
+Gateways can report one payment many times in a short while, each report
+asking for a status check. :func:`schedule` submits a check only if none is
+queued or running for the payment; otherwise it only marks the payment dirty
+(remembering the latest arguments), so there is at most one check in flight
+plus one follow-up run after it::
+
+    scheduler.schedule(payment_id, get_payment_status_task, session_id)
+
+Check tasks have to wrap their body with :func:`check`, which releases the
+payment or submits the follow-up when the check is done::
+
+    @tasks.task
+    def get_payment_status_task(payment_id, session_id):
+        with scheduler.check(payment_id):
+            ...
+
+Coalescing is enabled by ``GETPAID_SCHEDULER_CACHE`` naming the cache which
+keeps the state; it has to be shared by all processes (web and workers), so
+local memory and dummy caches are rejected by ``getpaid.E004`` system check.
+Without it every check is submitted. Checks are submitted with
+:func:`getpaid.tasks.submit`, so they run with ``GETPAID_TASK_EXECUTOR``.
+"""
+from contextlib import contextmanager
+import logging
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import six
+from django.utils.module_loading import import_string
+
+from getpaid import tasks
+
+logger = logging.getLogger('getpaid.scheduler')
+
+LOCK_PREFIX = 'getpaid:check:'
+DIRTY_PREFIX = 'getpaid:check-dirty:'
+DEFAULT_LOCK_TIMEOUT = 15 * 60
+UNSHARED_CACHE_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+def get_cache_alias():
+    return getattr(settings, 'GETPAID_SCHEDULER_CACHE', None)
+
+
+def is_enabled():
+    return bool(get_cache_alias())
+
+
+def get_cache():
+    return caches[get_cache_alias()]
+
+
+def get_lock_timeout():
+    """
+    Time after which a payment is released even if its check never finished (e.g. worker was killed).
+    It should be longer than retry delay of check tasks.
+    """
+    return getattr(settings, 'GETPAID_SCHEDULER_LOCK_TIMEOUT', DEFAULT_LOCK_TIMEOUT)
+
+
+def get_task_path(task):
+    return getattr(task, 'name', None) or '%s.%s' % (task.__module__, task.__name__)
+
+
+def submit(task, args, options=None):
+    tasks.submit(task, args, **(options or {}))
+
+
+def _pop_dirty(cache, key):
+    pending = cache.get(DIRTY_PREFIX + key)
+    if pending is not None:
+        cache.delete(DIRTY_PREFIX + key)
+    return pending
+
+
+def _submit_pending(cache, key):
+    """
+    Submits the follow-up check remembered for a payment which lock is held by the caller.
+    """
+    pending = _pop_dirty(cache, key)
+    if pending is None:
+        cache.delete(LOCK_PREFIX + key)
+        return False
+    task_path, args, options = pending
+    logger.debug('Submitting follow-up check of payment %s', key)
+    submit(import_string(task_path), args, options)
+    return True
+
+
+def schedule(payment_id, task, *args, **options):
+    """
+    Submits ``task(payment_id, *args)`` (with ``options`` of :func:`getpaid.tasks.submit`, e.g. queue
+    and priority) unless a check of the payment is queued or running.
+    Returns ``True`` if the task was submitted, ``False`` if it was coalesced.
+    """
+    if not is_enabled():
+        submit(task, (payment_id,) + args, options)
+        return True
+    cache = get_cache()
+    key = six.text_type(payment_id)
+    timeout = get_lock_timeout()
+    if cache.add(LOCK_PREFIX + key, 'queued', timeout):
+        submit(task, (payment_id,) + args, options)
+        return True
+
+    cache.set(DIRTY_PREFIX + key, (get_task_path(task), (payment_id,) + args, options), timeout)
+    if cache.add(LOCK_PREFIX + key, 'queued', timeout):
+        # the check finished before the payment was marked dirty
+        return _submit_pending(cache, key)
+    logger.debug('Check of payment %s coalesced', key)
+    return False
+
+
+def _is_retry(exc):
+    if isinstance(exc, tasks.Retry):
+        return True
+    try:
+        from celery.exceptions import Retry
+    except ImportError:
+        return False
+    return isinstance(exc, Retry)
+
+
+def _finish(cache, key):
+    cache.set(LOCK_PREFIX + key, 'queued', get_lock_timeout())
+    if _submit_pending(cache, key):
+        return
+    # a check could have been requested between reading dirty mark and releasing the lock
+    if cache.get(DIRTY_PREFIX + key) is not None and cache.add(LOCK_PREFIX + key, 'queued', get_lock_timeout()):
+        _submit_pending(cache, key)
+
+
+@contextmanager
+def check(payment_id):
+    """
+    Marks check of the payment as running; afterwards submits a follow-up check if the payment
+    was marked dirty meanwhile, or releases it. The payment stays locked when the task is retried.
+    """
+    if not is_enabled():
+        yield
+        return
+    cache = get_cache()
+    key = six.text_type(payment_id)
+    cache.set(LOCK_PREFIX + key, 'running', get_lock_timeout())
+    try:
+        yield
+    except Exception as e:
+        if not _is_retry(e):
+            _finish(cache, key)
+        raise
+    _finish(cache, key)
+
+
+def get_state(payment_id):
+    """
+    Returns ``None``, ``'queued'`` or ``'running'``.
+    """
+    if not is_enabled():
+        return None
+    return get_cache().get(LOCK_PREFIX + six.text_type(payment_id))
@@ -27,6 +27,15 @@ new_payment.__doc__ = """Sent after creating new payment."""
 payment_status_changed = Signal(providing_args=['old_status', 'new_status'])
 payment_status_changed.__doc__ = """Sent when Payment status changes."""
 
+payment_statuses_changed = Signal(providing_args=['payments', 'old_statuses', 'new_status'])
+payment_statuses_changed.__doc__ = """
+Sent once after status of many payments was changed together
+(``PaymentQuerySet.transition``), in addition to ``payment_status_changed``
+sent for each of them:
+    payments:       list of changed payments
+    old_statuses:   dict of previous statuses by payment pk
+"""
+
 
 order_additional_validation = Signal(providing_args=['request',
                                                      'order',
@@ -0,0 +1,342 @@
+# coding: utf8
+"""
+Durable local spool of gateway notifications.
+
+With ``GETPAID_NOTIFICATION_SPOOL`` set to a file path, notification views of
+Dotpay, Transferuj.pl, Moip and ePay.dk only validate notifications (IP
+addresses, signatures) and append them to the spool, so gateways are
+acknowledged without waiting for the database. ``getpaid_drain_spool``
+management command applies them later in batches with
+``PaymentProcessor.apply_notification()``::
+
+    if spool.is_enabled():
+        spool.append(PaymentProcessor.BACKEND, params)
+        return u'OK'
+    return PaymentProcessor.apply_notification(params)
+
+The spool is an append-only file of records (magic, length, CRC32 and JSON).
+Records are appended under an exclusive ``flock`` and acknowledged after
+``fsync``; concurrent appends of a process share one ``fsync``. The drainer
+memory-maps the file, applies records after the offset saved in
+``<spool>.offset`` in one transaction per batch and saves the offset after
+each batch. Torn records left by a crashed writer are skipped. The file is
+truncated whenever the drainer catches up with writers.
+
+An ``OperationalError`` or ``InterfaceError`` (lost connection, deadlock,
+...) rolls the whole batch back and stops draining without moving the offset;
+so does a crash, so the batch is applied again later. Repeats are recognized only if deduplication
+keys are rolled back together with the batch, so the spool requires
+``getpaid.dedup.DatabaseDedupStore`` (or no deduplication, leaving repeats to
+conditional status transitions). Records failing with other errors
+(including other database errors, e.g. ``IntegrityError``) are rolled back
+to their savepoint and moved to the dead-letter file ``<spool>.failed`` (same format, with the
+error), from which :meth:`SpoolDrainer.requeue_failed` puts them back.
+
+Spool is a local file, so the drainer has to run on the same host as the web
+processes (one drainer per spool).
+"""
+from datetime import datetime
+import binascii
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import InterfaceError, OperationalError, close_old_connections, transaction
+
+from getpaid import dedup, events
+from getpaid.utils import import_name
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+logger = logging.getLogger('getpaid.spool')
+
+MAGIC = b'GPN1'
+HEADER = struct.Struct('>4sII')  # magic, length, crc32 of the JSON payload
+DEFAULT_BATCH_SIZE = 100
+# database errors not caused by a record (lost connection, deadlock, lock timeout)
+TEMPORARY_ERRORS = (OperationalError, InterfaceError)
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_path():
+    return getattr(settings, 'GETPAID_NOTIFICATION_SPOOL', None)
+
+
+def is_enabled():
+    return bool(get_path())
+
+
+def check_dedup_store():
+    """
+    Returns ``True`` if keys of ``GETPAID_DEDUP_STORE`` are rolled back with a failed batch.
+    """
+    store = dedup.get_store()
+    return store is None or isinstance(store, dedup.DatabaseDedupStore)
+
+
+def encode(record):
+    payload = json.dumps(record, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return HEADER.pack(MAGIC, len(payload), binascii.crc32(payload) & 0xffffffff) + payload
+
+
+def iter_records(buf, offset, end):
+    """
+    Yields ``(record, next_offset)`` of records in ``buf[offset:end]``. Stops at an incomplete
+    record; damaged ones are skipped up to the next record start.
+    """
+    while offset + HEADER.size <= end:
+        magic, length, crc = HEADER.unpack(buf[offset:offset + HEADER.size])
+        start = offset + HEADER.size
+        if magic == MAGIC and start + length > end:
+            return
+        payload = buf[start:start + length] if magic == MAGIC else None
+        if payload is None or binascii.crc32(payload) & 0xffffffff != crc:
+            next_offset = buf.find(MAGIC, offset + 1, end)
+            logger.error('Skipping damaged spool record at %d', offset)
+            if next_offset < 0:
+                return
+            offset = next_offset
+            continue
+        offset = start + length
+        yield json.loads(payload.decode('utf-8')), offset
+
+
+class SpoolWriter(object):
+    """
+    Appends records to a spool file; :meth:`append` returns when the record is on disk.
+    """
+
+    def __init__(self, path):
+        if fcntl is None:
+            raise ImproperlyConfigured('GETPAID_NOTIFICATION_SPOOL requires fcntl (POSIX systems)')
+        self.path = path
+        self.fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        self.write_lock = threading.Lock()
+        self.sync_condition = threading.Condition()
+        self.written = 0
+        self.synced = 0
+        self.syncing = False
+
+    def append(self, record):
+        data = encode(record)
+        with self.write_lock:
+            fcntl.flock(self.fd, fcntl.LOCK_EX)
+            try:
+                while data:
+                    data = data[os.write(self.fd, data):]
+            finally:
+                fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.written += 1
+            sequence = self.written
+        self.sync(sequence)
+
+    def sync(self, sequence):
+        """
+        Waits until ``sequence`` records are on disk. One thread calls ``fsync`` for all records
+        written so far while others wait for it.
+        """
+        with self.sync_condition:
+            while self.synced < sequence:
+                if self.syncing:
+                    self.sync_condition.wait()
+                    continue
+                self.syncing = True
+                target = self.written
+                self.sync_condition.release()
+                try:
+                    os.fsync(self.fd)
+                finally:
+                    self.sync_condition.acquire()
+                    self.syncing = False
+                    self.sync_condition.notify_all()
+                self.synced = max(self.synced, target)
+
+    def close(self):
+        os.close(self.fd)
+
+
+def get_writer():
+    path = get_path()
+    key = (path, os.getpid())  # file descriptors are not shared with forked processes
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = SpoolWriter(path)
+        return _writers[key]
+
+
+def append(backend, params):
+    """
+    Durably appends validated notification ``params`` (JSON serializable) of ``backend`` to the spool.
+    """
+    get_writer().append({'backend': backend, 'params': params, 'received_on': datetime.utcnow().isoformat()})
+
+
+def read_offset(path):
+    try:
+        with open(path + '.offset') as offset_file:
+            return int(offset_file.read().strip() or 0)
+    except (IOError, OSError, ValueError):
+        return 0
+
+
+def save_offset(path, offset):
+    temp_path = path + '.offset.tmp'
+    with open(temp_path, 'w') as offset_file:
+        offset_file.write(str(offset))
+        offset_file.flush()
+        os.fsync(offset_file.fileno())
+    os.rename(temp_path, path + '.offset')
+
+
+class SpoolDrainer(object):
+    """
+    Applies spooled notifications in batches of ``batch_size``, one transaction per batch.
+    Only one drainer of a spool can run at a time.
+    """
+
+    def __init__(self, path=None, batch_size=DEFAULT_BATCH_SIZE):
+        if fcntl is None:
+            raise ImproperlyConfigured('GETPAID_NOTIFICATION_SPOOL requires fcntl (POSIX systems)')
+        self.path = path or get_path()
+        if not self.path:
+            raise ImproperlyConfigured('GETPAID_NOTIFICATION_SPOOL is not set')
+        if not check_dedup_store():
+            raise ImproperlyConfigured('GETPAID_NOTIFICATION_SPOOL requires GETPAID_DEDUP_STORE to be '
+                                       'getpaid.dedup.DatabaseDedupStore or None')
+        self.batch_size = batch_size
+        self.failed_path = self.path + '.failed'
+        self.failed_writer = None
+        self.lock_fd = os.open(self.path + '.lock', os.O_WRONLY | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            os.close(self.lock_fd)
+            raise RuntimeError('Spool %s is drained by another process' % self.path)
+
+    def close(self):
+        if self.failed_writer is not None:
+            self.failed_writer.close()
+        os.close(self.lock_fd)
+
+    def drain(self):
+        """
+        Applies all records spooled so far. Returns number of applied records. Raises temporary database
+        errors (``TEMPORARY_ERRORS``) of a batch, leaving it to be applied again.
+        """
+        offset = read_offset(self.path)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # writers hold an exclusive lock while appending, so the size is a record boundary
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            size = os.fstat(fd).st_size
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            if offset > size:
+                logger.warning('Spool %s is shorter than its offset %d, reading it from start', self.path, offset)
+                offset = 0
+            count = 0
+            if size > offset:
+                buf = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+                try:
+                    batch = []
+                    for record, next_offset in iter_records(buf, offset, size):
+                        batch.append(record)
+                        if len(batch) >= self.batch_size:
+                            count += self.apply_batch(batch, next_offset)
+                            batch = []
+                        offset = next_offset
+                    if batch:
+                        count += self.apply_batch(batch, offset)
+                finally:
+                    buf.close()
+            self.truncate(fd, offset)
+            return count
+        finally:
+            os.close(fd)
+
+    def truncate(self, fd, offset):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            if offset and os.fstat(fd).st_size == offset:
+                # offset is reset first: a crash in between only makes records to be applied again
+                save_offset(self.path, 0)
+                os.ftruncate(fd, 0)
+        finally:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def apply_batch(self, batch, next_offset):
+        failed = self.apply(batch)
+        for record in failed:
+            if self.failed_writer is None:
+                self.failed_writer = SpoolWriter(self.failed_path)
+            self.failed_writer.append(record)
+        save_offset(self.path, next_offset)
+        return len(batch) - len(failed)
+
+    def apply(self, batch):
+        """
+        Applies ``batch`` in one transaction. Returns records which failed (with their ``error``).
+        """
+        failed = []
+        with transaction.atomic(), events.buffered():
+            for record in batch:
+                try:
+                    with transaction.atomic():
+                        processor = import_name(record['backend']).PaymentProcessor
+                        result = processor.apply_notification(record['params'])
+                    logger.debug('Applied spooled notification of %s: %s', record['backend'], result)
+                except TEMPORARY_ERRORS:
+                    # the batch is rolled back and applied again
+                    raise
+                except Exception as e:
+                    logger.exception('Applying spooled notification failed: %r', record)
+                    failed.append(dict(record, error=repr(e)))
+        return failed
+
+    def requeue_failed(self):
+        """
+        Appends records of the dead-letter file back to the spool. Returns their number.
+        """
+        try:
+            with open(self.failed_path, 'rb') as failed_file:
+                data = failed_file.read()
+        except (IOError, OSError):
+            return 0
+        writer = SpoolWriter(self.path)
+        try:
+            count = 0
+            for record, offset in iter_records(data, 0, len(data)):
+                record.pop('error', None)
+                writer.append(record)
+                count += 1
+        finally:
+            writer.close()
+        with open(self.failed_path, 'r+b') as failed_file:
+            failed_file.truncate(0)
+        return count
+
+    def run(self, interval):
+        """
+        Drains the spool every ``interval`` seconds until interrupted.
+        """
+        while True:
+            # drops broken connections and those older than CONN_MAX_AGE
+            close_old_connections()
+            try:
+                count = self.drain()
+            except TEMPORARY_ERRORS:
+                logger.exception('Draining spool %s failed, it is retried in %s s', self.path, interval)
+            else:
+                if count:
+                    logger.info('Applied %d spooled notifications', count)
+            time.sleep(interval)
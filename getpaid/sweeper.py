@@ -0,0 +1,147 @@
+# coding: utf8
+"""
+Sweeping of stale payments.
+
+Payments of abandoned checkouts or with lost notifications stay ``new`` or
+``in_progress`` forever. The sweeper finds payments of each backend in these
+statuses older than ``stale_after`` seconds (default one day), reading them
+in keyset paginated batches through ``(backend, status, created_on)`` index,
+and applies ``stale_policy`` of the backend to every batch:
+
+* ``None`` (default) leaves them alone,
+* ``'check'`` (only for backends which can fetch status, see
+  ``getpaid.reconcile``) submits a coalesced status check of each payment,
+  routed like retries of the backend (``getpaid.routing``),
+* ``'cancel'`` changes them to ``cancelled`` with one ``UPDATE`` per batch
+  (``PaymentQuerySet.transition``); a late payment can still change them to
+  ``paid``, but gateways confirming some payments slowly (e.g. bank
+  transfers) need a long enough ``stale_after``.
+
+Both are set per backend in ``GETPAID_BACKENDS_SETTINGS``::
+
+    'getpaid.backends.payu': {
+        'stale_after': 24 * 60 * 60,
+        'stale_policy': 'cancel',
+    }
+
+Run it with ``getpaid_sweep`` management command or ``sweep_stale_payments``
+task from celery beat::
+
+    CELERY_IMPORTS = ('getpaid.sweeper',)
+    CELERYBEAT_SCHEDULE = {
+        'getpaid-sweep': {'task': 'getpaid.sweeper.sweep_stale_payments', 'schedule': timedelta(hours=1)},
+    }
+"""
+from datetime import timedelta
+import logging
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import Q
+from django.utils import timezone
+
+from getpaid import events, reconcile, routing, scheduler
+from getpaid.tasks import task
+from getpaid.utils import get_backend_config, import_name
+
+logger = logging.getLogger('getpaid.sweeper')
+
+STALE_STATUSES = ('new', 'in_progress')
+CHECK = 'check'
+CANCEL = 'cancel'
+POLICIES = (CHECK, CANCEL, None)
+DEFAULT_STALE_AFTER = 24 * 60 * 60
+DEFAULT_BATCH_SIZE = 500
+
+
+def get_policy(backend):
+    policy = get_backend_config(backend).get('stale_policy')
+    if policy not in POLICIES:
+        raise ImproperlyConfigured("stale_policy of %s has to be 'check', 'cancel' or None" % backend)
+    if policy == CHECK and not import_name(backend).PaymentProcessor.can_fetch_status():
+        raise ImproperlyConfigured("stale_policy of %s cannot be 'check', it cannot fetch payment status" % backend)
+    return policy
+
+
+def get_stale_after(backend):
+    return timedelta(seconds=get_backend_config(backend).get('stale_after', DEFAULT_STALE_AFTER))
+
+
+def iter_stale_batches(backend, status, created_before, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields lists of primary keys of ``backend`` payments in ``status`` created before ``created_before``,
+    ordered by ``(created_on, id)``.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    queryset = Payment.lean.filter(backend=backend, status=status, created_on__lt=created_before)
+    queryset = queryset.order_by('created_on', 'pk')
+    last = None
+    while True:
+        batch = queryset
+        if last is not None:
+            batch = batch.filter(Q(created_on__gt=last[1]) | Q(created_on=last[1], pk__gt=last[0]))
+        rows = list(batch.values_list('pk', 'created_on')[:batch_size])
+        if rows:
+            yield [pk for pk, created_on in rows]
+        if len(rows) < batch_size:
+            return
+        last = rows[-1]
+
+
+def cancel(payment_ids, status):
+    """
+    Cancels payments which are still in ``status``. Returns number of cancelled payments.
+    """
+    Payment = apps.get_model('getpaid', 'Payment')
+    return len(Payment.lean.filter(pk__in=payment_ids, status=status).transition('cancelled'))
+
+
+def sweep(backends=None, batch_size=DEFAULT_BATCH_SIZE, dry_run=False):
+    """
+    Applies stale payment policies of enabled backends (or given ones). Returns
+    ``ReconcileSummary`` with numbers of ``checked``, ``cancelled`` (or ``stale`` with ``dry_run``)
+    payments per backend.
+    """
+    summary = reconcile.ReconcileSummary()
+    for backend in backends or getattr(settings, 'GETPAID_BACKENDS', []):
+        policy = get_policy(backend)
+        if policy is None:
+            continue
+        created_before = timezone.now() - get_stale_after(backend)
+        for status in STALE_STATUSES:
+            for payment_ids in iter_stale_batches(backend, status, created_before, batch_size):
+                if dry_run:
+                    summary.add(backend, 'stale', len(payment_ids))
+                elif policy == CHECK:
+                    options = routing.get_options(backend, routing.RETRY)
+                    for payment_id in payment_ids:
+                        scheduler.schedule(payment_id, check_payment_status, **options)
+                    summary.add(backend, 'checked', len(payment_ids))
+                else:
+                    cancelled = cancel(payment_ids, status)
+                    summary.add(backend, 'cancelled', cancelled)
+                    logger.info('Cancelled %d stale %s payments of %s', cancelled, status, backend)
+    return summary
+
+
+@task
+def sweep_stale_payments():
+    summary = sweep()
+    logger.info('Stale payments swept:\n%s', summary)
+
+
+@task(kind=routing.RETRY)
+def check_payment_status(payment_id):
+    """
+    Fetches status of a payment from its gateway and applies it, see ``getpaid.reconcile``.
+    """
+    with scheduler.check(payment_id), events.buffered():
+        Payment = apps.get_model('getpaid', 'Payment')
+        try:
+            payment = Payment.lean.get(pk=int(payment_id))
+        except Payment.DoesNotExist:
+            logger.error('Payment does not exist pk=%s', payment_id)
+            return
+        reconciler = reconcile.Reconciler(workers=1)
+        reconciler.apply([reconciler.fetch(payment)], reconcile.ReconcileSummary())
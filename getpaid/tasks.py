@@ -0,0 +1,400 @@
+# coding: utf8
+"""
+Background tasks of backends.
+
+Backends declare their tasks with :func:`task` instead of a celery decorator
+and submit them with ``delay()`` (or :func:`submit`)::
+
+    @tasks.task(bind=True, max_retries=retry.DEFAULT_MAX_ATTEMPTS)
+    def get_payment_status_task(self, payment_id, session_id):
+        ...
+
+    get_payment_status_task.delay(payment_id, session_id)
+
+Tasks are run by the executor selected with ``GETPAID_TASK_EXECUTOR``:
+
+* ``'celery'`` (default) sends them to celery workers. Tasks are registered as
+  celery tasks under their usual names, so routing of existing deployments
+  keeps working.
+* ``'thread'`` runs them in a bounded pool of ``GETPAID_TASK_THREADS`` threads
+  of the current process; queued tasks are finished on interpreter exit.
+* ``'sync'`` runs them right away in the caller (tests).
+
+Celery is needed only by the ``'celery'`` executor. Bound tasks are retried
+with ``raise self.retry(exc=exc, countdown=delay)`` by all executors; local
+ones count attempts in ``self.request.retries`` like celery does. A retry can
+carry state for later attempts in ``kwargs`` of ``self.retry()`` under
+``RETRY_STATE_KWARG``; it is read from ``self.request.kwargs`` and not passed
+to the task function.
+
+Tasks are submitted with queue and priority of their backend and kind
+(``@task(kind=routing.ACCEPT)``, ``routing.CHECK`` by default), see
+:mod:`getpaid.routing`.
+"""
+import atexit
+from functools import wraps
+import itertools
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import close_old_connections, connections
+from django.dispatch import receiver
+from django.utils.six.moves import queue
+
+from getpaid import routing
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # django < 1.8
+    from django.test.signals import setting_changed
+
+logger = logging.getLogger('getpaid.tasks')
+
+DEFAULT_EXECUTOR = 'celery'
+DEFAULT_THREADS = 4
+DEFAULT_QUEUE_SIZE = 1000
+DEFAULT_SHUTDOWN_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 3
+SHUTDOWN_PRIORITY = routing.MAX_PRIORITY + 1
+RETRY_STATE_KWARG = 'getpaid_retry_state'
+
+_executors = {}
+_executors_lock = threading.Lock()
+
+
+class Retry(Exception):
+    """
+    Raised by a task run by a local executor to be run again after ``countdown`` seconds.
+    """
+
+    def __init__(self, exc=None, countdown=None, options=None, kwargs=None):
+        super(Retry, self).__init__(exc, countdown)
+        self.exc = exc
+        self.countdown = countdown
+        self.options = options or {}
+        self.kwargs = kwargs
+
+
+class MaxRetriesExceededError(Exception):
+    pass
+
+
+class Request(object):
+    """
+    Context of a task run by a local executor (subset of celery task request).
+    """
+
+    def __init__(self, retries=0, called_directly=False, args=(), kwargs=None):
+        self.retries = retries
+        self.called_directly = called_directly
+        self.args = args
+        self.kwargs = kwargs or {}
+
+
+def get_task_logger(name):
+    try:
+        from celery.utils.log import get_task_logger
+    except ImportError:
+        return logging.getLogger(name)
+    return get_task_logger(name)
+
+
+def _get_task_kwargs(kwargs):
+    # retry state is read from the request, not passed to the task function
+    return dict((key, value) for key, value in (kwargs or {}).items() if key != RETRY_STATE_KWARG)
+
+
+def _make_celery_task(fun, name, bind, options):
+    try:
+        from celery import shared_task
+    except ImportError:
+        return None
+
+    @wraps(fun)
+    def run(*args, **kwargs):
+        return fun(*args, **_get_task_kwargs(kwargs))
+    return shared_task(name=name, bind=bind, **options)(run)
+
+
+def _get_backend(module):
+    # tasks of backend 'getpaid.backends.payu' live in 'getpaid.backends.payu.tasks'
+    if module.endswith('.tasks'):
+        return module[:-len('.tasks')]
+    return None
+
+
+class Task(object):
+
+    def __init__(self, fun, name=None, bind=False, backend=None, kind=routing.CHECK, **options):
+        self.fun = fun
+        self.name = name or '%s.%s' % (fun.__module__, fun.__name__)
+        self.bind = bind
+        self.backend = backend or _get_backend(fun.__module__)
+        self.kind = kind
+        self.max_retries = options.get('max_retries', DEFAULT_MAX_RETRIES)
+        self.celery_task = _make_celery_task(fun, self.name, bind, options)
+        self.__name__ = fun.__name__
+        self.__module__ = fun.__module__
+        self.__doc__ = fun.__doc__
+        self._local = threading.local()
+
+    def __repr__(self):
+        return '<Task %s>' % self.name
+
+    @property
+    def request(self):
+        return getattr(self._local, 'request', None) or Request(called_directly=True)
+
+    def __call__(self, *args, **kwargs):
+        return self.run(args, kwargs)
+
+    def run(self, args=(), kwargs=None, retries=0):
+        """
+        Runs the task in the current thread as attempt ``retries`` (counted from 0).
+        """
+        previous = getattr(self._local, 'request', None)
+        self._local.request = Request(retries, args=args, kwargs=kwargs)
+        try:
+            if self.bind:
+                return self.fun(self, *args, **_get_task_kwargs(kwargs))
+            return self.fun(*args, **_get_task_kwargs(kwargs))
+        finally:
+            self._local.request = previous
+
+    def get_options(self, kind=None):
+        return routing.get_options(self.backend, kind or self.kind)
+
+    def retry(self, exc=None, countdown=None, max_retries=None, kwargs=None, **options):
+        """
+        Returns :class:`Retry` to be raised by the task; raises ``exc`` if it ran out of attempts.
+        ``kwargs`` replace keyword arguments of the retry, ``options`` (queue, priority) apply to it.
+        """
+        if max_retries is None:
+            max_retries = self.max_retries
+        if self.request.retries >= max_retries:
+            if exc is not None:
+                raise exc
+            raise MaxRetriesExceededError("Can't retry %s, it was retried %d times" % (self.name, max_retries))
+        return Retry(exc, countdown, options, kwargs)
+
+    def delay(self, *args, **kwargs):
+        return submit(self, args, kwargs)
+
+    def apply_async(self, args=(), kwargs=None, countdown=None, **options):
+        return submit(self, args, kwargs, countdown, **options)
+
+
+def task(*args, **options):
+    """
+    Decorator declaring a task; usable as ``@task`` or ``@task(bind=True, max_retries=...)``.
+    """
+    if len(args) == 1 and callable(args[0]) and not options:
+        return Task(args[0])
+
+    def decorator(fun):
+        return Task(fun, **options)
+    return decorator
+
+
+def _run(task, args, kwargs, retries):
+    if isinstance(task, Task):
+        return task.run(args, kwargs, retries)
+    return task(*args, **(kwargs or {}))
+
+
+class CeleryExecutor(object):
+
+    def submit(self, task, args=(), kwargs=None, countdown=None, **options):
+        if isinstance(task, Task):
+            if task.celery_task is None:
+                raise ImproperlyConfigured("GETPAID_TASK_EXECUTOR 'celery' requires celery to be installed")
+            task = task.celery_task
+        options = dict((name, value) for name, value in routing.get_celery_options(options).items()
+                       if value is not None)
+        if countdown is None and not options:
+            return task.delay(*args, **(kwargs or {}))
+        return task.apply_async(args, kwargs, countdown=countdown, **options)
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+class SyncExecutor(object):
+    """
+    Runs tasks right away in the caller. Retries are run at once, without waiting for the countdown.
+    """
+
+    def submit(self, task, args=(), kwargs=None, countdown=None, **options):
+        retries = 0
+        while True:
+            try:
+                return _run(task, args, kwargs, retries)
+            except Retry as e:
+                if e.kwargs is not None:
+                    kwargs = e.kwargs
+                retries += 1
+
+    def shutdown(self, timeout=None):
+        pass
+
+
+def _close_connections():
+    # connections are per thread, close those of a finishing thread
+    for connection in connections.all():
+        connection.close()
+
+
+class ThreadExecutor(object):
+    """
+    Runs tasks in a pool of ``threads`` threads fed by a queue of at most ``queue_size`` tasks,
+    higher ``priority`` first; when the queue is full, tasks are run by the submitting thread.
+    Retries are queued after their countdown. :meth:`shutdown` (called on interpreter exit)
+    finishes queued tasks and drops pending retries.
+    """
+
+    def __init__(self, threads=DEFAULT_THREADS, queue_size=DEFAULT_QUEUE_SIZE):
+        self.queue = queue.PriorityQueue(queue_size)
+        self.counter = itertools.count()
+        self.timers = set()
+        self.lock = threading.Lock()
+        self.closed = False
+        self.threads = []
+        for i in range(threads):
+            thread = threading.Thread(target=self.work, name='getpaid-task-%d' % i)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, task, args=(), kwargs=None, countdown=None, priority=None, retries=0, **options):
+        if countdown:
+            with self.lock:
+                if not self.closed:
+                    timer = threading.Timer(countdown, self._submit_later, (task, args, kwargs, priority, retries))
+                    timer.daemon = True
+                    self.timers.add(timer)
+                    timer.start()
+                    return
+            logger.warning('Task %r dropped, executor is shut down', task)
+            return
+        if not self.closed:
+            try:
+                # FIFO within a priority; shutdown markers go after all tasks
+                self.queue.put_nowait((-(priority or 0), next(self.counter), (task, args, kwargs, retries)))
+                return
+            except queue.Full:
+                logger.warning('Task queue is full, running %r in the caller', task)
+        self.execute(task, args, kwargs, retries)
+
+    def _submit_later(self, task, args, kwargs, priority, retries):
+        with self.lock:
+            self.timers.discard(threading.current_thread())
+        try:
+            self.submit(task, args, kwargs, priority=priority, retries=retries)
+        finally:
+            # the task could run in this thread if the queue was full
+            _close_connections()
+
+    def execute(self, task, args, kwargs, retries):
+        try:
+            _run(task, args, kwargs, retries)
+        except Retry as e:
+            kwargs = kwargs if e.kwargs is None else e.kwargs
+            self.submit(task, args, kwargs, e.countdown, e.options.get('priority'), retries + 1)
+        except Exception:
+            logger.exception('Task %r failed', task)
+
+    def work(self):
+        try:
+            while True:
+                priority, order, item = self.queue.get()
+                try:
+                    if item is None:
+                        return
+                    # like celery's Django fixup, drop broken connections and those older than CONN_MAX_AGE
+                    close_old_connections()
+                    try:
+                        self.execute(*item)
+                    finally:
+                        close_old_connections()
+                finally:
+                    self.queue.task_done()
+        finally:
+            _close_connections()
+
+    def shutdown(self, timeout=DEFAULT_SHUTDOWN_TIMEOUT):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            timers, self.timers = self.timers, set()
+        for timer in timers:
+            timer.cancel()
+        if timers:
+            logger.warning('%d pending task retries dropped on shutdown', len(timers))
+        deadline = time.time() + timeout
+        for thread in self.threads:
+            try:
+                self.queue.put((SHUTDOWN_PRIORITY, next(self.counter), None), timeout=max(0, deadline - time.time()))
+            except queue.Full:
+                break
+        for thread in self.threads:
+            thread.join(max(0, deadline - time.time()))
+        if any(thread.is_alive() for thread in self.threads):
+            logger.warning('Task executor did not finish within %s s', timeout)
+
+
+def get_executor_name():
+    # GETPAID_SCHEDULER_EXECUTOR is the former name of the setting
+    return getattr(settings, 'GETPAID_TASK_EXECUTOR', None) or \
+        getattr(settings, 'GETPAID_SCHEDULER_EXECUTOR', DEFAULT_EXECUTOR)
+
+
+def _create_executor(name):
+    if name == 'celery':
+        return CeleryExecutor()
+    if name == 'sync':
+        return SyncExecutor()
+    if name == 'thread':
+        executor = ThreadExecutor(
+            threads=getattr(settings, 'GETPAID_TASK_THREADS', None) or
+            getattr(settings, 'GETPAID_SCHEDULER_THREADS', DEFAULT_THREADS),
+            queue_size=getattr(settings, 'GETPAID_TASK_QUEUE_SIZE', DEFAULT_QUEUE_SIZE),
+        )
+        atexit.register(executor.shutdown, getattr(settings, 'GETPAID_TASK_SHUTDOWN_TIMEOUT',
+                                                   DEFAULT_SHUTDOWN_TIMEOUT))
+        return executor
+    raise ImproperlyConfigured("GETPAID_TASK_EXECUTOR has to be one of 'celery', 'thread' or 'sync'")
+
+
+def get_executor():
+    """
+    Returns shared instance of the executor selected with ``GETPAID_TASK_EXECUTOR``.
+    """
+    name = get_executor_name()
+    with _executors_lock:
+        if name not in _executors:
+            _executors[name] = _create_executor(name)
+        return _executors[name]
+
+
+def submit(task, args=(), kwargs=None, countdown=None, **options):
+    """
+    Runs ``task(*args, **kwargs)`` with the configured executor, after ``countdown`` seconds if given.
+    ``task`` is a :class:`Task` or, for executors other than celery, any callable. ``options`` (queue,
+    priority) default to the route of the task.
+    """
+    if isinstance(task, Task):
+        options = dict(task.get_options(), **options)
+    return get_executor().submit(task, args, kwargs, countdown, **options)
+
+
+@receiver(setting_changed)
+def reset_executors(sender, setting, **kwargs):
+    if setting.startswith('GETPAID_TASK_') or setting in ('GETPAID_SCHEDULER_EXECUTOR', 'GETPAID_SCHEDULER_THREADS'):
+        with _executors_lock:
+            executor = _executors.pop('thread', None)
+        if executor is not None:
+            executor.shutdown(0)
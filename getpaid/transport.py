@@ -0,0 +1,236 @@
+# coding: utf8
+"""
+HTTP transport used by backends for server to server calls to payment
+gateways.
+
+Default transport keeps a pool of keep-alive connections per backend and
+gateway host and applies per-backend timeouts and retry policy, which can be
+set in ``GETPAID_BACKENDS_SETTINGS``::
+
+    'getpaid.backends.payu': {
+        'http_connect_timeout': 5,
+        'http_read_timeout': 30,
+        'http_retries': 2,
+    }
+
+Failed connections are retried for every request, read errors and 5xx
+responses only for idempotent HTTP methods. Transport class can be replaced
+with ``GETPAID_TRANSPORT`` setting, e.g. with :class:`FakeTransport` in tests.
+"""
+from collections import namedtuple
+import logging
+import threading
+
+from django.conf import settings
+from django.dispatch import receiver
+from django.utils import six
+from django.utils.module_loading import import_string
+from django.utils.six.moves.urllib.parse import urlsplit
+
+from getpaid import events
+from getpaid.utils import get_backend_config
+
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # django < 1.8
+    from django.test.signals import setting_changed
+
+logger = logging.getLogger('getpaid.transport')
+
+DEFAULT_TRANSPORT = 'getpaid.transport.RequestsTransport'
+DEFAULT_CONNECT_TIMEOUT = 5
+DEFAULT_READ_TIMEOUT = 30
+DEFAULT_RETRIES = 2
+RETRY_BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (500, 502, 503, 504)
+POOL_MAXSIZE = 10
+
+
+class TransportError(Exception):
+    """
+    Gateway could not be reached or answered with an error status.
+    """
+
+    def __init__(self, message, status_code=None):
+        super(TransportError, self).__init__(message)
+        self.status_code = status_code
+
+
+class TransportResponse(object):
+
+    def __init__(self, status_code, content, encoding=None, url=None):
+        self.status_code = status_code
+        self.content = content
+        self.encoding = encoding or 'utf-8'
+        self.url = url
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding)
+
+
+class BaseTransport(object):
+    """
+    Transport interface. ``data`` is sent form encoded when it is a dict.
+    Error responses (status 400 and above) raise :class:`TransportError`.
+    """
+
+    def request(self, backend, method, url, data=None, headers=None, auth=None):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    @staticmethod
+    def get_options(backend):
+        """
+        Returns ``(connect_timeout, read_timeout, retries)`` for the backend.
+        """
+        config = get_backend_config(backend)
+        return (config.get('http_connect_timeout', DEFAULT_CONNECT_TIMEOUT),
+                config.get('http_read_timeout', DEFAULT_READ_TIMEOUT),
+                config.get('http_retries', DEFAULT_RETRIES))
+
+
+class RequestsTransport(BaseTransport):
+    """
+    Transport on ``requests`` sessions, one per backend and gateway host.
+    """
+
+    def __init__(self):
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    def get_session(self, backend, url):
+        parts = urlsplit(url)
+        key = (backend, parts.scheme, parts.netloc)
+        session = self._sessions.get(key)
+        if session is None:
+            with self._lock:
+                session = self._sessions.get(key)
+                if session is None:
+                    session = self._sessions[key] = self._create_session(backend, parts.scheme)
+        return session
+
+    def _create_session(self, backend, scheme):
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.packages.urllib3.util.retry import Retry
+
+        retries = self.get_options(backend)[2]
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=POOL_MAXSIZE,
+            max_retries=Retry(total=retries, backoff_factor=RETRY_BACKOFF_FACTOR,
+                              status_forcelist=RETRY_STATUSES, raise_on_status=False),
+        )
+        session.mount('%s://' % scheme, adapter)
+        return session
+
+    def request(self, backend, method, url, data=None, headers=None, auth=None):
+        import requests
+
+        connect_timeout, read_timeout = self.get_options(backend)[:2]
+        session = self.get_session(backend, url)
+        try:
+            response = session.request(method, url, data=data, headers=headers, auth=auth,
+                                       timeout=(connect_timeout, read_timeout))
+        except requests.RequestException as e:
+            logger.warning(u'%s %s failed: %s', method, url, e)
+            raise TransportError(u'%s %s failed: %s' % (method, url, e))
+        if response.status_code >= 400:
+            raise TransportError(u'%s %s returned status %s' % (method, url, response.status_code),
+                                 status_code=response.status_code)
+        return TransportResponse(response.status_code, response.content, response.encoding, url)
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+
+
+FakeRequest = namedtuple('FakeRequest', 'backend method url data headers auth')
+
+
+class FakeTransport(BaseTransport):
+    """
+    Transport for tests - records requests and answers them with responses
+    added with :meth:`add_response`. The last response added for an URL is
+    repeated for further requests.
+    """
+
+    def __init__(self):
+        self.responses = {}
+        self.requests = []
+
+    def reset(self):
+        self.responses.clear()
+        del self.requests[:]
+
+    def add_response(self, url, content=b'', status_code=200, encoding=None):
+        if isinstance(content, six.text_type):
+            content = content.encode(encoding or 'utf-8')
+        self.responses.setdefault(url, []).append(TransportResponse(status_code, content, encoding, url))
+
+    def request(self, backend, method, url, data=None, headers=None, auth=None):
+        self.requests.append(FakeRequest(backend, method, url, data, headers, auth))
+        responses = self.responses.get(url)
+        if not responses:
+            raise TransportError(u'%s %s has no fake response' % (method, url))
+        response = responses.pop(0) if len(responses) > 1 else responses[0]
+        if response.status_code >= 400:
+            raise TransportError(u'%s %s returned status %s' % (method, url, response.status_code),
+                                 status_code=response.status_code)
+        return response
+
+
+_transport = {}
+
+
+def get_transport():
+    """
+    Returns shared instance of ``GETPAID_TRANSPORT`` class.
+    """
+    try:
+        return _transport['instance']
+    except KeyError:
+        pass
+    transport_class = import_string(getattr(settings, 'GETPAID_TRANSPORT', DEFAULT_TRANSPORT))
+    transport = _transport.setdefault('instance', transport_class())
+    return transport
+
+
+def request(backend, method, url, payment_id=None, **kwargs):
+    """
+    Makes the request with the configured transport. Outcome of the call is recorded in the log of
+    payment ``payment_id``, if given.
+    """
+    if payment_id is None:
+        return get_transport().request(backend, method, url, **kwargs)
+    try:
+        response = get_transport().request(backend, method, url, **kwargs)
+    except TransportError as e:
+        events.record(payment_id, events.GATEWAY, backend, data={'method': method, 'url': url, 'error': e,
+                                                                 'status_code': e.status_code})
+        raise
+    events.record(payment_id, events.GATEWAY, backend, data={'method': method, 'url': url,
+                                                             'status_code': response.status_code})
+    return response
+
+
+def get(backend, url, **kwargs):
+    return request(backend, 'GET', url, **kwargs)
+
+
+def post(backend, url, **kwargs):
+    return request(backend, 'POST', url, **kwargs)
+
+
+@receiver(setting_changed)
+def reset_transport(sender, setting, **kwargs):
+    if setting in ('GETPAID_TRANSPORT', 'GETPAID_BACKENDS_SETTINGS'):
+        transport = _transport.pop('instance', None)
+        if transport is not None:
+            transport.close()
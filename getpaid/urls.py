@@ -1,15 +1,21 @@
-from django.conf.urls import patterns, url, include
-from getpaid.views import NewPaymentView, FallbackView
-from getpaid.utils import import_backend_modules
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.core.urlresolvers import RegexURLResolver
+from getpaid.views import NewPaymentView, FallbackView, ExportView, PaymentListView
 
+# Backend URLconfs are given to resolvers by dotted path (``include()`` would
+# import them right away), so their views and whatever third party libraries
+# they pull in are only imported on first URL resolving or reversing.
 includes_list = []
-for backend_name, urls in list(import_backend_modules('urls').items()):
-    includes_list.append(url(r'^%s/' % backend_name, include(urls)))
+for backend_name in getattr(settings, 'GETPAID_BACKENDS', []):
+    includes_list.append(RegexURLResolver(r'^%s/' % backend_name, '%s.urls' % backend_name))
 
 urlpatterns = patterns('',
     url(r'^new/payment/(?P<currency>[A-Z]{3})/$', NewPaymentView.as_view(), name='getpaid-new-payment'),
     url(r'^payment/success/(?P<pk>\d+)/$', FallbackView.as_view(success=True), name='getpaid-success-fallback'),
     url(r'^payment/failure/(?P<pk>\d+)$', FallbackView.as_view(success=False), name='getpaid-failure-fallback'),
+    url(r'^export/$', ExportView.as_view(), name='getpaid-export'),
+    url(r'^payments/$', PaymentListView.as_view(), name='getpaid-payments'),
     *includes_list
 
 )
@@ -5,12 +5,22 @@ from importlib import import_module
 
 from django.apps import apps
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.dispatch import receiver
 from django.utils import six
-from django.core.urlresolvers import reverse
+from django.core.urlresolvers import NoReverseMatch, get_script_prefix, reverse
+from django.template.base import Template
 from django.utils.functional import SimpleLazyObject
+from django.utils.module_loading import import_string
 from django.utils.six.moves.urllib.parse import parse_qsl
+from django.utils.translation import get_language
 import django
 
+try:
+    from django.core.signals import setting_changed
+except ImportError:  # django < 1.8
+    from django.test.signals import setting_changed
+
 Site = SimpleLazyObject(lambda: apps.get_model('sites.Site'))
 
 if six.PY3:
@@ -34,26 +44,54 @@ def import_backend_modules(submodule=None):
     return modules
 
 
+class BackendsRegistry(object):
+    """
+    Index of enabled backends built once from ``GETPAID_BACKENDS``.
+
+    Keeps ``(backend, name, logo_url)`` entries in ``GETPAID_BACKENDS`` order,
+    both for all backends and per accepted currency.
+    """
+
+    def __init__(self, backends_names):
+        self.backends = OrderedDict()
+        self.currencies = {}
+        for backend_name in backends_names:
+            processor = import_name(backend_name).PaymentProcessor
+            entry = (backend_name, processor.BACKEND_NAME, processor.get_logo_url())
+            self.backends[backend_name] = entry
+            for currency in processor.BACKEND_ACCEPTED_CURRENCY:
+                self.currencies.setdefault(currency, []).append(entry)
+
+    def get_backends(self, currency=None):
+        if currency:
+            return self.currencies.get(currency, [])
+        return list(self.backends.values())
+
+    def get_logo_url(self, backend_name):
+        return self.backends[backend_name][2]
+
+
+_backends_registry = None
+
+
+def get_backends_registry():
+    """
+    Returns ``BackendsRegistry`` of enabled backends. It is built on first use
+    and dropped whenever ``GETPAID_BACKENDS`` changes.
+    """
+    global _backends_registry
+    if _backends_registry is None:
+        _backends_registry = BackendsRegistry(getattr(settings, 'GETPAID_BACKENDS', []))
+    return _backends_registry
+
+
 def get_backend_choices(currency=None):
     """
     Get active backends modules. Backend list can be filtered by
     supporting given currency.
     """
-    choices = []
-    backends_names = getattr(settings, 'GETPAID_BACKENDS', [])
-
-    for backend_name in backends_names:
-        backend = import_name(backend_name)
-        if currency:
-            if currency in backend.PaymentProcessor.BACKEND_ACCEPTED_CURRENCY:
-                choices.append(
-                    (backend_name, backend.PaymentProcessor.BACKEND_NAME)
-                )
-        else:
-            choices.append(
-                (backend_name, backend.PaymentProcessor.BACKEND_NAME)
-            )
-    return choices
+    return [(backend_name, name) for backend_name, name, logo_url
+            in get_backends_registry().get_backends(currency)]
 
 
 def get_backend_settings(backend):
@@ -68,15 +106,180 @@ def get_backend_settings(backend):
         return {}
 
 
+class BackendConfig(object):
+    """
+    Immutable snapshot of a single backend configuration.
+
+    Values from ``GETPAID_BACKENDS_SETTINGS`` are merged over the
+    ``BACKEND_DEFAULT_SETTINGS`` of the backend ``PaymentProcessor`` and
+    exposed as attributes. Reading a required setting that was not provided
+    raises ``ImproperlyConfigured``.
+    """
+    __slots__ = ('backend', 'required', '_values')
+
+    def __init__(self, backend, values, defaults=None, required=()):
+        merged = dict(defaults or {})
+        merged.update(values)
+        object.__setattr__(self, 'backend', backend)
+        object.__setattr__(self, 'required', tuple(required))
+        object.__setattr__(self, '_values', merged)
+
+    def __getattr__(self, name):
+        try:
+            return self._values[name]
+        except KeyError:
+            raise ImproperlyConfigured("getpaid '%s' requires backend '%s' setting" % (self.backend, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("%s is read-only" % type(self).__name__)
+
+    def __contains__(self, name):
+        return name in self._values
+
+    def get(self, name, default=None):
+        return self._values.get(name, default)
+
+    def missing(self):
+        """
+        Returns names of required settings that were not provided.
+        """
+        return [name for name in self.required if name not in self._values]
+
+
+_backend_configs = {}
+
+
+def get_backend_config(backend):
+    """
+    Returns ``BackendConfig`` snapshot for given backend. Snapshots are built
+    once and dropped whenever getpaid settings change.
+    """
+    try:
+        return _backend_configs[backend]
+    except KeyError:
+        pass
+    processor = import_name(backend).PaymentProcessor
+    config = BackendConfig(backend, get_backend_settings(backend),
+                           defaults=processor.BACKEND_DEFAULT_SETTINGS,
+                           required=processor.BACKEND_REQUIRED_SETTINGS)
+    _backend_configs[backend] = config
+    return config
+
+
+def build_backend_configs():
+    """
+    Builds configuration snapshots for all enabled backends. Backends that
+    cannot be imported are skipped here and reported by system checks.
+    """
+    _backend_configs.clear()
+    for backend_name in getattr(settings, 'GETPAID_BACKENDS', []):
+        try:
+            get_backend_config(backend_name)
+        except (ImportError, AttributeError):
+            pass
+
+
+_order_description = {}
+
+
+def get_order_description_template():
+    """
+    Returns compiled ``GETPAID_ORDER_DESCRIPTION`` template or ``None`` if
+    the setting is empty. Template is compiled only once.
+    """
+    try:
+        return _order_description['template']
+    except KeyError:
+        pass
+    source = getattr(settings, 'GETPAID_ORDER_DESCRIPTION', None)
+    template = Template(source) if source else None
+    _order_description['template'] = template
+    return template
+
+
+def get_order_description_func():
+    """
+    Returns ``GETPAID_ORDER_DESCRIPTION_FUNC`` callable (it can be given as
+    a dotted path) or ``None`` if the setting is empty.
+    """
+    try:
+        return _order_description['func']
+    except KeyError:
+        pass
+    func = getattr(settings, 'GETPAID_ORDER_DESCRIPTION_FUNC', None)
+    if isinstance(func, six.string_types):
+        func = import_string(func)
+    _order_description['func'] = func
+    return func
+
+
+@receiver(setting_changed)
+def reset_caches(sender, setting, **kwargs):
+    global _backends_registry
+    if setting in ('GETPAID_BACKENDS', 'GETPAID_BACKENDS_SETTINGS'):
+        _backend_configs.clear()
+    if setting == 'GETPAID_BACKENDS':
+        _backends_registry = None
+    if setting in ('GETPAID_ORDER_DESCRIPTION', 'GETPAID_ORDER_DESCRIPTION_FUNC'):
+        _order_description.clear()
+    if setting in ('SITE_ID', 'ROOT_URLCONF'):
+        clear_url_cache()
+
+
+_domains = {}
+_url_templates = {}
+_URL_PLACEHOLDER = 987654321000
+
+
+def _get_url_template(view_name, scheme, domain, kwargs_names):
+    """
+    Returns absolute URL of ``view_name`` as a format string with
+    ``kwargs_names`` placeholders, e.g. ``https://example.com/success/{pk}/``.
+    Returns ``None`` if view cannot be reversed with numeric placeholders.
+    Templates depend on the script prefix and the active language (``i18n_patterns``).
+    """
+    key = (view_name, scheme, domain, kwargs_names, get_script_prefix(), get_language())
+    try:
+        return _url_templates[key]
+    except KeyError:
+        pass
+    placeholders = dict((name, six.text_type(_URL_PLACEHOLDER + i))
+                        for i, name in enumerate(kwargs_names))
+    try:
+        path = reverse(view_name, kwargs=placeholders)
+    except NoReverseMatch:
+        template = None
+    else:
+        template = u"{0}://{1}/{2}".format(scheme, domain.rstrip('/'), path.lstrip('/'))
+        template = template.replace(u'{', u'{{').replace(u'}', u'}}')
+        for name, value in placeholders.items():
+            template = template.replace(value, u'{%s}' % name)
+    _url_templates[key] = template
+    return template
+
+
+def clear_url_cache(**kwargs):
+    """
+    Drops cached domains and URL templates. Connected to ``Site`` changes.
+    """
+    _domains.clear()
+    _url_templates.clear()
+
+
 def build_absolute_uri(view_name, scheme='https', domain=None,
                        reverse_args=None, reverse_kwargs=None):
-    if not reverse_args:
-        reverse_args = ()
     if not reverse_kwargs:
         reverse_kwargs = {}
     if domain is None:
         domain = get_domain()
 
+    if not reverse_args and all(isinstance(value, six.integer_types) and not isinstance(value, bool) and value >= 0
+                                for value in reverse_kwargs.values()):
+        # other values could be rejected by URL patterns or need quoting, they are reversed below
+        template = _get_url_template(view_name, scheme, domain, tuple(sorted(reverse_kwargs)))
+        if template is not None:
+            return template.format(**reverse_kwargs)
+
     path = reverse(view_name, args=reverse_args, kwargs=reverse_kwargs)
     domain = domain.rstrip('/')
     path = path.lstrip('/')
@@ -99,12 +302,25 @@ def qs_to_ordered_params(query_string):
 
 
 def get_domain(request=None):
+    """
+    Returns ``GETPAID_SITE_DOMAIN`` or domain of current ``Site``. Domains of
+    sites are cached per ``SITE_ID`` (or request host if it is not set).
+    """
     if (hasattr(settings, 'GETPAID_SITE_DOMAIN') and
             settings.GETPAID_SITE_DOMAIN):
         return settings.GETPAID_SITE_DOMAIN
+    key = getattr(settings, 'SITE_ID', None)
+    if key is None and request is not None:
+        key = request.get_host()
+    try:
+        return _domains[key]
+    except KeyError:
+        pass
     if django.VERSION[:2] >= (1, 8):
         site = Site.objects.get_current(request=request)
     else:
         site = Site.objects.get_current()
 
+    if key is not None:
+        _domains[key] = site.domain
     return site.domain
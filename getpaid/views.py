@@ -1,14 +1,20 @@
 # getpaid views
 import logging
 from django.conf import settings
+from django.contrib.admin.views.decorators import staff_member_required
 from django.core.exceptions import PermissionDenied, ImproperlyConfigured
 from django.core.urlresolvers import reverse
-from django.http import Http404, HttpResponseRedirect
+from django.http import Http404, HttpResponseBadRequest, HttpResponseRedirect, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django.template.response import TemplateResponse
-from django.views.generic.base import RedirectView
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+from django.utils.decorators import method_decorator
+from django.views.generic.base import RedirectView, View
 from django.views.generic.edit import FormView
+from getpaid import export, listing
 from getpaid.forms import PaymentMethodForm, ValidationError
+from getpaid.replicas import ReadReplicaMixin
 from getpaid.signals import (redirecting_to_payment_gateway_signal,
                              order_additional_validation)
 
@@ -68,7 +74,7 @@ class NewPaymentView(FormView):
         raise PermissionDenied
 
 
-class FallbackView(RedirectView):
+class FallbackView(ReadReplicaMixin, RedirectView):
     success = None
     permanent = False
 
@@ -85,3 +91,73 @@ class FallbackView(RedirectView):
             if url_name is not None:
                 return reverse(url_name, kwargs={'pk': self.payment.order_id})
         return self.payment.order.get_absolute_url()
+
+
+class ExportView(View):
+    """
+    Streams payments as CSV or JSON lines to staff users. Accepts ``format`` (``csv`` or ``jsonl``),
+    ``status``, ``backend`` and ``currency`` (each can be repeated), ``from`` and ``to`` (YYYY-MM-DD)
+    query parameters.
+    """
+    http_method_names = ['get']
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(ExportView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        format = request.GET.get('format', 'csv')
+        if format not in export.FORMATS:
+            return HttpResponseBadRequest('Unknown format')
+        try:
+            created_from = export.parse_day(request.GET.get('from'))
+            created_to = export.parse_day(request.GET.get('to'))
+        except ValueError:
+            return HttpResponseBadRequest('Invalid date')
+
+        lines = export.export(format, statuses=request.GET.getlist('status'),
+                              backends=request.GET.getlist('backend'), currencies=request.GET.getlist('currency'),
+                              created_from=created_from, created_to=created_to)
+        response = StreamingHttpResponse(lines, content_type=export.CONTENT_TYPES[format])
+        response['Content-Disposition'] = 'attachment; filename="payments.%s"' % format
+        return response
+
+
+class PaymentListView(View):
+    """
+    Returns a page of payments as JSON to staff users, see ``getpaid.listing``. Accepts ``status``,
+    ``backend`` and ``currency`` (each can be repeated), ``updated_since`` (ISO 8601 date and time),
+    ``limit`` and ``cursor`` (``next`` value of the previous page) query parameters.
+    """
+    http_method_names = ['get']
+
+    @method_decorator(staff_member_required)
+    def dispatch(self, request, *args, **kwargs):
+        return super(PaymentListView, self).dispatch(request, *args, **kwargs)
+
+    def get(self, request):
+        try:
+            page_size = min(int(request.GET.get('limit', listing.DEFAULT_PAGE_SIZE)), listing.MAX_PAGE_SIZE)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid limit')
+        if page_size < 1:
+            return HttpResponseBadRequest('Invalid limit')
+        updated_since = request.GET.get('updated_since')
+        if updated_since:
+            try:
+                updated_since = parse_datetime(updated_since)
+            except ValueError:
+                updated_since = None
+            if updated_since is None:
+                return HttpResponseBadRequest('Invalid updated_since')
+            if getattr(settings, 'USE_TZ', False) and timezone.is_naive(updated_since):
+                updated_since = timezone.make_aware(updated_since, timezone.get_current_timezone())
+
+        try:
+            rows, next_cursor = listing.get_page(
+                request.GET.get('cursor'), page_size, statuses=request.GET.getlist('status'),
+                backends=request.GET.getlist('backend'), currencies=request.GET.getlist('currency'),
+                updated_since=updated_since)
+        except ValueError:
+            return HttpResponseBadRequest('Invalid cursor')
+        return JsonResponse({'results': rows, 'next': next_cursor})
@@ -0,0 +1,104 @@
+from datetime import timedelta
+from optparse import make_option
+import random
+import timeit
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from getpaid_test_project.orders.models import Order
+
+BACKENDS = ('getpaid.backends.eservice', 'getpaid.backends.payu', 'getpaid.backends.transferuj')
+STATUSES = ('new', 'in_progress', 'paid', 'failed')
+
+
+class Command(BaseCommand):
+    help = ('Compare payment lookups with and without composite indexes of Payment model. Creates test payments '
+            'and drops the indexes within a transaction which is rolled back; use a throwaway database.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--payments', type='int', dest='payments', default=100000,
+                    help='Number of payments to create (default: 100000).'),
+        make_option('--repeat', type='int', dest='repeat', default=200,
+                    help='Number of times each lookup is run (default: 200).'),
+    )
+
+    def handle(self, *args, **options):
+        Payment = apps.get_model('getpaid', 'Payment')
+        with transaction.atomic():
+            self.populate(Payment, options['payments'])
+            lookups = self.get_lookups(Payment, options['payments'])
+            table = Payment._meta.db_table
+            indexes = self.get_composite_indexes(table)
+
+            with connection.schema_editor() as editor:
+                for name in indexes:
+                    editor.execute(editor.sql_delete_index % {
+                        'table': editor.quote_name(table), 'name': editor.quote_name(name)})
+            before = self.run(lookups, options['repeat'])
+
+            with connection.schema_editor() as editor:
+                for name, columns in indexes.items():
+                    editor.execute(editor.sql_create_index % {
+                        'table': editor.quote_name(table), 'name': editor.quote_name(name),
+                        'columns': ', '.join(editor.quote_name(column) for column in columns), 'extra': ''})
+            after = self.run(lookups, options['repeat'])
+
+            transaction.set_rollback(True)
+
+        self.stdout.write('%-40s %12s %12s' % ('lookup', 'before (ms)', 'after (ms)'))
+        for name, query in lookups:
+            self.stdout.write('%-40s %12.3f %12.3f' % (name, before[name][0], after[name][0]))
+        for label, results in (('before', before), ('after', after)):
+            self.stdout.write('\nQuery plans %s:' % label)
+            for name, query in lookups:
+                self.stdout.write('  %s: %s' % (name, results[name][1]))
+
+    def populate(self, Payment, count):
+        Order.objects.bulk_create([Order(name='benchmark') for i in range(count // 5 + 1)], batch_size=500)
+        order_ids = list(Order.objects.filter(name='benchmark').values_list('pk', flat=True))
+        Payment.objects.bulk_create([
+            Payment(order_id=order_ids[i // 5], amount=100, currency='PLN', backend=BACKENDS[i % len(BACKENDS)],
+                    status=STATUSES[i % len(STATUSES)], external_id='ext-%d' % i)
+            for i in range(count)
+        ], batch_size=500)
+        self.order_ids = order_ids
+
+    def get_composite_indexes(self, table):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, table)
+        return dict((name, constraint['columns']) for name, constraint in constraints.items()
+                    if constraint['index'] and not constraint['unique'] and not constraint['primary_key']
+                    and len(constraint['columns']) > 1)
+
+    def get_lookups(self, Payment, count):
+        cutoff = timezone.now() + timedelta(minutes=1)
+        return [
+            ('by_external_id', lambda: Payment.objects.by_external_id(
+                BACKENDS[0], 'ext-%d' % random.randrange(count)).order_by().values_list('pk')),
+            ('backend, status, created_on', lambda: Payment.objects.filter(
+                backend=BACKENDS[1], status='in_progress', created_on__lt=cutoff).order_by().values_list('pk')[:100]),
+            ('order, status', lambda: Payment.objects.filter(
+                order_id=random.choice(self.order_ids), status='paid').order_by().values_list('pk')),
+        ]
+
+    def run(self, lookups, repeat):
+        results = {}
+        for name, query in lookups:
+            elapsed = timeit.timeit(lambda: list(query()), number=repeat)
+            results[name] = (elapsed * 1000 / repeat, self.explain(query()))
+        return results
+
+    def explain(self, queryset):
+        sql, params = queryset.query.sql_with_params()
+        if connection.vendor == 'sqlite':
+            prefix = 'EXPLAIN QUERY PLAN '
+        elif connection.vendor in ('postgresql', 'mysql'):
+            prefix = 'EXPLAIN '
+        else:
+            return 'n/a'
+        with connection.cursor() as cursor:
+            cursor.execute(prefix + sql, params)
+            return '; '.join(' '.join(str(column) for column in row) for row in cursor.fetchall())
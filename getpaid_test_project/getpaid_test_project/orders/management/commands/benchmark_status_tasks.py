@@ -0,0 +1,69 @@
+from optparse import make_option
+import random
+import timeit
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from getpaid import transport
+from getpaid.backends.payu import PaymentProcessor
+from getpaid.backends.payu.tasks import get_payment_status_task
+from getpaid_test_project.orders.models import Order
+
+
+class Command(BaseCommand):
+    help = ('Measure database cost of PayU status check task and compare payment lookups of Payment.objects '
+            '(joins order) and Payment.lean managers. Creates test payments within a transaction which is '
+            'rolled back; gateway is answered by a fake transport.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--payments', type='int', dest='payments', default=10000,
+                    help='Number of payments to create (default: 10000).'),
+        make_option('--repeat', type='int', dest='repeat', default=1000,
+                    help='Number of lookups and tasks run (default: 1000).'),
+    )
+
+    def handle(self, *args, **options):
+        Payment = apps.get_model('getpaid', 'Payment')
+        previous_transport = transport._transport.get('instance')
+        transport._transport['instance'] = fake_transport = transport.FakeTransport()
+        fake_transport.add_response(PaymentProcessor._GATEWAY_URL + 'UTF/Payment/get/txt', u'status: ERROR\n')
+        try:
+            with transaction.atomic():
+                pks = self.populate(Payment, options['payments'])
+                results = []
+                for name in ('objects', 'lean'):
+                    manager = getattr(Payment, name)
+                    elapsed = timeit.timeit(lambda: manager.get(pk=random.choice(pks)), number=options['repeat'])
+                    sql = str(manager.filter(pk=pks[0]).query)
+                    results.append(('Payment.%s.get()' % name, elapsed, 1, 'JOIN' in sql))
+
+                with CaptureQueriesContext(connection) as queries:
+                    elapsed = timeit.timeit(lambda: get_payment_status_task(random.choice(pks), '1:1'),
+                                            number=options['repeat'])
+                results.append(('payu get_payment_status_task', elapsed,
+                                float(len(queries.captured_queries)) / options['repeat'],
+                                any('JOIN' in query['sql'] for query in queries.captured_queries)))
+                transaction.set_rollback(True)
+        finally:
+            if previous_transport is None:
+                transport._transport.pop('instance', None)
+            else:
+                transport._transport['instance'] = previous_transport
+
+        self.stdout.write('%-32s %10s %10s %6s' % ('', 'ms each', 'queries', 'join'))
+        for name, elapsed, queries, join in results:
+            self.stdout.write('%-32s %10.3f %10.1f %6s' % (name, elapsed * 1000 / options['repeat'], queries,
+                                                           'yes' if join else 'no'))
+
+    def populate(self, Payment, count):
+        Order.objects.bulk_create([Order(name='benchmark') for i in range(count)], batch_size=500)
+        order_ids = list(Order.objects.filter(name='benchmark').values_list('pk', flat=True))
+        Payment.objects.bulk_create([
+            Payment(order_id=order_id, amount=100, currency='PLN', backend=PaymentProcessor.BACKEND,
+                    status='in_progress')
+            for order_id in order_ids
+        ], batch_size=500)
+        return list(Payment.objects.filter(order__name='benchmark').values_list('pk', flat=True))
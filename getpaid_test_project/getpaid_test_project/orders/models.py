@@ -31,5 +31,17 @@ Payment = getpaid.register_to_payment(Order,
                                       unique=False,
                                       related_name='payments')
 
+
+@python_2_unicode_compatible
+class Invoice(models.Model):
+    """
+    Example of a project model referencing payments.
+    """
+    payment = models.ForeignKey(Payment, related_name='invoices')
+    number = models.CharField(max_length=30)
+
+    def __str__(self):
+        return self.number
+
 #noinspection PyUnresolvedReferences
 from .listeners import *
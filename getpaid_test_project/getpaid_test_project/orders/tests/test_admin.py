@@ -0,0 +1,78 @@
+# coding: utf8
+from datetime import timedelta
+
+from django.apps import apps
+from django.contrib.admin import AdminSite
+from django.contrib.auth.models import User
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.test import RequestFactory, TestCase
+
+from getpaid import transport
+from getpaid.admin import EstimatedCountPaginator, PaymentAdmin
+from getpaid_test_project.orders.factories import PaymentFactory
+from .utils import FakeEserviceTransport, create_payment, eservice_settings
+
+
+class PaymentAdminTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        self.admin = PaymentAdmin(self.Payment, AdminSite())
+        self.user = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+
+    def get_request(self, data=None):
+        request = RequestFactory().get('/admin/getpaid/payment/', data or {})
+        request.user = self.user
+        setattr(request, 'session', {})
+        setattr(request, '_messages', FallbackStorage(request))
+        return request
+
+    def test_paginator_counts_up_to_limit(self):
+        for i in range(3):
+            PaymentFactory()
+
+        class Paginator(EstimatedCountPaginator):
+            count_limit = 2
+
+        paginator = Paginator(self.Payment.objects.filter(status='new'), 1)
+        self.assertEqual(paginator.count, 2)
+        self.assertEqual(paginator.num_pages, 2)
+        self.assertEqual(EstimatedCountPaginator(self.Payment.objects.all(), 1).count, 3)
+
+    def test_changelist(self):
+        payment = create_payment(external_id='ext-1', age=timedelta(days=3))
+        PaymentFactory(external_id='ext-2')
+
+        response = self.admin.changelist_view(self.get_request({'created': '1'}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context_data['cl'].result_count, 1)
+
+        response = self.admin.changelist_view(self.get_request({'q': 'ext-1'}))
+        self.assertEqual([p.pk for p in response.context_data['cl'].result_list], [payment.pk])
+
+    def test_search(self):
+        payment = PaymentFactory(external_id='123')
+        other = PaymentFactory(external_id='other')
+        queryset, use_distinct = self.admin.get_search_results(self.get_request(), self.Payment.objects.all(),
+                                                               str(other.pk))
+        self.assertEqual([p.pk for p in queryset], [other.pk])
+        queryset, use_distinct = self.admin.get_search_results(self.get_request(), self.Payment.objects.all(), '123')
+        self.assertEqual([p.pk for p in queryset], [payment.pk])
+        self.assertFalse(use_distinct)
+
+    def test_recheck_status(self):
+        with eservice_settings():
+            transport._transport['instance'] = fake_transport = FakeEserviceTransport()
+            fake_transport.statuses = {'ext-paid': 'C'}
+            payment = PaymentFactory(backend='getpaid.backends.eservice', status='in_progress', external_id='ext-paid')
+            PaymentFactory(status='in_progress')  # payu cannot fetch status
+
+            request = self.get_request()
+            self.admin.recheck_status(request, self.Payment.objects.all())
+
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'paid')
+        self.assertEqual(len(fake_transport.requests), 1)
+        self.assertEqual([m.message for m in request._messages], [
+            'Statuses re-checked: getpaid.backends.eservice: paid=1',
+            '1 payments skipped, their backends cannot check status',
+        ])
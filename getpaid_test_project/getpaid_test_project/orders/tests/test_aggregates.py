@@ -0,0 +1,86 @@
+# coding: utf8
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+from django.apps import apps
+from django.core.management import call_command
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import six, timezone
+
+from getpaid import aggregates, archive
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.tests.utils import create_payment
+
+
+@override_settings(GETPAID_DAILY_AGGREGATES=True)
+class AggregatesTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        self.PaymentDailyAggregate = apps.get_model('getpaid', 'PaymentDailyAggregate')
+        self.today = aggregates.get_day(timezone.now())
+
+    def get_buckets(self):
+        return dict(((a.backend, a.currency, a.status), (a.count, a.amount, a.amount_paid))
+                    for a in self.PaymentDailyAggregate.objects.filter(count__gt=0))
+
+    def test_incremental(self):
+        first = PaymentFactory(status='in_progress')
+        second = PaymentFactory(status='in_progress')
+        PaymentFactory(currency='EUR', amount=10)
+        first.on_success()
+        second.on_success(Decimal('50'))
+        second.on_success(Decimal('200'))
+        self.assertFalse(first.change_status('partially_paid'))  # not allowed, nothing changes
+
+        self.assertEqual(self.get_buckets(), {
+            ('getpaid.backends.payu', 'PLN', 'paid'): (2, Decimal('400'), Decimal('400')),
+            ('getpaid.backends.payu', 'EUR', 'new'): (1, Decimal('10'), Decimal('0')),
+        })
+        self.assertEqual(self.PaymentDailyAggregate.objects.get(status='in_progress').count, 0)
+
+    def test_day_in_default_time_zone(self):
+        created_on = timezone.make_aware(datetime(2015, 1, 1, 23, 30), timezone.get_default_timezone())
+        with timezone.override('Asia/Tokyo'):
+            self.assertEqual(aggregates.get_day(created_on), date(2015, 1, 1))
+            payment = create_payment(status='in_progress', created_on=created_on)
+        aggregates.rebuild()
+        with timezone.override('Asia/Tokyo'):
+            self.Payment.objects.get(pk=payment.pk).on_success()
+        self.assertEqual(self.PaymentDailyAggregate.objects.get(status='paid').day, date(2015, 1, 1))
+        self.assertFalse(self.PaymentDailyAggregate.objects.filter(count__lt=0).exists())
+
+    def test_totals(self):
+        PaymentFactory(status='in_progress').on_success()
+        PaymentFactory(status='in_progress').on_failure()
+        PaymentFactory(backend='getpaid.backends.dummy', status='in_progress')
+
+        totals = aggregates.get_totals(self.today, self.today)
+        self.assertEqual((totals['count'], totals['amount'], totals['amount_paid']), (3, Decimal('600'), Decimal('200')))
+        self.assertEqual(aggregates.get_totals(self.today + timedelta(days=1))['count'], 0)
+        by_backend = aggregates.get_totals(group_by=['backend'], status='paid')
+        self.assertEqual([(row['backend'], row['count']) for row in by_backend], [('getpaid.backends.payu', 1)])
+
+        self.assertEqual(aggregates.get_conversion_rate(self.today, self.today), 1 / 3.0)
+        self.assertEqual(aggregates.get_conversion_rate(backend='getpaid.backends.payu'), 0.5)
+        self.assertIsNone(aggregates.get_conversion_rate(currency='EUR'))
+
+    def test_rebuild(self):
+        paid = PaymentFactory(status='in_progress')
+        paid.on_success()
+        old = create_payment(status='failed', age=timedelta(days=400))
+        old_day = self.today - timedelta(days=400)
+        archive.archive_chunk([old.pk])
+        self.Payment.objects.change_status('failed')  # bulk update does not change aggregates
+
+        out = six.StringIO()
+        call_command('getpaid_rebuild_aggregates', stdout=out)
+        self.assertIn('Rebuilt 2 daily aggregates', out.getvalue())
+        self.assertEqual(set(self.PaymentDailyAggregate.objects.values_list('day', 'status', 'count')),
+                         set([(self.today, 'failed', 1), (old_day, 'failed', 1)]))
+
+        aggregates.add(old_day, 'getpaid.backends.payu', 'PLN', 'failed', 5)
+        self.assertEqual(aggregates.rebuild(old_day, old_day), 1)
+        self.assertEqual(self.PaymentDailyAggregate.objects.get(day=old_day).count, 1)
+        self.assertEqual(self.PaymentDailyAggregate.objects.get(day=self.today).status, 'failed')
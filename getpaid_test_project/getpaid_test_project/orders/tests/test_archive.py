@@ -0,0 +1,77 @@
+# coding: utf8
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import six, timezone
+
+from getpaid import archive, events
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.tests.utils import create_payment
+
+
+class ArchiveTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        self.ArchivedPayment = apps.get_model('getpaid', 'ArchivedPayment')
+        self.created_on = timezone.now() - timedelta(days=400)
+        self.paid = self.create_payment('paid')
+        self.failed = self.create_payment('failed', order=self.paid.order)
+        self.in_progress = self.create_payment('in_progress')
+        self.fresh = PaymentFactory(status='paid')
+
+    def create_payment(self, status, **kwargs):
+        return create_payment(status=status, created_on=self.created_on, **kwargs)
+
+    def test_command(self):
+        events.record(self.paid.pk, events.NOTIFICATION)
+        out = six.StringIO()
+        call_command('getpaid_archive', chunk_size=1, stdout=out)
+        self.assertIn('Archived 2 payments', out.getvalue())
+
+        self.assertEqual(set(self.Payment.objects.values_list('pk', flat=True)),
+                         set([self.in_progress.pk, self.fresh.pk]))
+        archived = self.ArchivedPayment.objects.get(pk=self.paid.pk)
+        self.assertEqual((archived.status, archived.order_id, archived.created_on),
+                         ('paid', self.paid.order_id, self.created_on))
+        self.assertIsNotNone(archived.archived_on)
+        self.assertEqual(self.ArchivedPayment.objects.get(pk=self.failed.pk).status, 'failed')
+        self.assertTrue(apps.get_model('getpaid', 'PaymentEvent').objects.filter(payment_id=self.paid.pk).exists())
+
+    def test_dry_run(self):
+        out = six.StringIO()
+        call_command('getpaid_archive', dry_run=True, stdout=out)
+        self.assertIn('Would archive 2 payments', out.getvalue())
+        self.assertFalse(self.ArchivedPayment.objects.exists())
+
+    def test_resume(self):
+        moved = list(archive.archive_payments(chunk_size=1, start_after=self.paid.pk))
+        self.assertEqual(moved, [(1, self.failed.pk)])
+        self.assertTrue(self.Payment.objects.filter(pk=self.paid.pk).exists())
+
+    def test_status_changed_meanwhile(self):
+        self.assertEqual(archive.archive_chunk([self.in_progress.pk, self.paid.pk]), 1)
+        self.assertTrue(self.Payment.objects.filter(pk=self.in_progress.pk).exists())
+
+    def test_referenced_payments_are_kept(self):
+        Invoice = apps.get_model('orders', 'Invoice')
+        invoice = Invoice.objects.create(payment=self.paid, number='FV/1')
+        moved = list(archive.archive_payments(chunk_size=10))
+        self.assertEqual(moved, [(1, self.failed.pk)])
+        # deleting the payment would delete the invoice
+        self.assertTrue(self.Payment.objects.filter(pk=self.paid.pk).exists())
+        self.assertFalse(self.ArchivedPayment.objects.filter(pk=self.paid.pk).exists())
+        self.assertTrue(Invoice.objects.filter(pk=invoice.pk).exists())
+
+    def test_with_archived(self):
+        archive.archive_chunk([self.paid.pk])
+        combined = self.Payment.objects.with_archived()
+        self.assertEqual(combined.count(), 4)
+        self.assertEqual(set(p.pk for p in combined.filter(order=self.paid.order)), set([self.paid.pk, self.failed.pk]))
+        self.assertTrue(combined.filter(status='paid').exclude(pk=self.fresh.pk).exists())
+        self.assertIsInstance(combined.get(pk=self.paid.pk), self.ArchivedPayment)
+        self.assertIsInstance(combined.get(pk=self.failed.pk), self.Payment)
+        with self.assertRaises(self.Payment.DoesNotExist):
+            combined.get(pk=0)
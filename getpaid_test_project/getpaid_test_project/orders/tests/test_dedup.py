@@ -0,0 +1,82 @@
+# coding: utf8
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import timezone
+import mock
+
+from getpaid import dedup
+
+
+class CacheDedupStoreTestCase(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_guard(self):
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+            self.assertFalse(duplicate)
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+            self.assertTrue(duplicate)
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 2) as duplicate:
+            self.assertFalse(duplicate)
+        with dedup.notification_guard('getpaid.backends.transferuj', 'session', 1) as duplicate:
+            self.assertFalse(duplicate)
+        self.assertEqual(dedup.get_dropped_counts(['getpaid.backends.payu', 'getpaid.backends.transferuj']),
+                         {'getpaid.backends.payu': 1, 'getpaid.backends.transferuj': 0})
+
+    def test_forgotten_on_error(self):
+        with self.assertRaises(ValueError):
+            with dedup.notification_guard('getpaid.backends.payu', 'session', 1):
+                raise ValueError
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+            self.assertFalse(duplicate)
+
+    @override_settings(GETPAID_DEDUP_STORE=None)
+    def test_disabled(self):
+        for i in range(2):
+            with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+                self.assertFalse(duplicate)
+
+    @mock.patch('getpaid.tasks.submit')
+    def test_payu_online_repeat(self, submit):
+        data = {
+            'pos_id': '123456789',
+            'session_id': '1:11111',
+            'ts': '1111',
+            'sig': '2a78322c06522613cbd7447983570188',
+        }
+        for i in range(3):
+            response = self.client.post(reverse('getpaid-payu-online'), data)
+            self.assertEqual(response.content, b'OK')
+        self.assertEqual(submit.call_count, 1)
+        self.assertEqual(dedup.get_dropped_counts()['getpaid.backends.payu'], 2)
+
+
+@override_settings(GETPAID_DEDUP_STORE='getpaid.dedup.DatabaseDedupStore', GETPAID_DEDUP_WINDOW=60)
+class DatabaseDedupStoreTestCase(TestCase):
+
+    def test_guard(self):
+        for i in range(3):
+            with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+                self.assertEqual(duplicate, i > 0)
+        self.assertEqual(dedup.get_dropped_counts(['getpaid.backends.payu'])['getpaid.backends.payu'], 2)
+
+    def test_window(self):
+        NotificationReceipt = apps.get_model('getpaid', 'NotificationReceipt')
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 1):
+            pass
+        NotificationReceipt.objects.update(created_on=timezone.now() - timedelta(seconds=61))
+        with dedup.notification_guard('getpaid.backends.payu', 'session', 1) as duplicate:
+            self.assertFalse(duplicate)
+
+        NotificationReceipt.objects.update(created_on=timezone.now() - timedelta(seconds=61))
+        dedup.get_store().prune()
+        self.assertFalse(NotificationReceipt.objects.exists())
@@ -0,0 +1,92 @@
+# coding: utf8
+from datetime import timedelta
+import json
+import os
+import shutil
+import tempfile
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.client import RequestFactory
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import six, timezone
+
+from getpaid import events, transport
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+class PaymentEventsTestCase(TestCase):
+
+    def setUp(self):
+        self.PaymentEvent = apps.get_model('getpaid', 'PaymentEvent')
+        self.payment = PaymentFactory(status='in_progress')
+
+    def test_status_change(self):
+        self.payment.change_status('failed', description='declined')
+        event = self.payment.events.get()
+        self.assertEqual((event.kind, event.backend, event.old_status, event.new_status),
+                         (events.STATUS, 'getpaid.backends.payu', 'in_progress', 'failed'))
+        self.assertEqual(json.loads(event.data), {'description': 'declined'})
+
+    def test_buffered(self):
+        with CaptureQueriesContext(connection) as queries:
+            with events.buffered():
+                events.record(self.payment.pk, events.NOTIFICATION, data={'a': 1})
+                with events.buffered():
+                    events.record(self.payment.pk, events.NOTIFICATION, data='raw')
+                events.record(self.payment.pk, events.GATEWAY)
+                self.assertEqual(len(queries), 0)
+        self.assertEqual(len([query for query in queries if 'INSERT INTO' in query['sql']]), 1)
+        self.assertEqual(list(self.payment.events.order_by('pk').values_list('kind', 'data')),
+                         [(events.NOTIFICATION, '{"a": 1}'), (events.NOTIFICATION, 'raw'), (events.GATEWAY, '')])
+
+    def test_middleware(self):
+        middleware = events.EventBufferMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        events.record(self.payment.pk, events.NOTIFICATION)
+        self.assertFalse(self.PaymentEvent.objects.exists())
+        middleware.process_response(request, None)
+        self.assertEqual(self.PaymentEvent.objects.count(), 1)
+        middleware.process_response(request, None)
+
+    @override_settings(GETPAID_TRANSPORT='getpaid.transport.FakeTransport')
+    def test_gateway_call(self):
+        fake = transport.get_transport()
+        fake.add_response('https://example.com/ok', b'OK')
+        fake.add_response('https://example.com/error', b'', status_code=500)
+        transport.post('getpaid.backends.payu', 'https://example.com/ok', payment_id=self.payment.pk)
+        with self.assertRaises(transport.TransportError):
+            transport.post('getpaid.backends.payu', 'https://example.com/error', payment_id=self.payment.pk)
+        transport.post('getpaid.backends.payu', 'https://example.com/ok')
+
+        data = [json.loads(event.data) for event in self.payment.events.order_by('pk')]
+        self.assertEqual([(d['url'], d['status_code']) for d in data],
+                         [('https://example.com/ok', 200), ('https://example.com/error', 500)])
+        self.assertIn('error', data[1])
+
+    @override_settings(GETPAID_PAYMENT_EVENTS=False)
+    def test_disabled(self):
+        self.payment.change_status('paid')
+        self.assertFalse(self.PaymentEvent.objects.exists())
+
+    def test_prune(self):
+        for i in range(5):
+            events.record(self.payment.pk, events.NOTIFICATION, data=six.text_type(i))
+        self.PaymentEvent.objects.filter(data__in=['0', '1', '2']).update(
+            created_on=timezone.now() - timedelta(days=100))
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'events.jsonl')
+            out = six.StringIO()
+            call_command('getpaid_prune_events', archive=path, batch_size=2, stdout=out)
+            self.assertIn('Deleted 3 payment events', out.getvalue())
+            with open(path, 'rb') as archive:
+                archived = [json.loads(line.decode('utf-8')) for line in archive]
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual([event['data'] for event in archived], ['0', '1', '2'])
+        self.assertEqual(archived[0]['payment_id'], self.payment.pk)
+        self.assertEqual(list(self.PaymentEvent.objects.order_by('pk').values_list('data', flat=True)), ['3', '4'])
@@ -0,0 +1,74 @@
+# coding: utf8
+from datetime import date, timedelta
+import csv
+import json
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import six, timezone
+
+from getpaid import export
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+class ExportTestCase(TestCase):
+
+    def setUp(self):
+        self.payments = [PaymentFactory(status='paid', description=u'zażółć "gęślą"') for i in range(5)]
+        self.failed = PaymentFactory(status='failed', currency='EUR')
+        self.old = PaymentFactory(status='paid')
+        apps.get_model('getpaid', 'Payment').objects.filter(pk=self.old.pk).update(
+            created_on=timezone.now() - timedelta(days=30))
+
+    def test_iter_rows_chunks(self):
+        queryset = export.get_export_queryset()
+        with self.assertNumQueries(3):  # 7 payments
+            rows = list(export.iter_rows(queryset, chunk_size=3))
+        self.assertEqual([row[0] for row in rows], sorted(p.pk for p in self.payments + [self.failed, self.old]))
+
+    def test_command_csv(self):
+        out = six.StringIO()
+        call_command('getpaid_export', statuses=['paid'], created_from=str(date.today() - timedelta(days=1)),
+                     chunk_size=2, stdout=out)
+        value = out.getvalue()
+        if six.PY2:  # csv module of python 2 reads bytes
+            value = value if isinstance(value, bytes) else value.encode('utf-8')
+        rows = list(csv.reader(value.splitlines()))
+        self.assertEqual(rows[0], list(export.EXPORT_FIELDS))
+        self.assertEqual([int(row[0]) for row in rows[1:]], [p.pk for p in self.payments])
+        description = rows[1][export.EXPORT_FIELDS.index('description')]
+        self.assertEqual(description.decode('utf-8') if six.PY2 else description, u'zażółć "gęślą"')
+
+    def test_command_jsonl(self):
+        out = six.StringIO()
+        call_command('getpaid_export', format='jsonl', currencies=['eur'], stdout=out)
+        rows = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(rows), 1)
+        self.assertEqual((rows[0]['id'], rows[0]['status'], rows[0]['paid_on']), (self.failed.pk, 'failed', None))
+
+    def test_command_invalid_date(self):
+        with self.assertRaises(CommandError):
+            call_command('getpaid_export', created_to='2015-02-30', stdout=six.StringIO())
+
+    def test_view(self):
+        url = reverse('getpaid-export')
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 302)
+
+        user = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='staff')
+        response = self.client.get(url, {'format': 'jsonl', 'status': ['failed', 'cancelled']})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Disposition'], 'attachment; filename="payments.jsonl"')
+        lines = b''.join(response.streaming_content).decode('utf-8').splitlines()
+        self.assertEqual([json.loads(line)['id'] for line in lines], [self.failed.pk])
+
+        self.assertEqual(self.client.get(url, {'format': 'xml'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'from': 'yesterday'}).status_code, 400)
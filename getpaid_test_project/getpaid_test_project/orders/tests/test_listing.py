@@ -0,0 +1,74 @@
+# coding: utf8
+from datetime import timedelta
+import json
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+from django.utils import timezone
+
+from getpaid import listing
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+class ListingTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        self.payments = [PaymentFactory(status='in_progress') for i in range(5)]
+        # payments created at the same time are ordered by id
+        self.Payment.objects.filter(pk__in=[p.pk for p in self.payments[1:3]]).update(
+            created_on=self.payments[1].created_on)
+        self.other = PaymentFactory(status='paid', backend='getpaid.backends.dummy')
+
+    def test_pages(self):
+        pks = []
+        cursor = None
+        for i in range(3):
+            with self.assertNumQueries(1):
+                rows, cursor = listing.get_page(cursor, page_size=2, statuses=['in_progress'])
+            pks.extend(row['id'] for row in rows)
+            if cursor is None:
+                break
+        self.assertEqual(pks, [p.pk for p in self.payments])
+        self.assertIsNone(cursor)
+        self.assertEqual(sorted(rows[0]), sorted(listing.LIST_FIELDS))
+
+    def test_filters(self):
+        rows, cursor = listing.get_page(backends=['getpaid.backends.dummy'], currencies=['pln'])
+        self.assertEqual([row['id'] for row in rows], [self.other.pk])
+
+        self.Payment.objects.update(updated_on=timezone.now() - timedelta(days=1))
+        self.assertTrue(self.payments[3].change_status('paid'))
+        rows, cursor = listing.get_page(updated_since=timezone.now() - timedelta(hours=1))
+        self.assertEqual([row['id'] for row in rows], [self.payments[3].pk])
+
+    def test_invalid_cursor(self):
+        for cursor in ('xyz', listing.encode_cursor(timezone.now(), 1)[:-4], u'zażółć'):
+            with self.assertRaises(ValueError):
+                listing.get_page(cursor)
+
+    def test_view(self):
+        url = reverse('getpaid-payments')
+        self.assertEqual(self.client.get(url).status_code, 302)
+
+        user = User.objects.create_user('staff', 'staff@example.com', 'staff')
+        user.is_staff = True
+        user.save()
+        self.client.login(username='staff', password='staff')
+        response = self.client.get(url, {'status': 'in_progress', 'limit': 3})
+        self.assertEqual(response.status_code, 200)
+        page = json.loads(response.content.decode('utf-8'))
+        self.assertEqual([row['id'] for row in page['results']], [p.pk for p in self.payments[:3]])
+        self.assertEqual(page['results'][0]['amount'], '200.0000')
+
+        page = json.loads(self.client.get(url, {'status': 'in_progress', 'limit': 3, 'cursor': page['next']})
+                          .content.decode('utf-8'))
+        self.assertEqual([row['id'] for row in page['results']], [p.pk for p in self.payments[3:]])
+        self.assertIsNone(page['next'])
+
+        self.assertEqual(self.client.get(url, {'updated_since': '2015-01-01T10:00:00'}).status_code, 200)
+        self.assertEqual(self.client.get(url, {'updated_since': 'yesterday'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'limit': 'all'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'cursor': 'xyz'}).status_code, 400)
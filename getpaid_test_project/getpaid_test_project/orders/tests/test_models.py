@@ -0,0 +1,144 @@
+# coding: utf8
+from decimal import Decimal
+
+from django.apps import apps
+from django.db import DatabaseError, connection, transaction
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+import mock
+
+from getpaid import events, models, signals
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+class PaymentTransitionTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        self.handler = mock.Mock()
+        signals.payment_status_changed.connect(self.handler)
+
+    def tearDown(self):
+        signals.payment_status_changed.disconnect(self.handler)
+
+    def test_transition(self):
+        payment = PaymentFactory(status='in_progress')
+        self.assertTrue(payment.transition('accepted_for_proc', allowed_from=['in_progress'], external_id='ext'))
+        self.assertEqual(payment.status, 'accepted_for_proc')
+        self.assertEqual(self.Payment.objects.filter(pk=payment.pk).values_list('status', 'external_id')[0],
+                         ('accepted_for_proc', 'ext'))
+        self.assertEqual(self.handler.call_count, 1)
+        self.assertEqual(self.handler.call_args[1]['old_status'], 'in_progress')
+        self.assertEqual(self.handler.call_args[1]['new_status'], 'accepted_for_proc')
+
+    def test_transition_not_allowed(self):
+        payment = PaymentFactory(status='in_progress')
+        stale = self.Payment.objects.get(pk=payment.pk)
+        self.assertTrue(payment.change_status('paid'))
+
+        self.assertFalse(stale.transition('failed', allowed_from=['new', 'in_progress']))
+        self.assertEqual(stale.status, 'in_progress')
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'paid')
+        self.assertEqual(self.handler.call_count, 1)
+
+    def test_concurrent_change_status(self):
+        payment = PaymentFactory(status='in_progress')
+        stale = self.Payment.objects.get(pk=payment.pk)
+        self.assertTrue(payment.change_status('paid'))
+        self.assertFalse(stale.change_status('paid'))
+        self.assertEqual(self.handler.call_count, 1)
+
+    def test_on_success_single_write(self):
+        payment = PaymentFactory(status='in_progress')
+        with events.buffered():
+            with self.assertNumQueries(1):
+                self.assertFalse(payment.on_success(Decimal('50'), external_id='ext'))
+        payment = self.Payment.objects.get(pk=payment.pk)
+        self.assertEqual(payment.status, 'partially_paid')
+
+    def test_aggregates_disabled_by_default(self):
+        PaymentFactory(status='in_progress').on_success()
+        self.assertFalse(apps.get_model('getpaid', 'PaymentDailyAggregate').objects.exists())
+
+    @override_settings(GETPAID_DAILY_AGGREGATES=True)
+    def test_on_success_writes_with_aggregates(self):
+        payment = PaymentFactory(status='in_progress')
+        with events.buffered():
+            with CaptureQueriesContext(connection) as queries:
+                self.assertFalse(payment.on_success(Decimal('50'), external_id='ext'))
+        statements = [query['sql'] for query in queries.captured_queries]
+        # the payment UPDATE, moving out of the old bucket and creating the new one (UPDATE, SAVEPOINT,
+        # INSERT, RELEASE); an existing bucket is updated with a single UPDATE
+        self.assertEqual(len(statements), 6)
+        self.assertIn('UPDATE "getpaid_payment"', statements[0])
+        self.assertTrue(all('getpaid_payment"' not in statement for statement in statements[1:]))
+        payment = self.Payment.objects.get(pk=payment.pk)
+        self.assertEqual(payment.status, 'partially_paid')
+        self.assertEqual(payment.amount_paid, Decimal('50'))
+        self.assertEqual(payment.external_id, 'ext')
+        self.assertIsNotNone(payment.paid_on)
+
+    @override_settings(GETPAID_DAILY_AGGREGATES=True)
+    def test_aggregates_updated_atomically(self):
+        payment = PaymentFactory(status='in_progress')
+        with mock.patch('getpaid.aggregates.add', side_effect=DatabaseError):
+            with transaction.atomic():
+                self.assertRaises(DatabaseError, payment.change_status, 'paid')
+                transaction.set_rollback(True)
+        self.assertEqual(payment.status, 'in_progress')
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'in_progress')
+        self.assertEqual(self.handler.call_count, 0)
+
+    def test_change_status_saves_given_fields_only(self):
+        payment = PaymentFactory(status='in_progress')
+        payment.description = 'not saved'
+        payment.change_status('failed')
+        self.assertIsNone(self.Payment.objects.get(pk=payment.pk).description)
+
+    def test_illegal_transition_without_query(self):
+        payment = PaymentFactory(status='paid')
+        with self.assertNumQueries(0):
+            self.assertFalse(payment.change_status('partially_paid'))
+            self.assertFalse(payment.change_status('paid'))
+        self.assertEqual(self.handler.call_count, 0)
+
+    def test_unknown_status(self):
+        payment = PaymentFactory(status='in_progress')
+        with self.assertRaises(ValueError):
+            payment.change_status('lost')
+
+
+class PaymentStatusTransitionsTestCase(TestCase):
+
+    def test_allowed_from(self):
+        self.assertTrue(models.can_change_status('in_progress', 'paid'))
+        self.assertTrue(models.can_change_status('paid', 'failed'))
+        self.assertFalse(models.can_change_status('paid', 'partially_paid'))
+        self.assertFalse(models.can_change_status('paid', 'paid'))
+        self.assertEqual(models.get_allowed_from('accepted_for_proc'), frozenset(['new', 'in_progress']))
+
+    def test_queryset_change_status(self):
+        Payment = apps.get_model('getpaid', 'Payment')
+        new = PaymentFactory()
+        in_progress = PaymentFactory(status='in_progress')
+        paid = PaymentFactory(status='paid')
+
+        self.assertEqual(Payment.objects.filter(backend='getpaid.backends.payu').change_status('cancelled'), 2)
+        statuses = dict(Payment.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses, {new.pk: 'cancelled', in_progress.pk: 'cancelled', paid.pk: 'paid'})
+        self.assertEqual(set(Payment.objects.allowing_status('in_progress')), set([new, in_progress]))
+
+    def test_by_external_id(self):
+        Payment = apps.get_model('getpaid', 'Payment')
+        payment = PaymentFactory(external_id='ext')
+        PaymentFactory(external_id='ext', backend='getpaid.backends.dummy')
+        self.assertEqual(list(Payment.objects.by_external_id('getpaid.backends.payu', 'ext')), [payment])
+
+    def test_lean_manager(self):
+        Payment = apps.get_model('getpaid', 'Payment')
+        payment = PaymentFactory()
+        self.assertIn('JOIN', str(Payment.objects.filter(pk=payment.pk).query))
+        self.assertNotIn('JOIN', str(Payment.lean.filter(pk=payment.pk).query))
+        self.assertIs(Payment._default_manager, Payment.objects)
+        with self.assertNumQueries(2):
+            self.assertEqual(Payment.lean.get(pk=payment.pk).order, payment.order)
@@ -6,13 +6,14 @@ from django.core.urlresolvers import reverse
 from django.apps import apps
 from django.test import TestCase
 from django.test.client import Client
+from django.test.utils import override_settings
 from django.utils.six.moves.urllib.parse import urlparse, parse_qs, \
     parse_qsl, urlencode
 from django.utils import six
-import mock
 
 import getpaid
 import getpaid.backends.payu
+from getpaid import transport
 from getpaid_test_project.orders.models import Order
 
 
@@ -20,10 +21,7 @@ if six.PY3:
     unicode = str
 
 
-def fake_payment_get_response_success(request):
-    class fake_response:
-        def read(self):
-            return b"""
+PAYMENT_GET_RESPONSE_SUCCESS = b"""
 status:OK
 trans_id:234748067
 trans_pos_id:123456789
@@ -45,19 +43,7 @@ trans_ts:1342616255805
 trans_sig:4d4df5557b89a4e2d8c48436b1dd3fef
 """
 
-    return fake_response()
-
-
-def fake_payment_get_response_failure(request):
-    class fake_response:
-        def info(self):
-            message = http.client.HTTPMessage()
-            message.headers = (
-                ('Content-type', 'text/plain; charset=ISO-8859-1'),
-            )
-            return message
-        def read(self):
-            return b"""
+PAYMENT_GET_RESPONSE_FAILURE = b"""
 status:OK
 trans_id:234748067
 trans_pos_id:123456789
@@ -79,8 +65,6 @@ trans_ts:1342616255805
 trans_sig:ee77e9515599e3fd2b3721dff50111dd
 """
 
-    return fake_response()
-
 
 class PayUBackendTestCase(TestCase):
     maxDiff = True
@@ -150,9 +134,11 @@ trans_sig:e4e981bfa780fa78fb077ca1f9295f2a
         })
         self.assertEqual(response.content, b'OK')
 
-    @mock.patch("getpaid.backends.payu.Request", autospec=True)
-    @mock.patch("getpaid.backends.payu.urlopen", fake_payment_get_response_success)
-    def test_payment_get_paid(self, mock_Request):
+    @override_settings(GETPAID_TRANSPORT='getpaid.transport.FakeTransport')
+    def test_payment_get_paid(self):
+        url = 'https://www.platnosci.pl/paygw/UTF/Payment/get/txt'
+        fake_transport = transport.get_transport()
+        fake_transport.add_response(url, PAYMENT_GET_RESPONSE_SUCCESS)
         Payment = apps.get_model('getpaid', 'Payment')
         order = Order(name='Test EUR order', total='123.45', currency='PLN')
         order.save()
@@ -167,20 +153,17 @@ trans_sig:e4e981bfa780fa78fb077ca1f9295f2a
         self.assertNotEqual(payment.paid_on, None)
         self.assertNotEqual(payment.amount_paid, Decimal('0'))
 
-        url = 'https://www.platnosci.pl/paygw/UTF/Payment/get/txt'
-        callargs = mock_Request.call_args_list
-        self.assertEqual(url, callargs[0][0][0])
-        if six.PY3:
-            self.assertIsInstance(callargs[0][0][1], bytes)
-            self.assertTrue(b'pos_id=123456789' in callargs[0][0][1])
-            self.assertTrue(b'session_id=99%3A1342616247.41' in callargs[0][0][1])
-        else:
-            self.assertIsInstance(callargs[0][0][1], str)
-            self.assertTrue('pos_id=123456789' in callargs[0][0][1])
-            self.assertTrue('session_id=99%3A1342616247.41' in callargs[0][0][1])
-
-    @mock.patch("getpaid.backends.payu.urlopen", fake_payment_get_response_failure)
+        request = fake_transport.requests[0]
+        self.assertEqual(request.backend, 'getpaid.backends.payu')
+        self.assertEqual(request.method, 'POST')
+        self.assertEqual(request.url, url)
+        self.assertEqual(request.data['pos_id'], b'123456789')
+        self.assertEqual(request.data['session_id'], b'99:1342616247.41')
+
+    @override_settings(GETPAID_TRANSPORT='getpaid.transport.FakeTransport')
     def test_payment_get_failed(self):
+        transport.get_transport().add_response('https://www.platnosci.pl/paygw/UTF/Payment/get/txt',
+                                               PAYMENT_GET_RESPONSE_FAILURE)
         Payment = apps.get_model('getpaid', 'Payment')
         order = Order(name='Test EUR order', total='123.45', currency='PLN')
         order.save()
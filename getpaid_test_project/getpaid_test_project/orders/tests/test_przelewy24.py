@@ -4,12 +4,13 @@ from decimal import Decimal
 
 from django.apps import apps
 from django.test import TestCase
+from django.test.utils import override_settings
 from django.utils.six.moves.urllib.parse import urlparse, parse_qs, \
     parse_qsl, urlencode
 from django.utils import six
-import mock
 
 import getpaid
+from getpaid import transport
 from getpaid.backends import przelewy24
 from getpaid_test_project.orders.models import Order
 
@@ -18,28 +19,23 @@ if six.PY3:
     unicode = str
 
 
-def fake_przelewy24_payment_get_response_success(request):
-    class fake_response:
-        def read(self):
-            return b"""RESULT
+PAYMENT_GET_RESPONSE_SUCCESS = b"""RESULT
 TRUE"""
 
-    return fake_response()
-
-
-def fake_przelewy24_payment_get_response_failed(request):
-    class fake_response:
-        def read(self):
-            # Błąd wywołania (3) - błąd CRC
-            return b"""RESULT
+# Błąd wywołania (3) - błąd CRC
+PAYMENT_GET_RESPONSE_FAILED = b"""RESULT
 ERR
 123
 Some error description"""
 
-    return fake_response()
-
 
+@override_settings(GETPAID_TRANSPORT='getpaid.transport.FakeTransport')
 class Przelewy24PaymentProcessorTestCase(TestCase):
+    confirm_url = przelewy24.PaymentProcessor._GATEWAY_CONFIRM_URL
+
+    def setUp(self):
+        transport.get_transport().reset()
+
     def test_sig(self):
         # Test based on p24 documentation
         sig = przelewy24.PaymentProcessor.compute_sig(
@@ -56,8 +52,8 @@ class Przelewy24PaymentProcessorTestCase(TestCase):
         )
         self.assertEqual(sig, 'e2c43dec9578633c518e1f514d3b434b')
 
-    @mock.patch("getpaid.backends.przelewy24.urlopen", fake_przelewy24_payment_get_response_success)
     def test_get_payment_status_success(self):
+        transport.get_transport().add_response(self.confirm_url, PAYMENT_GET_RESPONSE_SUCCESS)
         Payment = apps.get_model('getpaid', 'Payment')
         order = Order(name='Test PLN order', total='123.45', currency='PLN')
         order.save()
@@ -73,9 +69,8 @@ class Przelewy24PaymentProcessorTestCase(TestCase):
         self.assertNotEqual(payment.paid_on, None)
         self.assertEqual(payment.amount_paid, Decimal('123.45'))
 
-    @mock.patch("getpaid.backends.przelewy24.urlopen",
-                fake_przelewy24_payment_get_response_success)
     def test_get_payment_status_success_partial(self):
+        transport.get_transport().add_response(self.confirm_url, PAYMENT_GET_RESPONSE_SUCCESS)
         Payment = apps.get_model('getpaid', 'Payment')
         order = Order(name='Test PLN order', total='123.45', currency='PLN')
         order.save()
@@ -93,8 +88,8 @@ class Przelewy24PaymentProcessorTestCase(TestCase):
         self.assertNotEqual(payment.paid_on, None)
         self.assertEqual(payment.amount_paid, Decimal('122.45'))
 
-    @mock.patch("getpaid.backends.przelewy24.urlopen", fake_przelewy24_payment_get_response_failed)
     def test_get_payment_status_failed(self):
+        transport.get_transport().add_response(self.confirm_url, PAYMENT_GET_RESPONSE_FAILED)
         Payment = apps.get_model('getpaid', 'Payment')
         order = Order(name='Test PLN order', total='123.45', currency='PLN')
         order.save()
@@ -0,0 +1,86 @@
+# coding: utf8
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import six
+
+from getpaid import reconcile, transport
+from getpaid.backends.eservice import PaymentProcessor
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.tests.utils import FakeEserviceTransport, create_payment, eservice_settings
+
+
+class ReconcileTestCase(TestCase):
+
+    def setUp(self):
+        self.settings_override = eservice_settings()
+        self.settings_override.enable()
+        transport._transport['instance'] = self.transport = FakeEserviceTransport()
+        self.transport.statuses = {}
+
+    def tearDown(self):
+        self.settings_override.disable()
+
+    def create_payment(self, external_id, status='in_progress', age=timedelta(hours=2), **kwargs):
+        return create_payment(backend='getpaid.backends.eservice', status=status, external_id=external_id, age=age,
+                              **kwargs)
+
+    def test_reconcilable_backends(self):
+        self.assertTrue(PaymentProcessor.can_fetch_status())
+        self.assertEqual(reconcile.get_reconcilable_backends(), ['getpaid.backends.eservice'])
+
+    def test_stale_payments_keyset(self):
+        payments = [self.create_payment('ext%d' % i) for i in range(5)]
+        self.create_payment('fresh', age=timedelta(minutes=1))
+        self.create_payment('paid', status='paid')
+        PaymentFactory(status='in_progress')  # payu cannot fetch status
+
+        with CaptureQueriesContext(connection) as queries:
+            stale = list(reconcile.get_stale_payments(chunk_size=2))
+        self.assertEqual([p.pk for p in stale], [p.pk for p in payments])
+        # orders are not read by the sweep
+        self.assertFalse([query for query in queries.captured_queries if 'orders_order' in query['sql']])
+
+    def test_reconcile(self):
+        paid = self.create_payment('ext-paid')
+        failed = self.create_payment('ext-failed')
+        pending = self.create_payment('ext-pending')
+        broken = self.create_payment('ext-unknown')
+        self.transport.statuses = {'ext-paid': 'C', 'ext-failed': 'V', 'ext-pending': None}
+
+        summary = reconcile.reconcile(workers=2, backend_concurrency=1, batch_size=3)
+
+        Payment = apps.get_model('getpaid', 'Payment')
+        statuses = dict(Payment.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[paid.pk], 'paid')
+        self.assertEqual(statuses[failed.pk], 'failed')
+        self.assertEqual(statuses[pending.pk], 'in_progress')
+        self.assertEqual(statuses[broken.pk], 'in_progress')
+        self.assertEqual(dict(summary.counts['getpaid.backends.eservice']),
+                         {'paid': 1, 'failed': 1, 'pending': 1, 'error': 1})
+        self.assertEqual(len(self.transport.requests), 4)
+
+    def test_payment_changed_meanwhile(self):
+        payment = self.create_payment('ext-paid')
+        self.transport.statuses = {'ext-paid': 'V'}
+        reconciler = reconcile.Reconciler(workers=1)
+        fetched = [reconciler.fetch(payment)]
+        Payment = apps.get_model('getpaid', 'Payment')
+        Payment.objects.filter(pk=payment.pk).update(status='paid')
+
+        summary = reconciler.apply(fetched, reconcile.ReconcileSummary())
+        self.assertEqual(summary.total('changed'), 1)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'paid')
+
+    def test_command_dry_run(self):
+        payment = self.create_payment('ext-paid')
+        self.transport.statuses = {'ext-paid': 'C'}
+        out = six.StringIO()
+        call_command('getpaid_reconcile', dry_run=True, stdout=out)
+        self.assertIn('getpaid.backends.eservice: paid=1', out.getvalue())
+        Payment = apps.get_model('getpaid', 'Payment')
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'in_progress')
@@ -0,0 +1,74 @@
+# coding: utf8
+import time
+
+from django.apps import apps
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase
+from django.test.utils import override_settings
+from django.views.generic.base import View
+
+from getpaid import replicas
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.models import Order
+
+
+class RoutedView(replicas.ReadReplicaMixin, View):
+
+    def get(self, request):
+        return HttpResponse(replicas.ReplicaRouter().db_for_read(apps.get_model('getpaid', 'Payment')) or '')
+
+
+@override_settings(GETPAID_READ_DATABASE='replica')
+class ReplicaRouterTestCase(TestCase):
+
+    def setUp(self):
+        self.router = replicas.ReplicaRouter()
+        self.Payment = apps.get_model('getpaid', 'Payment')
+        replicas.reset()
+
+    def tearDown(self):
+        replicas.reset()
+
+    def test_read_only(self):
+        self.assertIsNone(self.router.db_for_read(self.Payment))
+        with replicas.read_only():
+            with replicas.read_only():
+                self.assertEqual(self.router.db_for_read(self.Payment), 'replica')
+            self.assertEqual(self.router.db_for_read(Order), 'replica')
+            self.assertIsNone(self.router.db_for_read(apps.get_model('auth', 'User')))
+        self.assertIsNone(self.router.db_for_read(self.Payment))
+        with override_settings(GETPAID_READ_DATABASE=None), replicas.read_only():
+            self.assertIsNone(self.router.db_for_read(self.Payment))
+
+    def test_pinned_after_status_change(self):
+        payment = PaymentFactory(status='in_progress')
+        with replicas.read_only():
+            payment.change_status('paid')
+            self.assertIsNone(self.router.db_for_read(self.Payment))
+        replicas.pin(time.time() - 1)  # older pins do not shorten it
+        self.assertTrue(replicas.is_pinned())
+        replicas.reset()
+        self.assertFalse(replicas.is_pinned())
+
+    def test_middleware(self):
+        middleware = replicas.ReplicaMiddleware()
+        request = RequestFactory().get('/')
+        middleware.process_request(request)
+        self.assertEqual(RoutedView.as_view()(request).content, b'replica')
+        PaymentFactory(status='in_progress').change_status('failed')
+        response = middleware.process_response(request, HttpResponse())
+        pinned_until = float(response.cookies[replicas.PINNED_COOKIE_NAME].value)
+        self.assertTrue(pinned_until > time.time())
+        self.assertFalse(replicas.is_pinned())
+
+        request = RequestFactory().get('/')
+        request.COOKIES[replicas.PINNED_COOKIE_NAME] = str(pinned_until)
+        middleware.process_request(request)
+        self.assertEqual(RoutedView.as_view()(request).content, b'')
+        response = middleware.process_response(request, HttpResponse())
+        self.assertNotIn(replicas.PINNED_COOKIE_NAME, response.cookies)
+
+        request = RequestFactory().get('/')
+        request.COOKIES[replicas.PINNED_COOKIE_NAME] = 'forever'
+        middleware.process_request(request)
+        self.assertFalse(replicas.is_pinned())
@@ -0,0 +1,113 @@
+# coding: utf8
+from datetime import timedelta
+import time
+
+from django.apps import apps
+from django.core.cache import caches
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from getpaid import events, retry, scheduler, tasks, transport
+from getpaid.backends.payu import PaymentProcessor
+from getpaid.backends.payu.tasks import get_payment_status_task
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.tests.utils import create_payment, payu_settings
+
+
+class RetryPolicyTestCase(TestCase):
+
+    def test_delay(self):
+        policy = retry.RetryPolicy(base_delay=10, max_delay=100)
+        for attempt in range(10):
+            for i in range(20):
+                self.assertTrue(0 <= policy.get_delay(attempt) <= min(100, 10 * 2 ** attempt))
+        self.assertNotEqual(len(set(policy.get_delay(3) for i in range(20))), 1)
+
+    def test_backend_settings(self):
+        with payu_settings(retry_base_delay=1, retry_max_attempts=3, retry_give_up_status='cancelled'):
+            policy = retry.RetryPolicy.for_backend('getpaid.backends.payu')
+        self.assertEqual((policy.base_delay, policy.max_delay, policy.max_attempts, policy.deadline,
+                          policy.give_up_status), (1, retry.DEFAULT_MAX_DELAY, 3, retry.DEFAULT_DEADLINE, 'cancelled'))
+
+    def test_retry_delay(self):
+        policy = retry.RetryPolicy(base_delay=10, max_attempts=3, deadline=60)
+        self.assertTrue(0 <= policy.get_retry_delay(time.time(), 1) <= 20)
+        self.assertIsNone(policy.get_retry_delay(time.time(), 2))
+        self.assertIsNone(policy.get_retry_delay(time.time() - 61, 0))
+
+
+@payu_settings(retry_base_delay=10, retry_max_attempts=3)
+class RetryTaskTestCase(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.fake_transport()
+        self.Payment = apps.get_model('getpaid', 'Payment')
+
+    def fake_transport(self):
+        # changed settings reset the transport
+        transport._transport['instance'] = self.transport = transport.FakeTransport()
+        self.transport.add_response(PaymentProcessor._GATEWAY_URL + 'UTF/Payment/get/txt', status_code=503)
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_retry(self):
+        payment = PaymentFactory(status='in_progress')
+        task = mock.Mock()
+        task.request.retries = 1
+        task.request.kwargs = {'session_id': '1:1'}
+        task.retry.return_value = tasks.Retry()
+        error = transport.TransportError('Service unavailable')
+        before = time.time()
+        with self.assertRaises(tasks.Retry):
+            retry.retry_or_give_up(task, payment, error)
+        kwargs = task.retry.call_args[1]
+        self.assertTrue(0 <= kwargs['countdown'] <= 20)
+        self.assertEqual((kwargs['exc'], kwargs['max_retries']), (error, 3))
+        # time of the first attempt is carried by the retry
+        self.assertEqual(kwargs['kwargs']['session_id'], '1:1')
+        self.assertTrue(before <= kwargs['kwargs'][tasks.RETRY_STATE_KWARG]['first_attempt'] <= time.time())
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'in_progress')
+
+    @override_settings(GETPAID_TASK_EXECUTOR='sync')
+    def test_give_up_after_attempts(self):
+        payment = PaymentFactory(status='in_progress')
+        get_payment_status_task.delay(payment.pk, '1:1')
+        self.assertEqual(len(self.transport.requests), 3)
+        # a gateway outage is not a failure of the payment
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'in_progress')
+        self.assertIsNone(scheduler.get_state(payment.pk))
+        self.assertTrue(payment.events.filter(kind=events.GATEWAY, data__contains='gave_up').exists())
+
+    @override_settings(GETPAID_TASK_EXECUTOR='sync')
+    @payu_settings(retry_base_delay=10, retry_max_attempts=3, retry_give_up_status='failed')
+    def test_give_up_status(self):
+        self.fake_transport()
+        payment = PaymentFactory(status='in_progress')
+        get_payment_status_task.delay(payment.pk, '1:1')
+        self.assertEqual(len(self.transport.requests), 3)
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'failed')
+
+    @override_settings(GETPAID_TASK_EXECUTOR='sync')
+    def test_deadline_from_first_attempt(self):
+        # an old payment is retried, the deadline is counted from its first check
+        payment = create_payment(status='in_progress', age=timedelta(days=2))
+        get_payment_status_task.delay(payment.pk, '1:1')
+        self.assertEqual(len(self.transport.requests), 3)
+
+    @payu_settings(retry_deadline=60, retry_give_up_status='cancelled')
+    def test_give_up_after_deadline(self):
+        self.fake_transport()
+        payment = PaymentFactory(status='in_progress')
+        first_attempt = time.time() - 61
+        get_payment_status_task.run((payment.pk, '1:1'), {tasks.RETRY_STATE_KWARG: {'first_attempt': first_attempt}},
+                                    retries=1)
+        self.assertEqual(len(self.transport.requests), 1)
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'cancelled')
+
+    def test_settled_payment_is_kept(self):
+        payment = PaymentFactory(status='paid')
+        self.assertFalse(retry.give_up(payment, 3))
+        self.assertEqual(self.Payment.objects.get(pk=payment.pk).status, 'paid')
@@ -0,0 +1,98 @@
+# coding: utf8
+import threading
+
+from celery import Celery, current_app
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from getpaid import retry, routing, tasks
+from getpaid.backends.payu.tasks import accept_payment, get_payment_status_task
+from getpaid_test_project.orders.factories import PaymentFactory
+from getpaid_test_project.orders.tests.utils import payu_settings
+
+
+class RoutingTestCase(TestCase):
+
+    def test_options(self):
+        self.assertEqual(routing.get_options('getpaid.backends.payu', routing.CHECK), {'priority': 6})
+        with override_settings(GETPAID_TASK_QUEUES=True, GETPAID_TASK_PRIORITIES={'retry': 1}):
+            self.assertEqual(routing.get_options('getpaid.backends.payu', routing.RETRY),
+                             {'queue': 'getpaid.payu.retry', 'priority': 1})
+            with payu_settings(task_queues={'accept': 'payu-accept'}):
+                self.assertEqual(accept_payment.get_options(), {'queue': 'payu-accept', 'priority': 6})
+                self.assertEqual(get_payment_status_task.get_options()['queue'], 'getpaid.payu.check')
+
+    def test_celery_queues(self):
+        queues = routing.get_celery_queues(['getpaid.backends.payu', 'getpaid.backends.eservice'])
+        self.assertEqual([queue.name for queue in queues], [
+            'getpaid.payu.check', 'getpaid.payu.retry', 'getpaid.payu.accept',
+            'getpaid.eservice.check', 'getpaid.eservice.retry', 'getpaid.eservice.accept',
+        ])
+        self.assertEqual(queues[0].queue_arguments, {'x-max-priority': routing.MAX_PRIORITY})
+        self.assertIn('getpaid.payu.check', routing.get_queue_names())
+
+    @override_settings(GETPAID_TASK_QUEUES=True)
+    def test_retry_route(self):
+        task = mock.Mock()
+        task.request.retries = 0
+        task.request.kwargs = {}
+        task.retry.return_value = tasks.Retry()
+        with self.assertRaises(tasks.Retry):
+            retry.retry_or_give_up(task, PaymentFactory(status='in_progress'))
+        kwargs = task.retry.call_args[1]
+        self.assertEqual((kwargs['queue'], kwargs['priority']), ('getpaid.payu.retry', 3))
+
+    def test_retry_without_queues(self):
+        task = mock.Mock()
+        task.request.retries = 0
+        task.request.kwargs = {}
+        task.retry.return_value = tasks.Retry()
+        with self.assertRaises(tasks.Retry):
+            retry.retry_or_give_up(task, PaymentFactory(status='in_progress'))
+        # celery tasks go to shared queues, which priorities would reorder
+        self.assertNotIn('priority', task.retry.call_args[1])
+        self.assertNotIn('queue', task.retry.call_args[1])
+        self.assertEqual(routing.get_celery_options({'priority': 3, 'queue': 'q'}), {'queue': 'q'})
+
+
+@override_settings(GETPAID_TASK_EXECUTOR='celery', GETPAID_TASK_QUEUES=True)
+class CeleryRoutingTestCase(TestCase):
+
+    def setUp(self):
+        self.previous_app = current_app._get_current_object()
+        self.app = Celery(set_as_current=False)
+        self.app.conf.update(BROKER_URL='memory://', CELERY_ALWAYS_EAGER=False, CELERY_TASK_SERIALIZER='json')
+
+    def tearDown(self):
+        # the first app created becomes the current one
+        self.previous_app.set_current()
+
+    def receive(self, queue):
+        with self.app.connection() as connection:
+            return connection.SimpleQueue(queue, no_ack=True).get(timeout=1)
+
+    def test_routed_to_memory_broker(self):
+        celery_task = self.app.task(name=accept_payment.name, bind=True, shared=False)(accept_payment.fun)
+        with mock.patch.object(accept_payment, 'celery_task', celery_task):
+            accept_payment.delay(1, '1:1')
+        message = self.receive('getpaid.payu.accept')
+        self.assertEqual((message.payload['task'], message.payload['args']), (accept_payment.name, [1, '1:1']))
+        self.assertEqual(message.delivery_info['priority'], 6)
+
+
+class ThreadExecutorPriorityTestCase(TestCase):
+
+    def test_priority(self):
+        calls = []
+        release = threading.Event()
+        executor = tasks.ThreadExecutor(threads=1, queue_size=10)
+        try:
+            executor.submit(release.wait, (5,))
+            executor.submit(calls.append, ('retry',), priority=routing.get_priority(routing.RETRY))
+            executor.submit(calls.append, ('check',), priority=routing.get_priority(routing.CHECK))
+            executor.submit(calls.append, ('plain',))
+        finally:
+            release.set()
+            executor.shutdown(5)
+        self.assertEqual(calls, ['check', 'retry', 'plain'])
@@ -0,0 +1,92 @@
+# coding: utf8
+from django.core.cache import caches
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from getpaid import scheduler
+from getpaid.checks import check_scheduler_cache
+
+
+calls = []
+
+
+def status_check(payment_id, marker, reschedule=0):
+    with scheduler.check(payment_id):
+        calls.append((payment_id, marker))
+        # notifications arriving while the check is running
+        for i in range(reschedule):
+            scheduler.schedule(payment_id, status_check, 'repeat %d' % i)
+
+
+@override_settings(GETPAID_TASK_EXECUTOR='sync', GETPAID_SCHEDULER_CACHE='default')
+class SchedulerTestCase(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        del calls[:]
+
+    def tearDown(self):
+        caches['default'].clear()
+
+    def test_single_check(self):
+        self.assertTrue(scheduler.schedule(1, status_check, 'first'))
+        self.assertEqual(calls, [(1, 'first')])
+        self.assertIsNone(scheduler.get_state(1))
+
+    def test_coalesced_while_running(self):
+        scheduler.schedule(1, status_check, 'first', 3)
+        # one follow-up with the latest arguments
+        self.assertEqual(calls, [(1, 'first'), (1, 'repeat 2')])
+        self.assertIsNone(scheduler.get_state(1))
+
+    def test_coalesced_while_queued(self):
+        with mock.patch.object(scheduler, 'submit') as submit:
+            self.assertTrue(scheduler.schedule(1, status_check, 'first'))
+            self.assertFalse(scheduler.schedule(1, status_check, 'second'))
+            self.assertFalse(scheduler.schedule(1, status_check, 'third'))
+            self.assertTrue(scheduler.schedule(2, status_check, 'other'))
+        self.assertEqual(submit.call_count, 2)
+        self.assertEqual(scheduler.get_state(1), 'queued')
+
+        # queued check runs and submits one follow-up
+        status_check(1, 'first')
+        self.assertEqual(calls, [(1, 'first'), (1, 'third')])
+        self.assertIsNone(scheduler.get_state(1))
+
+    def test_released_on_error(self):
+        def failing_check(payment_id):
+            with scheduler.check(payment_id):
+                raise ValueError
+
+        with self.assertRaises(ValueError):
+            scheduler.schedule(1, failing_check)
+        self.assertIsNone(scheduler.get_state(1))
+
+    @override_settings(GETPAID_TASK_EXECUTOR='celery')
+    def test_celery_executor(self):
+        task = mock.Mock(name='task')
+        scheduler.schedule(1, task, 'x')
+        task.delay.assert_called_once_with(1, 'x')
+
+    @override_settings(GETPAID_SCHEDULER_CACHE=None)
+    def test_disabled(self):
+        with mock.patch.object(scheduler, 'submit') as submit:
+            self.assertTrue(scheduler.schedule(1, status_check, 'first'))
+            self.assertTrue(scheduler.schedule(1, status_check, 'second'))
+        self.assertEqual(submit.call_count, 2)
+        self.assertIsNone(scheduler.get_state(1))
+        status_check(1, 'first')
+        self.assertEqual(calls, [(1, 'first')])
+        self.assertEqual(caches['default'].get(scheduler.LOCK_PREFIX + '1'), None)
+
+    def test_unshared_cache_check(self):
+        self.assertEqual([error.id for error in check_scheduler_cache()], ['getpaid.E004'])
+        with override_settings(GETPAID_SCHEDULER_CACHE='shared', CACHES={
+                'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+                'shared': {'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache'}}):
+            self.assertEqual(check_scheduler_cache(), [])
+        with override_settings(GETPAID_SCHEDULER_CACHE='missing'):
+            self.assertEqual([error.id for error in check_scheduler_cache()], ['getpaid.E004'])
+        with override_settings(GETPAID_SCHEDULER_CACHE=None):
+            self.assertEqual(check_scheduler_cache(), [])
@@ -0,0 +1,256 @@
+# coding: utf8
+import os
+import shutil
+import tempfile
+import threading
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import IntegrityError, OperationalError
+from django.test import TestCase
+from django.test.utils import override_settings
+from django.utils import six
+import mock
+
+from getpaid import checks, events, spool
+from getpaid.backends.transferuj import PaymentProcessor
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+class SpoolTestCase(TestCase):
+
+    def setUp(self):
+        caches['default'].clear()
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'notifications.spool')
+        self.override = override_settings(GETPAID_NOTIFICATION_SPOOL=self.path,
+                                          GETPAID_DEDUP_STORE='getpaid.dedup.DatabaseDedupStore')
+        self.override.enable()
+        self.Payment = apps.get_model('getpaid', 'Payment')
+
+    def tearDown(self):
+        self.override.disable()
+        for key in list(spool._writers):
+            spool._writers.pop(key).close()
+        shutil.rmtree(self.directory)
+        caches['default'].clear()
+
+    def notification(self, payment, tr_paid='123.45', tr_status='TRUE'):
+        params = {'id': '1234', 'tr_id': 'tr-%s' % payment.pk, 'tr_amount': '123.45', 'tr_crc': six.text_type(payment.pk)}
+        key = PaymentProcessor.get_backend_config().key
+        return dict(params, md5sum=PaymentProcessor.compute_sig(params, PaymentProcessor._ONLINE_SIG_FIELDS, key),
+                    tr_date='', tr_paid=tr_paid, tr_desc='', tr_status=tr_status, tr_error='none', tr_email='')
+
+    def spool_payments(self, count):
+        payments = [PaymentFactory(amount='123.45', currency='PLN', backend='getpaid.backends.transferuj')
+                    for i in range(count)]
+        for payment in payments:
+            params = self.notification(payment)
+            params.pop('md5sum')
+            spool.append(PaymentProcessor.BACKEND, params)
+        return payments
+
+    def get_statuses(self, payments):
+        return [self.Payment.objects.get(pk=payment.pk).status for payment in payments]
+
+    def drain(self, batch_size=spool.DEFAULT_BATCH_SIZE):
+        drainer = spool.SpoolDrainer(batch_size=batch_size)
+        try:
+            return drainer.drain()
+        finally:
+            drainer.close()
+
+    def test_view_acknowledges_without_database(self):
+        payment = PaymentFactory(amount='123.45', currency='PLN', backend='getpaid.backends.transferuj')
+        with self.assertNumQueries(0):
+            response = self.client.post(reverse('getpaid-transferuj-online'), self.notification(payment),
+                                        REMOTE_ADDR='195.149.229.109')
+        self.assertEqual(response.content, b'TRUE')
+        self.assertEqual(self.get_statuses([payment]), ['new'])
+
+        data = self.notification(payment)
+        data['md5sum'] = 'xxx'
+        response = self.client.post(reverse('getpaid-transferuj-online'), data, REMOTE_ADDR='195.149.229.109')
+        self.assertEqual(response.content, b'SIG ERR')
+
+        self.assertEqual(self.drain(), 1)
+        self.assertEqual(self.get_statuses([payment]), ['paid'])
+        self.assertEqual(payment.events.filter(kind=events.NOTIFICATION).count(), 1)
+        # caught up, the spool is truncated
+        self.assertEqual(os.path.getsize(self.path), 0)
+        self.assertEqual(spool.read_offset(self.path), 0)
+
+    def test_batches(self):
+        payments = self.spool_payments(5)
+        with mock.patch.object(spool.SpoolDrainer, 'apply', autospec=True,
+                               side_effect=lambda drainer, batch: []) as apply:
+            self.assertEqual(self.drain(batch_size=2), 5)
+        self.assertEqual([len(call[0][1]) for call in apply.call_args_list], [2, 2, 1])
+        self.assertEqual(self.get_statuses(payments), ['new'] * 5)
+
+    def test_resume_after_crash(self):
+        payments = self.spool_payments(3)
+        apply = spool.SpoolDrainer.apply
+
+        def crash_on_second_batch(drainer, batch):
+            if batch[0]['params']['tr_crc'] == six.text_type(payments[1].pk):
+                raise KeyboardInterrupt
+            return apply(drainer, batch)
+
+        with mock.patch.object(spool.SpoolDrainer, 'apply', autospec=True, side_effect=crash_on_second_batch):
+            self.assertRaises(KeyboardInterrupt, self.drain, 1)
+        self.assertEqual(self.get_statuses(payments), ['paid', 'new', 'new'])
+        self.assertTrue(spool.read_offset(self.path) > 0)
+
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(self.get_statuses(payments), ['paid'] * 3)
+
+    def test_replayed_records(self):
+        payments = self.spool_payments(2)
+        with open(self.path, 'rb') as spool_file:
+            data = spool_file.read()
+        self.assertEqual(self.drain(), 2)
+        # e.g. a crash between applying a batch and saving its offset
+        with open(self.path, 'ab') as spool_file:
+            spool_file.write(data)
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(self.get_statuses(payments), ['paid'] * 2)
+        # every delivery is recorded, but it is applied once
+        self.assertEqual(payments[0].events.filter(kind=events.NOTIFICATION).count(), 2)
+        self.assertEqual(payments[0].events.filter(kind=events.STATUS).count(), 1)
+
+    def test_torn_and_damaged_records(self):
+        payments = self.spool_payments(3)
+        with open(self.path, 'r+b') as spool_file:
+            data = spool_file.read()
+            second = data.find(spool.MAGIC, 1)
+            spool_file.seek(second + spool.HEADER.size + 2)
+            spool_file.write(b'#')  # damaged payload of the second record
+            spool_file.seek(0, os.SEEK_END)
+            spool_file.write(spool.encode({'backend': PaymentProcessor.BACKEND, 'params': {}})[:-3])
+        size = os.path.getsize(self.path)
+
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(self.get_statuses(payments), ['paid', 'new', 'paid'])
+        # the torn record is left for its writer
+        self.assertEqual(os.path.getsize(self.path), size)
+        self.assertEqual(spool.read_offset(self.path), len(data))
+
+    def test_failed_records_are_set_aside(self):
+        payments = self.spool_payments(1)
+        spool.append('getpaid.backends.dummy', {'n': 1})
+        payments += self.spool_payments(1)
+        self.assertEqual(self.drain(), 2)
+        self.assertEqual(self.get_statuses(payments), ['paid'] * 2)
+        with open(self.path + '.failed', 'rb') as failed_file:
+            data = failed_file.read()
+        records = [record for record, offset in spool.iter_records(data, 0, len(data))]
+        self.assertEqual([(record['backend'], record['params']) for record in records],
+                         [('getpaid.backends.dummy', {'n': 1})])
+        self.assertIn('error', records[0])
+
+        drainer = spool.SpoolDrainer()
+        try:
+            self.assertEqual(drainer.requeue_failed(), 1)
+        finally:
+            drainer.close()
+        self.assertEqual(os.path.getsize(self.path + '.failed'), 0)
+        with open(self.path, 'rb') as spool_file:
+            data = spool_file.read()
+        records = [record for record, offset in spool.iter_records(data, 0, len(data))]
+        self.assertEqual([(record['backend'], record['params']) for record in records],
+                         [('getpaid.backends.dummy', {'n': 1})])
+        self.assertNotIn('error', records[0])
+
+    def test_database_error_keeps_offset(self):
+        payments = self.spool_payments(3)
+        apply_notification = PaymentProcessor.apply_notification
+
+        def fail_on_second(params):
+            if params['tr_crc'] == six.text_type(payments[1].pk):
+                raise OperationalError('server closed the connection unexpectedly')
+            return apply_notification(params)
+
+        with mock.patch.object(PaymentProcessor, 'apply_notification', side_effect=fail_on_second):
+            self.assertRaises(OperationalError, self.drain)
+        # the whole batch is rolled back, nothing is set aside
+        self.assertEqual(self.get_statuses(payments), ['new'] * 3)
+        self.assertEqual(spool.read_offset(self.path), 0)
+        self.assertFalse(os.path.exists(self.path + '.failed'))
+
+        self.assertEqual(self.drain(), 3)
+        self.assertEqual(self.get_statuses(payments), ['paid'] * 3)
+        self.assertEqual(payments[0].events.filter(kind=events.STATUS).count(), 1)
+
+    def test_permanent_database_error_is_set_aside(self):
+        payments = self.spool_payments(3)
+        apply_notification = PaymentProcessor.apply_notification
+
+        def fail_on_second(params):
+            if params['tr_crc'] == six.text_type(payments[1].pk):
+                self.Payment.objects.filter(pk=payments[1].pk).update(status='paid')
+                raise IntegrityError('duplicate key value violates unique constraint')
+            return apply_notification(params)
+
+        with mock.patch.object(PaymentProcessor, 'apply_notification', side_effect=fail_on_second):
+            self.assertEqual(self.drain(), 2)
+        # only the savepoint of the record is rolled back
+        self.assertEqual(self.get_statuses(payments), ['paid', 'new', 'paid'])
+        self.assertEqual(os.path.getsize(self.path), 0)
+        with open(self.path + '.failed', 'rb') as failed_file:
+            data = failed_file.read()
+        records = [record for record, offset in spool.iter_records(data, 0, len(data))]
+        self.assertEqual([record['params']['tr_crc'] for record in records], [six.text_type(payments[1].pk)])
+        self.assertIn('IntegrityError', records[0]['error'])
+
+    def test_run_recycles_connections(self):
+        self.spool_payments(1)
+        drainer = spool.SpoolDrainer()
+        try:
+            with mock.patch.object(spool, 'close_old_connections') as close_old_connections, \
+                    mock.patch.object(spool.SpoolDrainer, 'drain', autospec=True,
+                                      side_effect=[OperationalError('connection lost'), 1]) as drain, \
+                    mock.patch('time.sleep', side_effect=[None, KeyboardInterrupt]):
+                self.assertRaises(KeyboardInterrupt, drainer.run, 1)
+        finally:
+            drainer.close()
+        self.assertEqual(drain.call_count, 2)
+        self.assertEqual(close_old_connections.call_count, 2)
+
+    def test_cache_dedup_store(self):
+        with override_settings(GETPAID_DEDUP_STORE='getpaid.dedup.CacheDedupStore'):
+            self.assertRaises(ImproperlyConfigured, spool.SpoolDrainer)
+            self.assertEqual([error.id for error in checks.check_notification_spool()], ['getpaid.E003'])
+        with override_settings(GETPAID_DEDUP_STORE=None):
+            self.assertEqual(checks.check_notification_spool(), [])
+        self.assertEqual(checks.check_notification_spool(), [])
+
+    def test_concurrent_appends(self):
+        threads = [threading.Thread(target=spool.append, args=('getpaid.backends.dummy', {'n': i})) for i in range(20)]
+        with mock.patch('os.fsync', wraps=os.fsync) as fsync:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertTrue(1 <= fsync.call_count <= 20)
+        with open(self.path, 'rb') as spool_file:
+            data = spool_file.read()
+        records = [record for record, offset in spool.iter_records(data, 0, len(data))]
+        self.assertEqual(sorted(record['params']['n'] for record in records), list(range(20)))
+
+    def test_single_drainer(self):
+        drainer = spool.SpoolDrainer()
+        try:
+            self.assertRaises(RuntimeError, spool.SpoolDrainer)
+        finally:
+            drainer.close()
+
+    def test_command(self):
+        payments = self.spool_payments(2)
+        out = six.StringIO()
+        call_command('getpaid_drain_spool', batch_size=1, stdout=out)
+        self.assertIn('Applied 2 notifications', out.getvalue())
+        self.assertEqual(self.get_statuses(payments), ['paid'] * 2)
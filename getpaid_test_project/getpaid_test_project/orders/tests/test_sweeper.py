@@ -0,0 +1,130 @@
+# coding: utf8
+from datetime import timedelta
+
+from django.apps import apps
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.utils import six, timezone
+import mock
+
+from getpaid import aggregates, events, routing, signals, sweeper, tasks, transport
+from getpaid_test_project.orders.tests.utils import (FakeEserviceTransport, create_payment, eservice_settings,
+                                                     payu_settings)
+
+
+class SweeperTestCase(TestCase):
+
+    def setUp(self):
+        self.Payment = apps.get_model('getpaid', 'Payment')
+
+    def create_payment(self, status, age=timedelta(days=2), backend='getpaid.backends.payu', **kwargs):
+        return create_payment(status=status, backend=backend, age=age, **kwargs)
+
+    def get_status(self, payment):
+        return self.Payment.objects.get(pk=payment.pk).status
+
+    def test_policy(self):
+        # nothing is swept unless enabled for the backend
+        self.assertIsNone(sweeper.get_policy('getpaid.backends.payu'))
+        with eservice_settings():
+            self.assertIsNone(sweeper.get_policy('getpaid.backends.eservice'))
+        with payu_settings(stale_policy='cancel', stale_after=60):
+            self.assertEqual(sweeper.get_policy('getpaid.backends.payu'), sweeper.CANCEL)
+            self.assertEqual(sweeper.get_stale_after('getpaid.backends.payu'), timedelta(minutes=1))
+        with payu_settings(stale_policy='check'):
+            self.assertRaises(ImproperlyConfigured, sweeper.get_policy, 'getpaid.backends.payu')
+
+    def test_stale_batches(self):
+        payments = [self.create_payment('new', age=timedelta(days=2, minutes=i)) for i in range(5)]
+        self.create_payment('new', age=timedelta(hours=1))
+        self.create_payment('in_progress')
+        self.create_payment('new', backend='getpaid.backends.dummy')
+
+        batches = list(sweeper.iter_stale_batches('getpaid.backends.payu', 'new', timezone.now() - timedelta(days=1), 2))
+        self.assertEqual(batches, [[payments[4].pk, payments[3].pk], [payments[2].pk, payments[1].pk],
+                                   [payments[0].pk]])
+
+    @override_settings(GETPAID_DAILY_AGGREGATES=True)
+    def test_cancel(self):
+        stale = [self.create_payment('new') for i in range(3)] + [self.create_payment('in_progress')]
+        fresh = self.create_payment('new', age=timedelta(hours=1))
+        paid = self.create_payment('paid')
+        changed, batches = [], []
+
+        def listener(sender, instance, old_status, new_status, **kwargs):
+            changed.append((instance.pk, old_status, new_status))
+
+        def bulk_listener(sender, payments, old_statuses, new_status, **kwargs):
+            batches.append(sorted(payment.pk for payment in payments))
+
+        aggregates.rebuild()  # payments were backdated
+        signals.payment_status_changed.connect(listener)
+        signals.payment_statuses_changed.connect(bulk_listener)
+        try:
+            with CaptureQueriesContext(connection) as queries, payu_settings(stale_policy='cancel'):
+                summary = sweeper.sweep(backends=['getpaid.backends.payu'], batch_size=3)
+        finally:
+            signals.payment_status_changed.disconnect(listener)
+            signals.payment_statuses_changed.disconnect(bulk_listener)
+
+        self.assertEqual(dict(summary.counts['getpaid.backends.payu']), {'cancelled': 4})
+        self.assertEqual([self.get_status(payment) for payment in stale], ['cancelled'] * 4)
+        self.assertEqual(self.get_status(fresh), 'new')
+        self.assertEqual(self.get_status(paid), 'paid')
+        self.assertEqual(sorted(changed), sorted([(payment.pk, payment.status, 'cancelled') for payment in stale]))
+        self.assertEqual(batches, [sorted(payment.pk for payment in stale[:3]), [stale[3].pk]])
+        # one UPDATE per batch
+        self.assertEqual(len([query for query in queries.captured_queries
+                              if 'UPDATE "getpaid_payment" SET' in query['sql']]), 2)
+        self.assertEqual(self.Payment.objects.get(pk=paid.pk).events.count(), 0)
+        self.assertEqual(stale[0].events.get(kind=events.STATUS).new_status, 'cancelled')
+
+        day = aggregates.get_day(timezone.now() - timedelta(days=2))
+        self.assertEqual(aggregates.get_totals(day, day, status='cancelled')['count'], 4)
+        self.assertEqual(aggregates.get_totals(day, day, status='new')['count'], 0)
+        self.assertEqual(aggregates.get_totals(status='new')['count'], 1)
+
+    def test_changed_meanwhile(self):
+        payment = self.create_payment('new')
+        self.assertEqual(sweeper.cancel([payment.pk], 'in_progress'), 0)
+        self.assertEqual(self.get_status(payment), 'new')
+
+    @override_settings(GETPAID_TASK_EXECUTOR='sync')
+    def test_check(self):
+        caches['default'].clear()
+        with eservice_settings(stale_policy='check'):
+            transport._transport['instance'] = fake_transport = FakeEserviceTransport()
+            fake_transport.statuses = {'ext-paid': 'C', 'ext-pending': None}
+            paid = self.create_payment('in_progress', backend='getpaid.backends.eservice', external_id='ext-paid')
+            pending = self.create_payment('new', backend='getpaid.backends.eservice', external_id='ext-pending')
+            with mock.patch('getpaid.tasks.submit', wraps=tasks.submit) as submit:
+                summary = sweeper.sweep(backends=['getpaid.backends.eservice'])
+        caches['default'].clear()
+        self.assertEqual(dict(summary.counts['getpaid.backends.eservice']), {'checked': 2})
+        self.assertEqual(self.get_status(paid), 'paid')
+        self.assertEqual(self.get_status(pending), 'new')
+        self.assertEqual(len(fake_transport.requests), 2)
+        # routed like retries of the backend, behind fresh checks
+        self.assertEqual(submit.call_args[1]['priority'], routing.get_priority(routing.RETRY))
+        with override_settings(GETPAID_TASK_QUEUES=True):
+            self.assertEqual(sweeper.check_payment_status.get_options(), {'priority': 3})
+            self.assertEqual(routing.get_options('getpaid.backends.eservice', routing.RETRY)['queue'],
+                             'getpaid.eservice.retry')
+
+    def test_command(self):
+        payment = self.create_payment('new')
+        sweeper.sweep_stale_payments()
+        self.assertEqual(self.get_status(payment), 'new')
+
+        with payu_settings(stale_policy='cancel'):
+            out = six.StringIO()
+            call_command('getpaid_sweep', backends=['getpaid.backends.payu'], dry_run=True, stdout=out)
+            self.assertIn('getpaid.backends.payu: stale=1', out.getvalue())
+            self.assertEqual(self.get_status(payment), 'new')
+
+            sweeper.sweep_stale_payments()
+        self.assertEqual(self.get_status(payment), 'cancelled')
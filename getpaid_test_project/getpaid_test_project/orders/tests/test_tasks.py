@@ -0,0 +1,155 @@
+# coding: utf8
+import threading
+
+from django.test import TestCase
+from django.test.utils import override_settings
+import mock
+
+from getpaid import tasks
+
+
+calls = []
+
+
+@tasks.task
+def add_call(value):
+    calls.append(value)
+
+
+@tasks.task(bind=True, max_retries=3)
+def flaky(self, succeed_after):
+    calls.append(self.request.retries)
+    if self.request.retries < succeed_after:
+        raise self.retry(exc=ValueError('not yet'), countdown=0.01)
+
+
+class TaskTestCase(TestCase):
+
+    def setUp(self):
+        del calls[:]
+
+    def test_declaration(self):
+        self.assertEqual(add_call.name, 'getpaid_test_project.orders.tests.test_tasks.add_call')
+        self.assertEqual(add_call.celery_task.name, add_call.name)
+        self.assertEqual(flaky.max_retries, 3)
+
+    def test_direct_call(self):
+        add_call(1)
+        self.assertEqual(calls, [1])
+        self.assertTrue(flaky.request.called_directly)
+        with self.assertRaises(tasks.Retry):
+            flaky(1)
+
+    def test_max_retries(self):
+        with self.assertRaises(ValueError):
+            flaky.run((5,), retries=3)
+        self.assertEqual(calls, [3])
+
+    @override_settings(GETPAID_TASK_EXECUTOR='sync')
+    def test_sync_executor(self):
+        flaky.delay(2)
+        self.assertEqual(calls, [0, 1, 2])
+        add_call.apply_async((1,), countdown=10)
+        self.assertEqual(calls[-1], 1)
+
+    @override_settings(GETPAID_TASK_EXECUTOR='celery')
+    def test_celery_executor(self):
+        # test project runs celery tasks eagerly
+        add_call.delay(1)
+        flaky.delay(0)
+        self.assertEqual(calls, [1, 0])
+
+    def test_retry_state(self):
+        state = {tasks.RETRY_STATE_KWARG: {'first_attempt': 1}}
+
+        @tasks.task(bind=True)
+        def record_request(self, value):
+            calls.append((value, self.request.kwargs))
+
+        record_request.run((1,), state)
+        # celery tasks get it in the request too, the function never does
+        add_call.celery_task(2, **state)
+        self.assertEqual(calls, [(1, state), 2])
+
+        @tasks.task(bind=True, max_retries=1)
+        def retried(self):
+            calls.append(self.request.kwargs)
+            if not self.request.retries:
+                raise self.retry(kwargs=state)
+
+        del calls[:]
+        with override_settings(GETPAID_TASK_EXECUTOR='sync'):
+            retried.delay()
+        self.assertEqual(calls, [{}, state])
+
+    def test_scheduler_executor_setting(self):
+        with override_settings(GETPAID_SCHEDULER_EXECUTOR='sync'):
+            self.assertIsInstance(tasks.get_executor(), tasks.SyncExecutor)
+        with override_settings(GETPAID_SCHEDULER_EXECUTOR='thread', GETPAID_TASK_EXECUTOR='sync'):
+            self.assertIsInstance(tasks.get_executor(), tasks.SyncExecutor)
+
+
+class ThreadExecutorTestCase(TestCase):
+
+    def setUp(self):
+        del calls[:]
+        self.executor = tasks.ThreadExecutor(threads=2, queue_size=10)
+
+    def tearDown(self):
+        self.executor.shutdown(5)
+
+    def test_shutdown_finishes_queued_tasks(self):
+        for i in range(10):
+            self.executor.submit(add_call, (i,))
+        self.executor.shutdown(5)
+        self.assertEqual(sorted(calls), list(range(10)))
+        self.assertFalse(any(thread.is_alive() for thread in self.executor.threads))
+
+    def test_retry(self):
+        self.executor.submit(flaky, (2,))
+        for i in range(100):
+            if len(calls) == 3:
+                break
+            threading.Event().wait(0.05)
+        self.assertEqual(calls, [0, 1, 2])
+
+    def test_full_queue_runs_in_caller(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def block():
+            started.set()
+            release.wait(5)
+
+        executor = tasks.ThreadExecutor(threads=1, queue_size=1)
+        try:
+            executor.submit(block, ())
+            # the worker has taken the blocking task, so the next one fills the queue
+            self.assertTrue(started.wait(5))
+            executor.submit(add_call, ('queued',))
+            executor.submit(add_call, ('caller',))
+            self.assertIn('caller', calls)
+        finally:
+            release.set()
+            executor.shutdown(5)
+        self.assertEqual(sorted(calls), ['caller', 'queued'])
+
+    def test_database_connections_closed(self):
+        with mock.patch('getpaid.tasks.close_old_connections') as close_old_connections, \
+                mock.patch('getpaid.tasks._close_connections') as close_connections:
+            executor = tasks.ThreadExecutor(threads=2, queue_size=10)
+            for i in range(3):
+                executor.submit(add_call, (i,))
+            executor.shutdown(5)
+        # before and after each task, all connections of a worker when it stops
+        self.assertEqual(close_old_connections.call_count, 6)
+        self.assertEqual(close_connections.call_count, 2)
+
+    def test_retries_dropped_after_shutdown(self):
+        self.executor.submit(add_call, (1,), countdown=60)
+        self.assertEqual(len(self.executor.timers), 1)
+        self.executor.shutdown(5)
+        self.assertEqual(self.executor.timers, set())
+        self.executor.submit(add_call, (2,), countdown=1)
+        self.executor.submit(add_call, (3,))
+        self.assertEqual(calls, [3])
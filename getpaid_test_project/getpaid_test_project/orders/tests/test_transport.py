@@ -0,0 +1,68 @@
+# coding: utf8
+import mock
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from getpaid import transport
+
+
+class RequestsTransportTestCase(TestCase):
+
+    def setUp(self):
+        self.transport = transport.RequestsTransport()
+
+    def tearDown(self):
+        self.transport.close()
+
+    def test_session_per_backend_and_host(self):
+        session = self.transport.get_session('getpaid.backends.payu', 'https://www.platnosci.pl/paygw/UTF/Payment/get/txt')
+        self.assertIs(session, self.transport.get_session('getpaid.backends.payu',
+                                                          'https://www.platnosci.pl/paygw/UTF/Payment/confirm/txt'))
+        self.assertIsNot(session, self.transport.get_session('getpaid.backends.payu', 'https://example.com/'))
+        self.assertIsNot(session, self.transport.get_session('getpaid.backends.przelewy24',
+                                                             'https://www.platnosci.pl/paygw/UTF/Payment/get/txt'))
+
+    @override_settings(GETPAID_BACKENDS_SETTINGS={
+        'getpaid.backends.payu': {
+            'pos_id': 123456789, 'key1': 'xxx', 'key2': 'xxx', 'pos_auth_key': 'xxx',
+            'http_connect_timeout': 1, 'http_read_timeout': 7, 'http_retries': 4,
+        },
+    })
+    def test_backend_options(self):
+        session = self.transport.get_session('getpaid.backends.payu', 'https://www.platnosci.pl/')
+        self.assertEqual(session.get_adapter('https://www.platnosci.pl/').max_retries.total, 4)
+
+        response = mock.Mock(status_code=200, content=b'status:OK', encoding=None)
+        with mock.patch.object(session, 'request', return_value=response) as request:
+            result = self.transport.request('getpaid.backends.payu', 'POST', 'https://www.platnosci.pl/', data={'a': 1})
+        self.assertEqual(request.call_args[1]['timeout'], (1, 7))
+        self.assertEqual(result.text, u'status:OK')
+
+    def test_error_status(self):
+        session = self.transport.get_session('getpaid.backends.payu', 'https://www.platnosci.pl/')
+        response = mock.Mock(status_code=503, content=b'', encoding=None)
+        with mock.patch.object(session, 'request', return_value=response):
+            with self.assertRaises(transport.TransportError) as cm:
+                self.transport.request('getpaid.backends.payu', 'POST', 'https://www.platnosci.pl/')
+        self.assertEqual(cm.exception.status_code, 503)
+
+
+class FakeTransportTestCase(TestCase):
+
+    @override_settings(GETPAID_TRANSPORT='getpaid.transport.FakeTransport')
+    def test_fake_transport(self):
+        fake_transport = transport.get_transport()
+        self.assertIsInstance(fake_transport, transport.FakeTransport)
+        fake_transport.add_response('https://example.com/', u'first')
+        fake_transport.add_response('https://example.com/', u'second')
+
+        self.assertEqual(transport.post('getpaid.backends.dummy', 'https://example.com/').text, u'first')
+        self.assertEqual(transport.post('getpaid.backends.dummy', 'https://example.com/').text, u'second')
+        self.assertEqual(transport.get('getpaid.backends.dummy', 'https://example.com/').text, u'second')
+        self.assertEqual([r.method for r in fake_transport.requests], ['POST', 'POST', 'GET'])
+        with self.assertRaises(transport.TransportError):
+            transport.post('getpaid.backends.dummy', 'https://example.com/other')
+
+    def test_default_transport(self):
+        self.assertIsInstance(transport.get_transport(), transport.RequestsTransport)
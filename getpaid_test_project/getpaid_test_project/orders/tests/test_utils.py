@@ -1,14 +1,29 @@
 # coding: utf8
+import os
+import subprocess
+import sys
+
 from mock import patch
 
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.urlresolvers import NoReverseMatch, RegexURLResolver, set_script_prefix
 from django.test import TestCase
 from django.test.utils import override_settings
+from django.utils import six
 
 from getpaid import utils
+from getpaid.checks import check_backends_settings
+from getpaid_test_project.orders.factories import PaymentFactory
 
 
 class UtilsTestCase(TestCase):
 
+    def setUp(self):
+        utils.clear_url_cache()
+
     @override_settings(GETPAID_SITE_DOMAIN='example1.com')
     def test_get_domain_getpaid_const(self):
         self.assertEquals('example1.com', utils.get_domain())
@@ -76,3 +91,198 @@ class UtilsTestCase(TestCase):
         url = utils.build_absolute_uri('test', domain='domain', scheme='ftp')
 
         self.assertEquals(url, 'ftp://domain/path')
+
+    @override_settings(GETPAID_SITE_DOMAIN=None)
+    def test_get_domain_cached(self):
+        from django.contrib.sites.models import Site
+        site = Site.objects.get_current()
+        with patch.object(utils, 'Site', wraps=Site) as patch_site:
+            self.assertEquals(utils.get_domain(), site.domain)
+            self.assertEquals(utils.get_domain(), site.domain)
+            self.assertEquals(patch_site.objects.get_current.call_count, 1)
+
+            site.domain = 'changed.example.com'
+            site.save()
+            self.assertEquals(utils.get_domain(), 'changed.example.com')
+            self.assertEquals(patch_site.objects.get_current.call_count, 2)
+
+    def test_build_absolute_url_template_cached(self):
+        with patch.object(utils, 'reverse', wraps=utils.reverse) as patch_reverse:
+            url1 = utils.build_absolute_uri('getpaid-transferuj-success', scheme='http', domain='example.com',
+                                            reverse_kwargs={'pk': 1})
+            url2 = utils.build_absolute_uri('getpaid-transferuj-success', scheme='http', domain='example.com',
+                                            reverse_kwargs={'pk': 22})
+        self.assertEquals(url1, 'http://example.com/getpaid.backends.transferuj/success/1/')
+        self.assertEquals(url2, 'http://example.com/getpaid.backends.transferuj/success/22/')
+        self.assertEquals(patch_reverse.call_count, 1)
+
+    def test_build_absolute_url_template_multiple_kwargs(self):
+        url = utils.build_absolute_uri('getpaid-payu-failure', domain='example.com',
+                                       reverse_kwargs={'pk': 5, 'error': 501})
+        self.assertEquals(url, 'https://example.com/getpaid.backends.payu/failure/5/501/')
+
+    def test_build_absolute_url_template_not_integer_kwargs(self):
+        utils.build_absolute_uri('getpaid-payu-failure', domain='example.com', reverse_kwargs={'pk': 5, 'error': 501})
+        with patch.object(utils, 'reverse', wraps=utils.reverse) as patch_reverse:
+            self.assertRaises(NoReverseMatch, utils.build_absolute_uri, 'getpaid-payu-failure', domain='example.com',
+                              reverse_kwargs={'pk': 'a/b', 'error': 501})
+            url = utils.build_absolute_uri('getpaid-payu-failure', domain='example.com',
+                                           reverse_kwargs={'pk': '5', 'error': 501})
+        self.assertEquals(url, 'https://example.com/getpaid.backends.payu/failure/5/501/')
+        self.assertEquals(patch_reverse.call_count, 2)
+
+    def test_build_absolute_url_template_script_prefix(self):
+        url1 = utils.build_absolute_uri('getpaid-payu-failure', domain='example.com',
+                                        reverse_kwargs={'pk': 5, 'error': 501})
+        set_script_prefix('/shop/')
+        try:
+            url2 = utils.build_absolute_uri('getpaid-payu-failure', domain='example.com',
+                                            reverse_kwargs={'pk': 5, 'error': 501})
+        finally:
+            set_script_prefix('/')
+        self.assertEquals(url1, 'https://example.com/getpaid.backends.payu/failure/5/501/')
+        self.assertEquals(url2, 'https://example.com/shop/getpaid.backends.payu/failure/5/501/')
+
+
+class BackendConfigTestCase(TestCase):
+
+    def test_defaults_applied(self):
+        config = utils.get_backend_config('getpaid.backends.payu')
+        self.assertEquals(config.pos_id, 123456789)
+        self.assertEquals(config.method, 'get')
+        self.assertTrue(config.signing)
+
+    def test_missing_required_setting(self):
+        with self.settings(GETPAID_BACKENDS_SETTINGS={}):
+            config = utils.get_backend_config('getpaid.backends.payu')
+            self.assertEquals(config.missing(), ['pos_id', 'key1', 'key2', 'pos_auth_key'])
+            with self.assertRaises(ImproperlyConfigured):
+                config.pos_id
+
+    def test_read_only(self):
+        config = utils.get_backend_config('getpaid.backends.payu')
+        with self.assertRaises(AttributeError):
+            config.pos_id = 1
+
+    def test_rebuilt_on_setting_changed(self):
+        config = utils.get_backend_config('getpaid.backends.transferuj')
+        self.assertIs(config, utils.get_backend_config('getpaid.backends.transferuj'))
+        with self.settings(GETPAID_BACKENDS_SETTINGS={'getpaid.backends.transferuj': {'id': 1, 'key': 'k',
+                                                                                      'method': 'post'}}):
+            self.assertEquals(utils.get_backend_config('getpaid.backends.transferuj').method, 'post')
+        self.assertEquals(utils.get_backend_config('getpaid.backends.transferuj').method, config.method)
+
+    def test_system_check(self):
+        self.assertEquals(check_backends_settings(), [])
+        with self.settings(GETPAID_BACKENDS=('getpaid.backends.payu', 'getpaid.backends.nonexisting'),
+                           GETPAID_BACKENDS_SETTINGS={'getpaid.backends.payu': {'pos_id': 1, 'key1': 'x',
+                                                                                'key2': 'x'}}):
+            errors = check_backends_settings()
+        self.assertEquals([e.id for e in errors], ['getpaid.E002', 'getpaid.E001'])
+
+
+class BackendsRegistryTestCase(TestCase):
+
+    def test_choices_by_currency(self):
+        self.assertEquals([b for b, name in utils.get_backend_choices('PLN')],
+                          ['getpaid.backends.dummy', 'getpaid.backends.payu', 'getpaid.backends.transferuj',
+                           'getpaid.backends.przelewy24', 'getpaid.backends.epaydk'])
+        self.assertEquals([b for b, name in utils.get_backend_choices('DKK')], ['getpaid.backends.epaydk'])
+        self.assertEquals(utils.get_backend_choices('XXX'), [])
+        self.assertEquals(len(utils.get_backend_choices()), 5)
+
+    def test_no_imports_per_call(self):
+        utils.get_backends_registry()
+        with patch.object(utils, 'import_name') as patch_import_name:
+            utils.get_backend_choices('PLN')
+            utils.get_backends_registry().get_logo_url('getpaid.backends.payu')
+        self.assertFalse(patch_import_name.called)
+
+    def test_logo_url(self):
+        self.assertEquals(utils.get_backends_registry().get_logo_url('getpaid.backends.payu'),
+                          'getpaid/backends/payu/payu_logo.png')
+        self.assertEquals(utils.get_backends_registry().get_logo_url('getpaid.backends.dummy'), None)
+
+    def test_rebuilt_on_setting_changed(self):
+        with self.settings(GETPAID_BACKENDS=('getpaid.backends.dummy',)):
+            self.assertEquals(utils.get_backend_choices('PLN'), [('getpaid.backends.dummy', 'Dummy backend')])
+        self.assertEquals(len(utils.get_backend_choices('PLN')), 5)
+
+
+def order_description(payment, order):
+    return u'Order #%s' % order.pk
+
+
+class OrderDescriptionTestCase(TestCase):
+
+    def setUp(self):
+        from getpaid.backends.dummy import PaymentProcessor
+        self.payment = PaymentFactory()
+        self.processor = PaymentProcessor(self.payment)
+
+    @override_settings(GETPAID_ORDER_DESCRIPTION=None, GETPAID_ORDER_DESCRIPTION_FUNC=None)
+    def test_default(self):
+        self.assertEquals(self.processor.get_order_description(self.payment, self.payment.order),
+                          six.text_type(self.payment.order))
+
+    @override_settings(GETPAID_ORDER_DESCRIPTION='{{ order.name }} {{ payment.currency }}')
+    def test_template_compiled_once(self):
+        with patch.object(utils, 'Template', wraps=utils.Template) as patch_template:
+            for i in range(3):
+                description = self.processor.get_order_description(self.payment, self.payment.order)
+        self.assertEquals(description, u'%s PLN' % self.payment.order.name)
+        self.assertEquals(patch_template.call_count, 1)
+
+        with self.settings(GETPAID_ORDER_DESCRIPTION='{{ order.pk }}'):
+            self.assertEquals(self.processor.get_order_description(self.payment, self.payment.order),
+                              six.text_type(self.payment.order.pk))
+
+    @override_settings(GETPAID_ORDER_DESCRIPTION='{{ order.name }}',
+                       GETPAID_ORDER_DESCRIPTION_FUNC='getpaid_test_project.orders.tests.test_utils.order_description')
+    def test_func(self):
+        self.assertEquals(self.processor.get_order_description(self.payment, self.payment.order),
+                          u'Order #%s' % self.payment.order.pk)
+
+
+class LazyBackendLoadingTestCase(TestCase):
+
+    def test_backend_urls_are_included_by_dotted_path(self):
+        from getpaid import urls
+
+        urlconf_names = [pattern.urlconf_name for pattern in urls.urlpatterns
+                         if isinstance(pattern, RegexURLResolver)]
+        self.assertEqual(urlconf_names, ['%s.urls' % backend for backend in settings.GETPAID_BACKENDS])
+        self.assertTrue(all(isinstance(name, str) for name in urlconf_names))
+
+    def test_backend_views_imported_on_resolve(self):
+        # views of other tests are imported already, so it is checked in a fresh interpreter
+        code = '\n'.join([
+            'import sys, django',
+            'django.setup()',
+            'from django.core.urlresolvers import resolve',
+            'import getpaid.urls',
+            'views = lambda: sorted(name for name in sys.modules if name.startswith("getpaid.backends.") and '
+            'name.endswith(".views") and sys.modules[name] is not None)',
+            'print(views())',
+            'resolve("/getpaid.backends.transferuj/online/", "getpaid.urls")',
+            'print(views())',
+        ])
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=settings.SETTINGS_MODULE, PYTHONPATH=os.pathsep.join(sys.path))
+        output = subprocess.check_output([sys.executable, '-c', code], env=env).decode('utf-8').splitlines()
+        self.assertEqual(output[-2:], ["[]", "['getpaid.backends.transferuj.views']"])
+
+    def test_import_profile_command(self):
+        out = six.StringIO()
+        call_command('getpaid_import_profile', backends=['getpaid.backends.dummy'], stdout=out)
+        rows = dict((line.split()[0], line.split()[1]) for line in out.getvalue().splitlines()[1:])
+        # measured in a child process, not preloaded by django.setup() of this one
+        self.assertEqual(rows, {
+            'getpaid.backends.dummy': 'imported',
+            'getpaid.backends.dummy.models': 'imported',
+            'getpaid.backends.dummy.views': 'imported',
+            'getpaid.backends.dummy.urls': 'imported',
+        })
+
+    def test_import_profile_command_unknown_backend(self):
+        with self.assertRaises(CommandError):
+            call_command('getpaid_import_profile', backends=['getpaid.backends.unknown'], stdout=six.StringIO())
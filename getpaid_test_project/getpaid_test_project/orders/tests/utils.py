@@ -0,0 +1,77 @@
+# coding: utf8
+"""
+Helpers shared by test modules.
+"""
+from django.apps import apps
+from django.conf import settings
+from django.test.utils import override_settings
+from django.utils import timezone
+
+from getpaid import transport
+from getpaid_test_project.orders.factories import PaymentFactory
+
+
+ESERVICE_STATUS_RESPONSE = u"""<?xml version="1.0" encoding="UTF-8"?>
+<CC5Response><Extra><PROC_RET_CD>00</PROC_RET_CD><TRANS_STAT>%s</TRANS_STAT></Extra></CC5Response>"""
+
+ESERVICE_PENDING_RESPONSE = u"""<?xml version="1.0" encoding="UTF-8"?>
+<CC5Response><Extra><PROC_RET_CD>99</PROC_RET_CD></Extra></CC5Response>"""
+
+
+def backend_settings(backend, **values):
+    """
+    Overrides ``values`` in ``GETPAID_BACKENDS_SETTINGS`` of ``backend``.
+    """
+    backends_settings = dict(settings.GETPAID_BACKENDS_SETTINGS)
+    backends_settings[backend] = dict(backends_settings.get(backend, {}), **values)
+    return override_settings(GETPAID_BACKENDS_SETTINGS=backends_settings)
+
+
+def payu_settings(**values):
+    return backend_settings('getpaid.backends.payu', **values)
+
+
+def create_payment(age=None, created_on=None, **kwargs):
+    """
+    Creates a payment with ``PaymentFactory`` and backdates it to ``created_on`` or by ``age``.
+    """
+    payment = PaymentFactory(**kwargs)
+    if created_on is None:
+        created_on = timezone.now() - age
+    apps.get_model('getpaid', 'Payment').objects.filter(pk=payment.pk).update(created_on=created_on)
+    payment.created_on = created_on
+    return payment
+
+
+def eservice_settings(**values):
+    backends_settings = dict(settings.GETPAID_BACKENDS_SETTINGS)
+    backends_settings['getpaid.backends.eservice'] = dict({
+        'client_id': '1234',
+        'password': 'xxx',
+        'store_type': '3d_pay_hosting',
+        'api_user': 'api',
+        'api_password': 'xxx',
+        'pending_url': 'https://example.com/pending/',
+        'test': True,
+    }, **values)
+    return override_settings(
+        GETPAID_BACKENDS=tuple(settings.GETPAID_BACKENDS) + ('getpaid.backends.eservice',),
+        GETPAID_BACKENDS_SETTINGS=backends_settings,
+        GETPAID_TRANSPORT='getpaid.transport.FakeTransport',
+    )
+
+
+class FakeEserviceTransport(transport.FakeTransport):
+    """
+    Answers eService status queries with statuses of ``self.statuses`` by order id.
+    """
+
+    statuses = {}
+
+    def request(self, backend, method, url, data=None, headers=None, auth=None):
+        self.requests.append(transport.FakeRequest(backend, method, url, data, headers, auth))
+        for order_id, status in self.statuses.items():
+            if ('<OrderId>%s</OrderId>' % order_id).encode('utf-8') in data:
+                content = ESERVICE_STATUS_RESPONSE % status if status else ESERVICE_PENDING_RESPONSE
+                return transport.TransportResponse(200, content.encode('utf-8'))
+        raise transport.TransportError('Unknown order')
@@ -2,6 +2,7 @@
 from django.views.generic import CreateView
 from django.views.generic.detail import DetailView
 from getpaid.forms import PaymentMethodForm
+from getpaid.replicas import ReadReplicaMixin
 from getpaid_test_project.orders.forms import OrderForm
 from getpaid_test_project.orders.models import Order
 
@@ -16,7 +17,7 @@ class HomeView(CreateView):
         return context
 
 
-class OrderView(DetailView):
+class OrderView(ReadReplicaMixin, DetailView):
     model=Order
 
     def get_context_data(self, **kwargs):